@@ -10,26 +10,46 @@ Client = (function() {
     this.requests = {};
   }
 
-  "connect: Establishes a websocket connection to the server.\n\nTakes two callback parameters.\nonSocketOpen: onSocketOpen() is called when socket connection has been established.\nonMessage: onMessage(json) is called with json response from server. The json consists of the following mandatory fields:\n  - result: Fx. \"OK\" or \"BOARD_NOT_RECOGNIZED\"\n  - action: Action which message is a reply to, fx. \"reset\" or \"initializeBoard\"\n  - payload: The actual payload. Varies from response to response.\n  - requestId: Unique request id for which this is a response to.";
+  "connect: Establishes a websocket connection to the server.\n\nTakes two callback parameters.\nonSocketOpen: onSocketOpen() is called when socket connection has been established.\nonMessage: onMessage(json) is called with json response from server. The json consists of the following mandatory fields:\n  - result: Fx. \"OK\" or \"BOARD_NOT_RECOGNIZED\"\n  - action: Action which message is a reply to, fx. \"reset\" or \"initializeBoard\"\n  - payload: The actual payload. Varies from response to response.\n  - requestId: Unique request id for which this is a response to.\nbinaryProtocol: (Optional) If true, the server sends brick and marker updates in a compact binary format. They are decoded before onMessage is called.\nbatchUpdates: (Optional) If true, the server sends all updates from the same camera image in a single message. They are unpacked before onMessage is called.";
 
-  Client.prototype.connect = function(onSocketOpen, onMessage) {
+  Client.prototype.connect = function(onSocketOpen, onMessage, binaryProtocol, batchUpdates) {
+    if (binaryProtocol == null) {
+      binaryProtocol = false;
+    }
+    if (batchUpdates == null) {
+      batchUpdates = false;
+    }
     this.disconnect();
     this.socket = new WebSocket("ws://localhost:" + this.port + "/");
+    this.socket.binaryType = "arraybuffer";
     this.socket.onopen = (function(_this) {
       return function(event) {
-        return onSocketOpen();
+        if (binaryProtocol || batchUpdates) {
+          return _this.setProtocol(binaryProtocol, batchUpdates, function(action, payload) {
+            return onSocketOpen();
+          });
+        } else {
+          return onSocketOpen();
+        }
       };
     })(this);
     return this.socket.onmessage = (function(_this) {
       return function(event) {
-        var json;
-        json = JSON.parse(event.data);
-        _this.performCompletionCallbackForRequest(json);
-        onMessage(json);
-        if (_this.debug_textField != null) {
-          _this.debug_log.splice(0, 0, JSON.stringify(json));
-          return _this.debug_textField.text = _this.debug_log.slice(0, 6).join("<br/>");
+        var json, _i, _len, _ref, _results;
+        _ref = _this.decodeMessages(event.data);
+        _results = [];
+        for (_i = 0, _len = _ref.length; _i < _len; _i++) {
+          json = _ref[_i];
+          _this.performCompletionCallbackForRequest(json);
+          onMessage(json);
+          if (_this.debug_textField != null) {
+            _this.debug_log.splice(0, 0, JSON.stringify(json));
+            _results.push(_this.debug_textField.text = _this.debug_log.slice(0, 6).join("<br/>"));
+          } else {
+            _results.push(void 0);
+          }
         }
+        return _results;
       };
     })(this);
   };
@@ -43,6 +63,27 @@ Client = (function() {
     }
   };
 
+  "setProtocol: Sets the message protocol used by the server for this connection. Is called by connect.\n\nbinaryProtocol: (Optional) If true, the server sends brick and marker updates in a compact binary format.\nbatchUpdates: (Optional) If true, the server sends all updates from the same camera image in a single message.\ncompletionCallback: (Optional) completionCallback(action, payload) is called when receiving a respond to the request.";
+
+  Client.prototype.setProtocol = function(binaryProtocol, batchUpdates, completionCallback) {
+    var requestId;
+    if (binaryProtocol == null) {
+      binaryProtocol = false;
+    }
+    if (batchUpdates == null) {
+      batchUpdates = false;
+    }
+    if (completionCallback == null) {
+      completionCallback = void 0;
+    }
+    requestId = this.addCompletionCallback(completionCallback);
+    return this.sendMessage("setProtocol", {
+      "requestId": requestId,
+      "binary": binaryProtocol,
+      "batchUpdates": batchUpdates
+    });
+  };
+
   "enableDebug: Enables server debug.\n\ncompletionCallback: (Optional) completionCallback(action, payload) is called when receiving a respond to the request.";
 
   Client.prototype.enableDebug = function(completionCallback) {
@@ -293,6 +334,20 @@ Client = (function() {
     });
   };
 
+  "requestOccupancyMap: Returns the occupancy of all tiles in a tiled area. The payload contains \"tileCount\", and\n\"means\" and \"darkFractions\" as lists of rows, ie. means[y][x] is the mean intensity of the tile at (x, y), with\nlower values for darker tiles. \"darkFractions\" are the fractions of dark pixels of each tile using a threshold\nfor the whole area, and are thus an estimate only, as brick reporters threshold the tiles they search among.\n\nareaId: Area ID of tiled board area.\ncompletionCallback: (Optional) completionCallback(action, payload) is called when receiving a respond to the request.";
+
+  Client.prototype.requestOccupancyMap = function(areaId, completionCallback) {
+    var requestId;
+    if (completionCallback == null) {
+      completionCallback = void 0;
+    }
+    requestId = this.addCompletionCallback(completionCallback);
+    return this.sendMessage("requestOccupancyMap", {
+      "requestId": requestId,
+      "areaId": areaId
+    });
+  };
+
   "reportBackWhenBrickFoundAtAnyOfPositions: Keeps searching for a brick in the given positions in a tiled area and returns\nthe position when found.\n\nareaId: Area ID of tiled board area.\nvalidPositions: A list of valid positions in the form [[x, y], [x, y], ...].\nid: (Optional) Reporter ID.\nstabilityLevel: (Optional) Minimum stability level of board area before returning result.\ncompletionCallback: (Optional) completionCallback(action, payload) is called when receiving a respond to the request.";
 
   Client.prototype.reportBackWhenBrickFoundAtAnyOfPositions = function(areaId, validPositions, id, stabilityLevel, completionCallback) {
@@ -564,6 +619,19 @@ Client = (function() {
     return this.sendMessage("startTrackingMarker", json);
   };
 
+  "getStats: Returns server processing statistics, fx. latency and dropped frame counts for each stage of the\nframe processing pipeline.\n\ncompletionCallback: (Optional) completionCallback(action, payload) is called when receiving a respond to the request.";
+
+  Client.prototype.getStats = function(completionCallback) {
+    var requestId;
+    if (completionCallback == null) {
+      completionCallback = void 0;
+    }
+    requestId = this.addCompletionCallback(completionCallback);
+    return this.sendMessage("getStats", {
+      "requestId": requestId
+    });
+  };
+
   Client.prototype.sendMessage = function(action, payload) {
     var message;
     message = {
@@ -587,6 +655,97 @@ Client = (function() {
     }
   };
 
+  Client.prototype.decodeMessages = function(data) {
+    var json, view;
+    if (data instanceof ArrayBuffer) {
+      view = new DataView(data);
+      if (view.byteLength > 0 && view.getUint8(0) === 0xB1) {
+        return this.decodeBinaryUpdates(view);
+      }
+      data = new TextDecoder("utf-8").decode(data);
+    }
+    json = JSON.parse(data);
+    if (json["action"] === "updates") {
+      return json["payload"]["updates"];
+    }
+    return [json];
+  };
+
+  Client.prototype.decodeBinaryUpdates = function(view) {
+    var action, i, j, markerCount, messages, offset, payload, requestId, updateCount, updateType, _i, _j;
+    messages = [];
+    updateCount = view.getUint16(1, true);
+    offset = 3;
+    for (i = _i = 0; 0 <= updateCount ? _i < updateCount : _i > updateCount; i = 0 <= updateCount ? ++_i : --_i) {
+      updateType = view.getUint8(offset);
+      requestId = view.getInt32(offset + 1, true);
+      payload = {
+        "id": view.getInt32(offset + 5, true)
+      };
+      offset += 9;
+      switch (updateType) {
+        case 0:
+          action = "brickFoundAtPosition";
+          payload["position"] = [view.getInt16(offset, true), view.getInt16(offset + 2, true)];
+          offset += 4;
+          break;
+        case 1:
+          action = "brickMovedToPosition";
+          payload["position"] = [view.getInt16(offset, true), view.getInt16(offset + 2, true)];
+          if (view.getUint8(offset + 4) === 1) {
+            payload["initialPosition"] = [view.getInt16(offset + 5, true), view.getInt16(offset + 7, true)];
+          }
+          offset += 9;
+          break;
+        case 2:
+        case 4:
+          action = updateType === 2 ? "markerFound" : "markerTracked";
+          payload["areaId"] = view.getInt32(offset, true);
+          payload["marker"] = this.decodeBinaryMarker(view, offset + 4);
+          offset += 33;
+          break;
+        case 3:
+          action = "markersFound";
+          payload["areaId"] = view.getInt32(offset, true);
+          markerCount = view.getUint16(offset + 4, true);
+          offset += 6;
+          payload["markers"] = [];
+          for (j = _j = 0; 0 <= markerCount ? _j < markerCount : _j > markerCount; j = 0 <= markerCount ? ++_j : --_j) {
+            payload["markers"].push(this.decodeBinaryMarker(view, offset));
+            offset += 29;
+          }
+          break;
+        default:
+          return messages;
+      }
+      messages.push({
+        "result": "UPDATE",
+        "action": action,
+        "payload": payload,
+        "requestId": requestId
+      });
+    }
+    return messages;
+  };
+
+  Client.prototype.decodeBinaryMarker = function(view, offset) {
+    var marker, source;
+    marker = {
+      "markerId": view.getInt32(offset, true),
+      "x": view.getFloat32(offset + 4, true),
+      "y": view.getFloat32(offset + 8, true),
+      "width": view.getFloat32(offset + 12, true),
+      "height": view.getFloat32(offset + 16, true),
+      "angle": view.getFloat32(offset + 20, true)
+    };
+    source = view.getUint8(offset + 24);
+    if (source !== 0) {
+      marker["source"] = source === 1 ? "detection" : "flow";
+      marker["confidence"] = view.getFloat32(offset + 25, true);
+    }
+    return marker;
+  };
+
   Client.prototype.performCompletionCallbackForRequest = function(json) {
     var action, completionCallback, payload, requestDict, requestId, shouldRemoveRequest;
     action = json["action"];
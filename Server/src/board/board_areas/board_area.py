@@ -2,8 +2,11 @@ import cv2
 from random import randint
 from threading import RLock
 from server import globals
-from board import histogram_util
+from util import image_util
+from board import image_statistics
 from board.board_descriptor import BoardDescriptor
+from board.image_cache import ColorSpace
+from board.preprocessed_image import PreprocessedImage
 
 
 class BoardArea(object):
@@ -13,12 +16,8 @@ class BoardArea(object):
     Field variables:
     board_area_pct -- [x1, y1, x2, y2] in percentage [0..1]
     board_descriptor -- Board descriptor
-    area_image -- Extracted area image
+    foreground_mask -- Foreground mask of the last stability score update
     """
-    lock = RLock()
-    extracted_area_images = {}
-    extracted_grayscaled_area_images = {}
-    foreground_mask = None
 
     def __init__(self, area_id=None, board_area_pct=[0.0, 0.0, 1.0, 1.0], board_descriptor=None):
         """
@@ -31,9 +30,10 @@ class BoardArea(object):
         self.area_id = area_id if area_id is not None else randint(0, 100000)
         self.board_area_pct = board_area_pct
         self.board_descriptor = board_descriptor if board_descriptor is not None else globals.board_descriptor
+        self.lock = RLock()
         self.background_subtractor = cv2.BackgroundSubtractorMOG2(history=5, varThreshold=16)
+        self.foreground_mask = None
         self.current_stability_score = 1.0
-        self.current_board_snapshot_id = None
 
     def area_image(self, snapshot_size=BoardDescriptor.SnapshotSize.SMALL):
         """
@@ -43,37 +43,43 @@ class BoardArea(object):
         :return Extracted area image
         """
 
-        with self.lock:
+        # Check if board is recognized
+        if not self.board_descriptor.is_recognized():
+            return None
 
-            # Check if board is recognized
-            if not self.board_descriptor.is_recognized():
-                return None
+        snapshot = self.board_descriptor.snapshot
 
-            # Check if snapshot has changed
-            if self.current_board_snapshot_id is not self.board_descriptor.snapshot.id:
-                self.extracted_area_images = {}
-                self.extracted_grayscaled_area_images = {}
+        key = snapshot.image_cache.key(snapshot.id, self.cache_area_id(), snapshot_size, ColorSpace.COLOR)
+        return snapshot.image_cache.get_or_create(key, lambda: self.extract_area_image(snapshot_size))
 
-            # Return pre-processed area image
-            if snapshot_size in self.extracted_area_images:
-                return self.extracted_area_images[snapshot_size]
+    def cache_area_id(self):
+        """
+        Returns the id by which area images are cached. Includes the area geometry, so that an area reinitialized with
+        the same id but another region never gets the images of the old area from a reused snapshot.
 
-            # Save snapshot ID
-            self.current_board_snapshot_id = self.board_descriptor.snapshot.id
+        :return: Cache area id
+        """
+        return self.area_id, tuple(self.board_area_pct)
 
-            # Get board canvas image
-            board_image = self.board_descriptor.board_canvas(snapshot_size)
-            image_height, image_width = board_image.shape[:2]
+    def extract_area_image(self, snapshot_size):
+        """
+        Extracts the area region from the board canvas image.
 
-            # Extract area image
-            x1 = int(float(image_width) * self.board_area_pct[0])
-            y1 = int(float(image_height) * self.board_area_pct[1])
-            x2 = int(float(image_width) * self.board_area_pct[2])
-            y2 = int(float(image_height) * self.board_area_pct[3])
+        :param snapshot_size: Snapshot size to use
+        :return Extracted area image
+        """
 
-            self.extracted_area_images[snapshot_size] = board_image[y1:y2, x1:x2]
+        # Get board canvas image
+        board_image = self.board_descriptor.board_canvas(snapshot_size)
+        image_height, image_width = board_image.shape[:2]
 
-            return self.extracted_area_images[snapshot_size]
+        # Extract area image
+        x1 = int(float(image_width) * self.board_area_pct[0])
+        y1 = int(float(image_height) * self.board_area_pct[1])
+        x2 = int(float(image_width) * self.board_area_pct[2])
+        y2 = int(float(image_height) * self.board_area_pct[3])
+
+        return board_image[y1:y2, x1:x2]
 
     def grayscaled_area_image(self, snapshot_size=BoardDescriptor.SnapshotSize.SMALL):
         """
@@ -83,24 +89,38 @@ class BoardArea(object):
         :return Extracted area image
         """
 
-        with self.lock:
+        # Check if board is recognized
+        if not self.board_descriptor.is_recognized():
+            return None
 
-            # Check if board is recognized
-            if not self.board_descriptor.is_recognized():
-                return None
+        snapshot = self.board_descriptor.snapshot
 
-            # Already extracted image
-            if self.current_board_snapshot_id is self.board_descriptor.snapshot.id:
-                if snapshot_size in self.extracted_grayscaled_area_images:
-                    return self.extracted_grayscaled_area_images[snapshot_size]
+        # Area image is already grayscaled when captured in grayscale
+        image = self.area_image(snapshot_size)
+        if image_util.is_grayscaled(image):
+            return image
 
-            # Extract image
-            image = self.area_image(snapshot_size)
+        key = snapshot.image_cache.key(snapshot.id, self.cache_area_id(), snapshot_size, ColorSpace.GRAYSCALE)
+        return snapshot.image_cache.get_or_create(key, lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
 
-            # Grayscale image
-            self.extracted_grayscaled_area_images[snapshot_size] = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def preprocessed_area_image(self, snapshot_size=BoardDescriptor.SnapshotSize.SMALL):
+        """
+        Extracts area image from board snapshot, with preprocessing results cached for the snapshot.
+
+        :param snapshot_size: Snapshot size to use
+        :return Preprocessed area image, or None if board is not recognized
+        """
 
-            return self.extracted_grayscaled_area_images[snapshot_size]
+        # Check if board is recognized
+        if not self.board_descriptor.is_recognized():
+            return None
+
+        snapshot = self.board_descriptor.snapshot
+
+        key = snapshot.image_cache.key(snapshot.id, self.cache_area_id(), snapshot_size, ColorSpace.COLOR)
+        image = snapshot.image_cache.get_or_create(key, lambda: self.extract_area_image(snapshot_size))
+
+        return PreprocessedImage(image, snapshot.image_cache, key) if image is not None else None
 
     def update_stability_score(self):
 
@@ -115,12 +135,8 @@ class BoardArea(object):
             # Update foreground mask with area image
             self.foreground_mask = self.background_subtractor.apply(image, learningRate=0.5)
 
-            mask_height, mask_width = self.foreground_mask.shape[:2]
-
             # Calculate stability score
-            histogram = histogram_util.histogram_from_bw_image(self.foreground_mask)
-            histogram_median = histogram_util.histogram_median(histogram, mask_width * mask_height)
-            self.current_stability_score = 1.0 - (histogram_median / 255.0)
+            self.current_stability_score = 1.0 - (image_statistics.mean(self.foreground_mask) / 255.0)
 
             #image_height, image_width = image.shape[:2]
             #print("Score %i: %f --- %i, %i" % (self.area_id, self.current_stability_score, image_width, image_height))
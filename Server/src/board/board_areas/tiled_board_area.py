@@ -1,5 +1,6 @@
 import numpy as np
 from board_area import BoardArea
+from board.tile_statistics import TileStatistics
 
 
 class TiledBoardArea(BoardArea):
@@ -18,6 +19,29 @@ class TiledBoardArea(BoardArea):
         super(TiledBoardArea, self).__init__(area_id, board_area_pct, board_descriptor)
 
         self.tile_count = tile_count
+        self.current_occupancy_map = None
+        self.occupancy_map_snapshot_id = None
+
+    def occupancy_map(self):
+        """
+        Returns the tile statistics and occupancy of all tiles in the current board snapshot. The occupancy map is
+        calculated at most once per snapshot and shared by everyone searching for bricks in this area.
+
+        :return: Tile statistics, or None if board is not recognized
+        """
+        with self.lock:
+
+            # Check if board is recognized
+            if not self.board_descriptor.is_recognized():
+                return None
+
+            # Calculate occupancy map for new snapshot
+            snapshot_id = self.board_descriptor.snapshot.id
+            if self.current_occupancy_map is None or self.occupancy_map_snapshot_id != snapshot_id:
+                self.current_occupancy_map = TileStatistics(self.grayscaled_area_image(), self.tile_count)
+                self.occupancy_map_snapshot_id = snapshot_id
+
+            return self.current_occupancy_map
 
     def tile_size(self):
         """
@@ -1,8 +1,10 @@
 import numpy as np
 import cv2
-from random import randint
-from threading import RLock
+import itertools
 from util import enum
+from util import image_util
+from board.image_cache import shared_image_cache
+from board.image_cache import ColorSpace
 
 
 BoardStatus = enum.Enum('NOT_RECOGNIZED', 'RECOGNIZED')
@@ -176,28 +178,23 @@ class BoardSnapshot:
     Field variables:
     status -- Board recognition status
     camera_image -- Original camera image
-    board_images -- The recognized and transformed images in all sizes
-    grayscaled_board_images -- A grayscale version of the board images in all sizes
+    original_board_image -- The recognized and transformed image in original size
     board_corners -- The four points in the source image representing the corners of the recognized board
     missing_corners -- Dictionary of missing corners, if board was not recognized. {topLeft, topRight, bottomLeft, bottomRight}
-    id -- Random ID for the actual snapshot. Is set automatically when created
+    image_cache -- Cache holding the resized, grayscaled and canvas images derived from the board image
+    id -- Unique ID for the actual snapshot. Is set automatically when created
     """
+    id_counter = itertools.count(1)
 
-    def __init__(self, status=BoardStatus.RECOGNIZED, camera_image=None, board_image=None, board_corners=None, missing_corners=None):
+    def __init__(self, status=BoardStatus.RECOGNIZED, camera_image=None, board_image=None, board_corners=None, missing_corners=None, image_cache=None):
         self.status = status
         self.camera_image = camera_image
-        self.board_images = {}
-        self.grayscaled_board_images = {}
-        self.board_canvas_images = {}
+        self.original_board_image = board_image
         self.board_corners = board_corners
         self.missing_corners = missing_corners
+        self.image_cache = image_cache if image_cache is not None else shared_image_cache
 
-        self.id = randint(0, 100000)
-
-        self.lock = RLock()
-
-        if board_image is not None:
-            self.board_images[BoardDescriptor.SnapshotSize.ORIGINAL] = board_image
+        self.id = next(self.id_counter)
 
     def board_image(self, image_size=BoardDescriptor.SnapshotSize.SMALL):
         """
@@ -207,38 +204,45 @@ class BoardSnapshot:
         :return: Board image in given size
         """
 
-        with self.lock:
+        # Check for original board image
+        if self.original_board_image is None:
+            return None
 
-            # Check if image already exists
-            if image_size in self.board_images:
-                return self.board_images[image_size]
+        if image_size == BoardDescriptor.SnapshotSize.ORIGINAL:
+            return self.original_board_image
 
-            if BoardDescriptor.SnapshotSize.ORIGINAL not in self.board_images:
-                return None
+        key = self.image_cache.key(self.id, None, image_size, ColorSpace.COLOR)
+        return self.image_cache.get_or_create(key, lambda: self.resized_board_image(image_size))
 
-            # Original image measurements
-            original_image = self.board_images[BoardDescriptor.SnapshotSize.ORIGINAL]
-            original_height, original_width = original_image.shape[:2]
-            aspect_ratio = float(original_height) / float(original_width)
-
-            # Find scaled width
-            dest_width = original_width
-            if image_size is BoardDescriptor.SnapshotSize.EXTRA_SMALL:
-                dest_width = 320.0
-            elif image_size is BoardDescriptor.SnapshotSize.SMALL:
-                dest_width = 640.0
-            elif image_size is BoardDescriptor.SnapshotSize.MEDIUM:
-                dest_width = 800.0
-            elif image_size is BoardDescriptor.SnapshotSize.LARGE:
-                dest_width = 1200.0
+    def resized_board_image(self, image_size):
+        """
+        Resizes the original board image to the given size.
 
-            # Resize image
-            if dest_width < original_width:
-                self.board_images[image_size] = cv2.resize(original_image, (int(dest_width), int(dest_width * aspect_ratio)))
-            else:
-                self.board_images[image_size] = original_image
+        :param image_size: Image size
+        :return: Resized board image
+        """
 
-            return self.board_images[image_size]
+        # Original image measurements
+        original_image = self.original_board_image
+        original_height, original_width = original_image.shape[:2]
+        aspect_ratio = float(original_height) / float(original_width)
+
+        # Find scaled width
+        dest_width = original_width
+        if image_size is BoardDescriptor.SnapshotSize.EXTRA_SMALL:
+            dest_width = 320.0
+        elif image_size is BoardDescriptor.SnapshotSize.SMALL:
+            dest_width = 640.0
+        elif image_size is BoardDescriptor.SnapshotSize.MEDIUM:
+            dest_width = 800.0
+        elif image_size is BoardDescriptor.SnapshotSize.LARGE:
+            dest_width = 1200.0
+
+        # Resize image
+        if dest_width < original_width:
+            return cv2.resize(original_image, (int(dest_width), int(dest_width * aspect_ratio)))
+        else:
+            return original_image
 
     def grayscaled_board_image(self, image_size=BoardDescriptor.SnapshotSize.SMALL):
         """
@@ -248,42 +252,34 @@ class BoardSnapshot:
         :return: Grayscaled board image in given size
         """
 
-        with self.lock:
+        # Check for original board image
+        board_image = self.board_image(image_size)
+        if board_image is None:
+            return None
 
-            # Check if image already exists
-            if image_size in self.grayscaled_board_images:
-                return self.grayscaled_board_images[image_size]
+        # Board image is already grayscaled when captured in grayscale
+        if image_util.is_grayscaled(board_image):
+            return board_image
 
-            # Check for original board image
-            if BoardDescriptor.SnapshotSize.ORIGINAL not in self.board_images:
-                return None
-
-            # Grayscale imagae
-            self.grayscaled_board_images[image_size] = cv2.cvtColor(self.board_image(image_size), cv2.COLOR_BGR2GRAY)
-            return self.grayscaled_board_images[image_size]
+        # Grayscale image
+        key = self.image_cache.key(self.id, None, image_size, ColorSpace.GRAYSCALE)
+        return self.image_cache.get_or_create(key, lambda: cv2.cvtColor(board_image, cv2.COLOR_BGR2GRAY))
 
     def board_canvas_image(self, canvas_region, image_size=BoardDescriptor.SnapshotSize.SMALL):
         """
-        Returns the grayscaled board image in the given size.
+        Returns the board canvas image in the given size.
 
         :param canvas_region: Canvas region (x1, y1, x2, y2)
         :param image_size: Image size
-        :return: Grayscaled board image in given size
+        :return: Board canvas image in given size
         """
 
-        with self.lock:
-
-            # Check if already present
-            if image_size not in self.board_canvas_images:
-
-                # Extract board image
-                board_image = self.board_image(image_size)
-                if board_image is None:
-                    return None
-
-                # Extract region
-                self.board_canvas_images[image_size] = board_image[
-                                                       int(canvas_region[1]):int(canvas_region[3]),
-                                                       int(canvas_region[0]):int(canvas_region[2])]
+        # Extract board image
+        board_image = self.board_image(image_size)
+        if board_image is None:
+            return None
 
-            return self.board_canvas_images[image_size]
+        # Extract region
+        key = self.image_cache.key(self.id, "canvas", image_size, ColorSpace.COLOR)
+        return self.image_cache.get_or_create(key, lambda: board_image[int(canvas_region[1]):int(canvas_region[3]),
+                                                                       int(canvas_region[0]):int(canvas_region[2])])
@@ -1,18 +1,102 @@
 import cv2
 import numpy as np
 import math
+import time
+from multiprocessing.pool import ThreadPool
 from util import enum
 from util import misc_math
+from util import image_util
 from board.board_descriptor import BoardSnapshot
 from board.board_descriptor import BoardStatus
 from board import transform
-from board import histogram_util
+from board import image_statistics
+
+
+class ThresholdModeStatistics(object):
+    """
+    Success counts and timings of the threshold modes used for finding a single corner marker. Each threshold mode
+    tried in an image counts as one attempt, with the time spent in all search phases of that image. Older images are
+    gradually forgotten, so the statistics follow changes in lighting.
+
+    Field variables:
+    attempts -- Decayed number of images in which each threshold mode was tried
+    successes -- Decayed number of images in which each threshold mode found the marker
+    durations -- Decayed total time in seconds spent in each threshold mode
+    last_successful_mode -- Threshold mode which most recently found the marker
+    """
+    decay = 0.99
+
+    def __init__(self, mode_count):
+        self.attempts = [0.0] * mode_count
+        self.successes = [0.0] * mode_count
+        self.durations = [0.0] * mode_count
+        self.last_successful_mode = None
+
+    def add_attempts(self, durations, successful_mode):
+        """
+        Records the attempts of finding the marker in a single image.
+
+        :param durations: Dictionary of total time in seconds spent in all search phases by threshold mode tried
+        :param successful_mode: Threshold mode which found the marker, or None if not found
+        """
+        for i in range(0, len(self.attempts)):
+            self.attempts[i] *= self.decay
+            self.successes[i] *= self.decay
+            self.durations[i] *= self.decay
+
+        for mode, duration in durations.iteritems():
+            self.attempts[mode] += 1.0
+            self.durations[mode] += duration
+
+        if successful_mode is not None:
+            self.successes[successful_mode] += 1.0
+            self.last_successful_mode = successful_mode
+
+    def expected_cost(self, mode):
+        """
+        Calculates the expected time spent per successful attempt with the given threshold mode.
+
+        :param mode: Threshold mode
+        :return: Expected cost in seconds. Untried modes have zero cost
+        """
+        if self.attempts[mode] == 0.0:
+            return 0.0
+
+        average_duration = self.durations[mode] / self.attempts[mode]
+        success_rate = (self.successes[mode] + 1.0) / (self.attempts[mode] + 2.0)
+
+        return average_duration / success_rate
+
+    def ordered_modes(self):
+        """
+        Orders the threshold modes with the last successful mode first, followed by the remaining modes in order of
+        expected cost per success.
+
+        :return: List of threshold modes
+        """
+        return sorted(range(0, len(self.attempts)),
+                      key=lambda mode: (mode != self.last_successful_mode, self.expected_cost(mode), mode))
+
+    def to_dict(self, mode_names):
+        return {mode_names[mode]: {"attempts": self.attempts[mode],
+                                   "successes": self.successes[mode],
+                                   "expectedCost": self.expected_cost(mode)} for mode in range(0, len(self.attempts))}
 
 
 class BoardRecognizedState(object):
     def __init__(self):
         self.marker_rects = [None, None, None, None]
-        self.threshold_mode = BoardRecognizer.ThresholdModes.OTSU
+        self.threshold_mode_statistics = [ThresholdModeStatistics(len(BoardRecognizer.ThresholdModes.names)) for _ in range(0, 4)]
+
+        self.candidate_corners = None
+        self.consistent_detection_count = 0
+
+        self.locked_corners = None
+        self.locked_image_size = None
+        self.locked_marker_rects = None
+        self.locked_marker_patches = None
+        self.remap_tables = None
+        self.frames_since_verification = 0
 
 
 class BoardRecognizer(object):
@@ -35,57 +119,75 @@ class BoardRecognizer(object):
     image_width = 0
     image_height = 0
 
+    # Marker search
+    parts = [[0, 0], [1, 0], [0, 1], [1, 1]]
+
+    marker_pyramid_min_width = 160
+    marker_pyramid_max_candidates = 8
+    exhaustive_marker_search = True
+
+    # Locked calibration
+    calibration_lock_detection_count = 3
+    calibration_lock_max_corner_deviation = 3.0
+    calibration_verification_interval = 100
+    calibration_drift_threshold = 25.0
+    calibration_patch_size = (16, 16)
+
     def __init__(self):
         self.state = BoardRecognizedState()
+        self.calibration_lock_enabled = False
+        self.parallel_marker_search = False
+        self.thread_pool = None
 
     def find_board(self, image, board_descriptor):
         """
         Finds a board, if any, in the source image and populates the board descriptor.
 
+        If calibration lock is enabled and the board corners have been found at the same position in a number of
+        consecutive images, the corners are frozen and the board image is extracted using precomputed remap tables.
+        The corner markers are then only searched for every calibration_verification_interval images, or when the
+        image around one of the corner markers has changed.
+
         :param image: Source image from which to recognize board
         :param board_descriptor: Board descriptor
         :return Board descriptor
         """
 
-        source_image = self.prepare_image(image)
+        # Use locked calibration
+        if self.calibration_lock_enabled and self.state.locked_corners is not None:
+            board_snapshot = self.board_snapshot_from_locked_calibration(image)
+            if board_snapshot is not None:
+                return board_snapshot
 
-        self.prepare_constants_from_image(source_image, board_descriptor)
-
-        # Find markers in all four part of image
-        parts = [[0, 0], [1, 0], [0, 1], [1, 1]]
-        marker_contours = [None, None, None, None]
-
-        # First try previous found rect, if any
-        for (threshold_mode, _) in self.ThresholdModes.tuples():
-            for i in range(0, len(parts)):
+        # Find board from corner markers
+        board_snapshot = self.find_board_from_markers(image, board_descriptor)
 
-                # Already found this marker
-                if marker_contours[i] is not None:
-                    continue
+        # Update calibration lock
+        if self.calibration_lock_enabled:
+            self.update_calibration_lock(image, board_snapshot)
 
-                # Marker hasn't yet been foound
-                if self.state.marker_rects[i] is None:
-                    continue
+        return board_snapshot
 
-                # Find marker
-                marker_rect, marker_contours[i] = self.find_marker(source_image, parts[i][0], parts[i][1], self.state.marker_rects[i], threshold_mode, board_descriptor.corner_marker)
-
-                if marker_rect is not None:
-                    self.state.marker_rects[i] = marker_rect
+    def find_board_from_markers(self, image, board_descriptor):
+        """
+        Finds a board, if any, in the source image by searching for the four corner markers.
 
-        # Next try whole image
-        for (threshold_mode, _) in self.ThresholdModes.tuples():
-            for i in range(0, len(parts)):
+        :param image: Source image from which to recognize board
+        :param board_descriptor: Board descriptor
+        :return Board descriptor
+        """
 
-                # Already found this marker
-                if marker_contours[i] is not None:
-                    continue
+        source_image = self.prepare_image(image)
 
-                # Find marker
-                marker_rect, marker_contours[i] = self.find_marker(source_image, parts[i][0], parts[i][1], None, threshold_mode, board_descriptor.corner_marker)
+        self.prepare_constants_from_image(source_image, board_descriptor)
 
-                if marker_rect is not None:
-                    self.state.marker_rects[i] = marker_rect
+        # Find markers in all four part of image
+        if self.parallel_marker_search:
+            marker_contours = self.marker_search_thread_pool().map(
+                lambda i: self.find_corner_marker(source_image, i, board_descriptor.corner_marker),
+                range(0, len(self.parts)))
+        else:
+            marker_contours = [self.find_corner_marker(source_image, i, board_descriptor.corner_marker) for i in range(0, len(self.parts))]
 
         # Check if all markers are found
         if marker_contours[0] is None or marker_contours[1] is None or marker_contours[2] is None or marker_contours[3] is None:
@@ -99,6 +201,232 @@ class BoardRecognizer(object):
 
         return None
 
+    def marker_search_thread_pool(self):
+        """
+        Returns the thread pool used for searching the four corners in parallel.
+
+        :return: Thread pool
+        """
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPool(len(self.parts))
+        return self.thread_pool
+
+    def find_corner_marker(self, image, index, corner_marker):
+        """
+        Finds the corner marker in the given part of the image. Only touches the state of the given corner, so the four
+        corners can be searched concurrently.
+
+        :param image: Grayscaled source image
+        :param index: Corner index
+        :param corner_marker: Corner marker
+        :return: Marker contour, or None if marker is not found
+        """
+        statistics = self.state.threshold_mode_statistics[index]
+
+        # Search marker, timing each threshold mode across all search phases
+        durations = {}
+        contour, successful_mode = self.search_corner_marker(image, index, corner_marker, statistics.ordered_modes(), durations)
+
+        # Record one attempt per threshold mode tried
+        statistics.add_attempts(durations, successful_mode)
+
+        return contour
+
+    def search_corner_marker(self, image, index, corner_marker, threshold_modes, durations):
+        """
+        Searches the corner marker in the given part of the image, first around the previously found marker, then among
+        marker candidates found in downscaled image and finally in the whole part of the image.
+
+        :param image: Grayscaled source image
+        :param index: Corner index
+        :param corner_marker: Corner marker
+        :param threshold_modes: Threshold modes in order of trying
+        :param durations: Dictionary of time in seconds spent by threshold mode, which is added to
+        :return: (marker contour, threshold mode which found the marker), or (None, None) if marker is not found
+        """
+        part_x, part_y = self.parts[index]
+
+        # First try previous found rect, if any
+        if self.state.marker_rects[index] is not None:
+            for threshold_mode in threshold_modes:
+                contour = self.timed_marker_search(durations, threshold_mode, self.find_marker_in_rect,
+                                                   image, self.state.marker_rects[index], threshold_mode, corner_marker)
+                if contour is not None:
+                    self.state.marker_rects[index] = self.centered_search_rect(contour)
+                    return contour, threshold_mode
+
+        # Next try marker candidates found in downscaled image
+        for threshold_mode in threshold_modes:
+            marker_rect, contour = self.timed_marker_search(durations, threshold_mode, self.find_marker_using_pyramid,
+                                                            image, part_x, part_y, threshold_mode, corner_marker)
+            if contour is not None:
+                self.state.marker_rects[index] = marker_rect
+                return contour, threshold_mode
+
+        # Finally search whole image
+        if self.exhaustive_marker_search:
+            for threshold_mode in threshold_modes:
+                marker_rect, contour = self.timed_marker_search(durations, threshold_mode, self.find_marker,
+                                                                image, part_x, part_y, threshold_mode, corner_marker)
+                if contour is not None:
+                    self.state.marker_rects[index] = marker_rect
+                    return contour, threshold_mode
+
+        # No marker found
+        return None, None
+
+    def timed_marker_search(self, durations, threshold_mode, search_function, *args):
+        """
+        Calls the search function and adds the time spent to the threshold mode.
+
+        :param durations: Dictionary of time in seconds spent by threshold mode
+        :param threshold_mode: Threshold mode
+        :param search_function: Search function
+        :return: Result from search function
+        """
+        start_time = time.time()
+        result = search_function(*args)
+
+        durations[threshold_mode] = durations.get(threshold_mode, 0.0) + time.time() - start_time
+
+        return result
+
+    def threshold_mode_statistics(self):
+        """
+        Returns the threshold mode statistics for the four corners.
+
+        :return: List of dictionaries in form {mode name: {"attempts", "successes", "expectedCost"}}
+        """
+        return [statistics.to_dict(self.ThresholdModes.names) for statistics in self.state.threshold_mode_statistics]
+
+    def unlock_calibration(self):
+        """
+        Unlocks the calibration, forcing the corner markers to be found again.
+        """
+        self.state.candidate_corners = None
+        self.state.consistent_detection_count = 0
+        self.state.locked_corners = None
+        self.state.locked_image_size = None
+        self.state.locked_marker_rects = None
+        self.state.locked_marker_patches = None
+        self.state.remap_tables = None
+        self.state.frames_since_verification = 0
+
+    def board_snapshot_from_locked_calibration(self, image):
+        """
+        Extracts the board from the source image using the locked calibration.
+
+        :param image: Source image
+        :return: Board snapshot, or None if the corner markers must be verified
+        """
+        self.state.frames_since_verification += 1
+
+        # Verify corners regularly
+        if self.state.frames_since_verification >= self.calibration_verification_interval:
+            return None
+
+        # Verify corners if image size has changed
+        if image.shape[:2] != self.state.locked_image_size:
+            return None
+
+        # Verify corners if anything has changed around the markers
+        if self.has_calibration_drifted(image):
+            return None
+
+        transformed_image = transform.remap_image(image, self.state.remap_tables)
+        return BoardSnapshot(camera_image=image, board_image=transformed_image, board_corners=self.state.locked_corners)
+
+    def update_calibration_lock(self, image, board_snapshot):
+        """
+        Updates the calibration lock with the result of a full board recognition.
+
+        :param image: Source image
+        :param board_snapshot: Board snapshot
+        """
+
+        # Board not found
+        if board_snapshot is None or board_snapshot.status != BoardStatus.RECOGNIZED:
+            self.unlock_calibration()
+            return
+
+        corners = board_snapshot.board_corners
+
+        # Verify locked corners
+        if self.state.locked_corners is not None:
+            if self.corners_deviation(self.state.locked_corners, corners) <= self.calibration_lock_max_corner_deviation:
+                self.lock_calibration(image, self.state.locked_corners)
+                return
+
+            self.unlock_calibration()
+
+        # Count consistent detections
+        if self.state.candidate_corners is not None and \
+                self.corners_deviation(self.state.candidate_corners, corners) <= self.calibration_lock_max_corner_deviation:
+            self.state.consistent_detection_count += 1
+        else:
+            self.state.candidate_corners = corners
+            self.state.consistent_detection_count = 1
+
+        # Lock calibration
+        if self.state.consistent_detection_count >= self.calibration_lock_detection_count:
+            self.lock_calibration(image, self.state.candidate_corners)
+
+    def lock_calibration(self, image, corners):
+        """
+        Locks the calibration at the given corners and precomputes the remap tables.
+
+        :param image: Source image
+        :param corners: Board corners
+        """
+        if self.state.locked_corners is not corners:
+            self.state.remap_tables = transform.remap_tables_for_corners(corners)
+
+        self.state.locked_corners = corners
+        self.state.locked_image_size = image.shape[:2]
+        self.state.locked_marker_rects = list(self.state.marker_rects)
+        self.state.locked_marker_patches = self.marker_patches(image, self.state.locked_marker_rects)
+        self.state.frames_since_verification = 0
+
+    def has_calibration_drifted(self, image):
+        """
+        Cheaply checks whether the image around any of the locked corner markers has changed.
+
+        :param image: Source image
+        :return: True, if the image has changed around any of the corner markers
+        """
+        patches = self.marker_patches(image, self.state.locked_marker_rects)
+
+        for (patch, locked_patch) in zip(patches, self.state.locked_marker_patches):
+            if cv2.mean(cv2.absdiff(patch, locked_patch))[0] > self.calibration_drift_threshold:
+                return True
+
+        return False
+
+    def marker_patches(self, image, marker_rects):
+        """
+        Extracts small grayscaled patches of the image at the marker rects.
+
+        :param image: Source image
+        :param marker_rects: Marker rects [x1, y1, x2, y2]
+        :return: List of patches
+        """
+        patches = []
+        for marker_rect in marker_rects:
+            patch = image[marker_rect[1]:marker_rect[3], marker_rect[0]:marker_rect[2]]
+            patch = image_util.grayscaled_image(patch)
+            patches.append(cv2.resize(patch, self.calibration_patch_size, interpolation=cv2.INTER_AREA))
+        return patches
+
+    def corners_deviation(self, corners1, corners2):
+        """
+        Calculates the maximum distance between corresponding corners.
+
+        :param corners1: First corners
+        :param corners2: Second corners
+        :return: Maximum distance in pixels
+        """
+        return max([transform.distance(p1, p2) for (p1, p2) in zip(corners1, corners2)])
+
     def prepare_constants_from_image(self, image, board_descriptor):
         self.image_height, self.image_width = image.shape[:2]
         board_width, board_height = board_descriptor.board_size
@@ -111,24 +439,108 @@ class BoardRecognizer(object):
         self.marker_search_height = int(self.image_height * 0.1)
 
     def prepare_image(self, image):
-        grayscaled_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        grayscaled_image = image_util.grayscaled_image(image)
         return grayscaled_image
 
-    def find_marker(self, image, part_x, part_y, current_marker_rect, threshold_mode, corner_marker):
+    def part_rect(self, part_x, part_y):
+        """
+        Calculates the rect of the given image part (quadrant).
 
-        # Calculate part rect
+        :param part_x: Horizontal part index, 0 or 1
+        :param part_y: Vertical part index, 0 or 1
+        :return: (x, y, width, height)
+        """
         part_width = int(self.image_width / 2)
         part_height = int(self.image_height / 2)
 
-        part_offset_x = part_x * part_width
-        part_offset_y = part_y * part_height
+        return part_x * part_width, part_y * part_height, part_width, part_height
 
-        # Find marker in previous marker rect
-        if current_marker_rect is not None:
-            contour = self.find_marker_in_rect(image, current_marker_rect, threshold_mode, corner_marker)
+    def find_marker_using_pyramid(self, image, part_x, part_y, threshold_mode, corner_marker):
+        """
+        Finds marker candidates in a downscaled version of the image part and verifies them in full resolution.
+
+        :param image: Grayscaled source image
+        :param part_x: Horizontal part index, 0 or 1
+        :param part_y: Vertical part index, 0 or 1
+        :param threshold_mode: Threshold mode
+        :param corner_marker: Corner marker
+        :return: (Marker rect, marker contour), or (None, None) if no marker is found
+        """
+        for (x, y) in self.find_marker_candidates(image, part_x, part_y, threshold_mode):
+
+            # Verify candidate in full resolution
+            search_rect = self.search_rect_centered_at(x, y)
+            contour = self.find_marker_in_rect(image, search_rect, threshold_mode, corner_marker)
             if contour is not None:
                 return self.centered_search_rect(contour), contour
 
+        # No marker found
+        return None, None
+
+    def find_marker_candidates(self, image, part_x, part_y, threshold_mode):
+        """
+        Finds the centers of blobs in the downscaled image part, which are of a size that could be a marker.
+
+        :param image: Grayscaled source image
+        :param part_x: Horizontal part index, 0 or 1
+        :param part_y: Vertical part index, 0 or 1
+        :param threshold_mode: Threshold mode
+        :return: List of candidate centers [(x, y), ...] in source image, largest first
+        """
+        part_offset_x, part_offset_y, part_width, part_height = self.part_rect(part_x, part_y)
+
+        # Downscale image part
+        image = image[part_offset_y:part_offset_y + part_height, part_offset_x:part_offset_x + part_width]
+
+        scale = 1
+        while image.shape[1] / 2 >= self.marker_pyramid_min_width:
+            image = cv2.pyrDown(image)
+            scale *= 2
+
+        # Find blobs
+        thresholded_image = self.threshold_image(image, threshold_mode)
+        contours, _ = cv2.findContours(thresholded_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+        # Markers must fit inside search rect and cover a minimum part of it
+        min_area = (self.marker_search_width * 0.1) * (self.marker_search_height * 0.1)
+
+        candidates = []
+        for contour in contours:
+            x, y, width, height = [v * scale for v in cv2.boundingRect(contour)]
+
+            if width > self.marker_search_width or height > self.marker_search_height:
+                continue
+            if width * height < min_area:
+                continue
+
+            candidates.append((width * height, part_offset_x + x + (width / 2), part_offset_y + y + (height / 2)))
+
+        # Remove candidates at the same position
+        candidates.sort(reverse=True)
+
+        result = []
+        for (_, x, y) in candidates:
+            if any([abs(x - cx) < self.marker_search_width / 2 and abs(y - cy) < self.marker_search_height / 2 for (cx, cy) in result]):
+                continue
+            result.append((x, y))
+
+        return result[:self.marker_pyramid_max_candidates]
+
+    def find_marker(self, image, part_x, part_y, threshold_mode, corner_marker):
+        """
+        Finds marker by sliding the search rect over the whole image part.
+
+        :param image: Grayscaled source image
+        :param part_x: Horizontal part index, 0 or 1
+        :param part_y: Vertical part index, 0 or 1
+        :param threshold_mode: Threshold mode
+        :param corner_marker: Corner marker
+        :return: (Marker rect, marker contour), or (None, None) if no marker is found
+        """
+
+        # Calculate part rect
+        part_offset_x, part_offset_y, part_width, part_height = self.part_rect(part_x, part_y)
+
         # Go through whole image
         for y in range(part_offset_y, part_offset_y + part_height, self.marker_search_height / 2):
             for x in range(part_offset_x, part_offset_x + part_width, self.marker_search_width / 2):
@@ -159,9 +571,13 @@ class BoardRecognizer(object):
     def centered_search_rect(self, contour):
         x, y, width, height = cv2.boundingRect(contour)
 
+        return self.search_rect_centered_at(x + (width / 2), y + (height / 2))
+
+    def search_rect_centered_at(self, x, y):
+
         # Calculate offset
-        offset_x = max(0, min(self.image_width - self.marker_search_width, x + ( width - self.marker_search_width) / 2))
-        offset_y = max(0, min(self.image_height - self.marker_search_height, y + (height - self.marker_search_height) / 2))
+        offset_x = max(0, min(self.image_width - self.marker_search_width, x - (self.marker_search_width / 2)))
+        offset_y = max(0, min(self.image_height - self.marker_search_height, y - (self.marker_search_height / 2)))
 
         return [offset_x, offset_y, offset_x + self.marker_search_width, offset_y + self.marker_search_height]
 
@@ -263,17 +679,8 @@ class BoardRecognizer(object):
 
     def automatic_thresholding_for_image(self, image):
 
-        # Calculate histogram
-        histogram = histogram_util.histogram_from_image(image, 256)
-
-        # Calculate mean
-        min_index = 255
-        max_index = 0
-        for i in range(0, 256):
-            value = histogram.item(i)
-            if value != 0:
-                min_index = min(min_index, i)
-                max_index = max(max_index, i)
+        # Find min and max
+        min_index, max_index = image_statistics.min_max(image)
 
         # Mean value
         mean = (min_index + max_index) / 2.0
@@ -0,0 +1,109 @@
+from __future__ import with_statement
+import cv2
+from threading import Lock
+from util import image_util
+
+
+class FrameChangeDetector(object):
+    """
+    Class capable of detecting whether a camera image has changed since the last processed image.
+
+    The reference image is only replaced once an image has actually been processed, so a changed image which is
+    dropped before being processed keeps the following images changed until one of them is processed.
+
+    Both images are downscaled to small grayscale thumbnails, in which each pixel is the mean of a block of the source
+    image. The image is considered changed if any block differs by more than the threshold. Comparing blocks instead
+    of the whole image makes sure that small changes, fx. a single brick being placed, are not averaged away.
+
+    Field variables:
+    threshold -- Maximum block difference in gray levels for an image to be considered unchanged. None disables gating
+    thumbnail_size -- Thumbnail (width, height)
+    max_reuse_count -- Maximum number of consecutive unchanged images before forcing an image to be processed anyway
+    """
+
+    def __init__(self, threshold=12.0, thumbnail_size=(80, 60), max_reuse_count=50):
+        self.threshold = threshold
+        self.thumbnail_size = thumbnail_size
+        self.max_reuse_count = max_reuse_count
+
+        self.lock = Lock()
+        self.reference_thumbnail = None
+        self.reuse_count = 0
+        self.changed_frame_count = 0
+        self.unchanged_frame_count = 0
+
+    def reset(self):
+        """
+        Forgets the reference image, forcing the next image to be processed.
+        """
+        with self.lock:
+            self.reference_thumbnail = None
+            self.reuse_count = 0
+
+    def has_changed(self, thumbnail):
+        """
+        Compares the thumbnail with the thumbnail of the last processed image.
+
+        :param thumbnail: Thumbnail of camera image, as returned by thumbnail
+        :return: True, if the image must be processed, else false
+        """
+        if thumbnail is None:
+            return True
+
+        with self.lock:
+            if self.reference_thumbnail is not None and \
+                    self.reference_thumbnail.shape == thumbnail.shape and \
+                    self.reuse_count < self.max_reuse_count and \
+                    self.difference(self.reference_thumbnail, thumbnail) <= self.threshold:
+                self.reuse_count += 1
+                self.unchanged_frame_count += 1
+                return False
+
+            self.changed_frame_count += 1
+            return True
+
+    def set_processed(self, thumbnail):
+        """
+        Makes the thumbnail of a processed image the new reference image.
+
+        :param thumbnail: Thumbnail of processed camera image, as returned by thumbnail
+        """
+        if thumbnail is None:
+            return
+
+        with self.lock:
+            self.reference_thumbnail = thumbnail
+            self.reuse_count = 0
+
+    def thumbnail(self, image):
+        """
+        Returns the downscaled grayscale thumbnail of the image.
+
+        :param image: Source image
+        :return: Thumbnail image, or None if gating is disabled
+        """
+        if self.threshold is None:
+            return None
+
+        return cv2.resize(image_util.grayscaled_image(image), self.thumbnail_size, interpolation=cv2.INTER_AREA)
+
+    def difference(self, thumbnail1, thumbnail2):
+        """
+        Calculates the largest block difference between the two thumbnails.
+
+        :param thumbnail1: First thumbnail
+        :param thumbnail2: Second thumbnail
+        :return: Maximum absolute difference in gray levels
+        """
+        _, max_difference, _, _ = cv2.minMaxLoc(cv2.absdiff(thumbnail1, thumbnail2))
+        return max_difference
+
+    def statistics(self):
+        """
+        Returns the number of changed and unchanged images seen.
+
+        :return: Dictionary in form {"changed", "unchanged"}
+        """
+        with self.lock:
+            return {"changed": self.changed_frame_count,
+                    "unchanged": self.unchanged_frame_count}
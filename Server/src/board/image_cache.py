@@ -0,0 +1,143 @@
+from __future__ import with_statement
+from collections import OrderedDict
+from threading import RLock
+from util import enum
+
+
+ColorSpace = enum.Enum('COLOR', 'GRAYSCALE')
+
+
+class ImageCache(object):
+    """
+    Least recently used cache of images derived from board snapshots, fx. resized, grayscaled and area images, and of
+    preprocessing results of these, fx. thresholded images and contours.
+
+    Images are keyed by (snapshot id, area id, snapshot size, color space, operations), where area id is None for
+    whole board images and operations is the sequence of preprocessing operations applied. When the total size of the
+    cached images exceeds the byte budget the least recently used images are evicted.
+
+    Field variables:
+    max_size -- Byte budget
+    size -- Total size in bytes of the cached images
+    hit_count -- Number of lookups which found the image in the cache
+    miss_count -- Number of lookups which did not find the image in the cache
+    eviction_count -- Number of images evicted to stay within the byte budget
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024):
+        """
+        :param max_size: Byte budget
+        """
+        self.max_size = max_size
+
+        self.lock = RLock()
+        self.images = OrderedDict()
+        self.size = 0
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+
+    def key(self, snapshot_id, area_id, snapshot_size, color_space, operations=()):
+        return snapshot_id, area_id, snapshot_size, color_space, operations
+
+    def get(self, key):
+        """
+        Returns the cached image and marks it as most recently used.
+
+        :param key: Cache key
+        :return: Cached image, or None if not present
+        """
+        with self.lock:
+            image = self.images.pop(key, None)
+            if image is None:
+                self.miss_count += 1
+                return None
+
+            self.images[key] = image
+            self.hit_count += 1
+            return image
+
+    def put(self, key, image):
+        """
+        Adds the image to the cache, evicting least recently used images if the byte budget is exceeded.
+
+        :param key: Cache key
+        :param image: Image, or tuple of images and arrays
+        :return: The image
+        """
+        if image is None:
+            return None
+
+        with self.lock:
+            old_image = self.images.pop(key, None)
+            if old_image is not None:
+                self.size -= self.value_size(old_image)
+
+            self.images[key] = image
+            self.size += self.value_size(image)
+
+            self.evict()
+
+            return image
+
+    def get_or_create(self, key, create_function):
+        """
+        Returns the cached image, or creates and caches it if not present.
+
+        :param key: Cache key
+        :param create_function: Function returning the image, or None if it cannot be created
+        :return: Image
+        """
+        image = self.get(key)
+        if image is not None:
+            return image
+
+        # Create image without holding the lock, so other threads are not blocked while converting
+        return self.put(key, create_function())
+
+    def evict(self):
+        with self.lock:
+            while self.size > self.max_size and len(self.images) > 1:
+                _, image = self.images.popitem(last=False)
+                self.size -= self.value_size(image)
+                self.eviction_count += 1
+
+    def value_size(self, value):
+        """
+        Returns the size in bytes of the cached value, which is either an image or a tuple or list of images and
+        arrays, fx. contours.
+
+        :param value: Cached value
+        :return: Size in bytes
+        """
+        if isinstance(value, (tuple, list)):
+            return sum([self.value_size(item) for item in value])
+
+        return value.nbytes if value is not None else 0
+
+    def set_max_size(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+
+    def statistics(self):
+        """
+        Returns hit, miss and memory statistics.
+
+        :return: Dictionary in form {"hits", "misses", "evictions", "imageCount", "size", "maxSize"}
+        """
+        with self.lock:
+            return {"hits": self.hit_count,
+                    "misses": self.miss_count,
+                    "evictions": self.eviction_count,
+                    "imageCount": len(self.images),
+                    "size": self.size,
+                    "maxSize": self.max_size}
+
+
+shared_image_cache = ImageCache()
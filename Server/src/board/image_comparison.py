@@ -1,5 +1,7 @@
 import cv2
 import histogram_util
+import image_statistics
+from util import image_util
 
 
 def compare_images(image1, image2, threshold=1.0):
@@ -24,13 +26,7 @@ def image_comparison_score(image):
     :param image: Source image
     :return: The image comparison score
     """
-    (height, width) = image.shape[:2]
-
-    grayscaled_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    grayscaled_image = image_util.grayscaled_image(image)
     equalized_image = histogram_util.equalize_image(grayscaled_image)
 
-    histogram = histogram_util.histogram_from_image(equalized_image, 256)
-
-    median = histogram_util.histogram_median(histogram, width * height)
-
-    return median
+    return image_statistics.mean(equalized_image)
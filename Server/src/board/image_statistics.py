@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+
+def mean(image, mask=None):
+    """
+    Calculates the mean value of a single channel image.
+
+    :param image: Source image
+    :param mask: Optional mask
+    :return: Mean value
+    """
+    return cv2.mean(image, mask)[0]
+
+
+def min_max(image):
+    """
+    Finds the minimum and maximum values of a single channel image.
+
+    :param image: Source image
+    :return: (min value, max value)
+    """
+    min_value, max_value, _, _ = cv2.minMaxLoc(image)
+    return min_value, max_value
+
+
+def cumulative_histogram(image, bin_count=256):
+    """
+    Calculates the cumulative histogram of an 8 bit single channel image.
+
+    :param image: Source image
+    :param bin_count: Bin count
+    :return: Cumulative histogram
+    """
+    return np.cumsum(np.bincount(image.ravel(), minlength=bin_count))
+
+
+def percentiles(image, percentages):
+    """
+    Calculates the given percentiles of an 8 bit single channel image.
+
+    :param image: Source image
+    :param percentages: Percentages in range [0..1]
+    :return: List of values at the given percentiles
+    """
+    return percentiles_from_cumulative_histogram(cumulative_histogram(image), percentages)
+
+
+def percentiles_from_cumulative_histogram(cumulative_histogram, percentages):
+    """
+    Finds the given percentiles in a cumulative histogram.
+
+    :param cumulative_histogram: Cumulative histogram
+    :param percentages: Percentages in range [0..1]
+    :return: List of values at the given percentiles
+    """
+    total = cumulative_histogram[-1]
+    counts = np.asarray(percentages, dtype=np.float64) * float(total)
+    return np.searchsorted(cumulative_histogram, np.maximum(counts, 1), side='left').tolist()
+
+
+def otsu_threshold_from_histogram(histogram):
+    """
+    Calculates the OTSU threshold from a 256 bin histogram, equivalent to the threshold chosen by cv2.threshold with
+    cv2.THRESH_OTSU. Pixels with values less than or equal to the threshold are black.
+
+    :param histogram: Histogram
+    :return: OTSU threshold
+    """
+    histogram = np.asarray(histogram, dtype=np.float64).ravel()
+
+    total = histogram.sum()
+    if total == 0:
+        return 0
+
+    p = histogram / total
+    i = np.arange(len(p), dtype=np.float64)
+
+    q1 = np.cumsum(p)
+    q2 = 1.0 - q1
+    m1 = np.cumsum(i * p)
+    mu = m1[-1]
+
+    epsilon = np.finfo(np.float32).eps
+    valid = (np.minimum(q1, q2) >= epsilon) & (np.maximum(q1, q2) <= 1.0 - epsilon)
+    if not np.any(valid):
+        return 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu1 = m1 / q1
+        mu2 = (mu - m1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+
+    sigma[~valid] = -1.0
+    return int(np.argmax(sigma))
@@ -3,6 +3,7 @@ import numpy as np
 from marker import Marker
 from board.board_descriptor import BoardDescriptor
 from util import misc_math
+from board.preprocessed_image import PreprocessedImage
 
 
 class DefaultMarker(Marker):
@@ -28,31 +29,47 @@ class DefaultMarker(Marker):
 
     def find_markers_in_image(self, image):
 
+        # Find marker in OTSU'ed image
+        return self.find_markers_in_preprocessed_image(PreprocessedImage(image))
+
+    def find_markers_in_preprocessed_image(self, preprocessed_image):
+
         # OTSU image
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        image = cv2.blur(image, (2, 2))
-        ret, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        image = preprocessed_image.grayscaled().blurred((2, 2)).otsu_thresholded()
 
-        # Find marker in OTSU'ed image
-        return self.find_markers_in_thresholded_image(image)
+        # Find contours in image resized 2x
+        contours, hierarchy = image.resized(2).contours(cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 
-    def find_markers_in_thresholded_image(self, image):
+        return self.find_markers_in_contours(image.image, contours, hierarchy)
 
-        original_image = image
+    def find_markers_in_thresholded_image(self, image):
 
         # Resize image 2x
         image_height, image_width = image.shape[:2]
-        image = cv2.resize(image, (image_width * 2, image_height * 2))
+        resized_image = cv2.resize(image, (image_width * 2, image_height * 2))
+
+        # Find contours
+        contours, hierarchy = \
+            cv2.findContours(resized_image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+        return self.find_markers_in_contours(image, contours, hierarchy)
+
+    def find_markers_in_contours(self, original_image, contours, hierarchy):
+        """
+        Find all markers among contours found in thresholded image resized 2x.
+
+        :param original_image: Thresholded image
+        :param contours: Contours found in thresholded image resized 2x
+        :param hierarchy: Contour hierarchy
+        :return: List of markers each in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
 
         # Prepare constants
-        image_height, image_width = image.shape[:2]
+        image_height, image_width = original_image.shape[:2]
+        image_height, image_width = image_height * 2, image_width * 2
         min_marker_size = (image_width * 0.1) * (image_height * 0.1)
         max_marker_size = (image_width * 0.5) * (image_height * 0.5)
 
-        # Find contours
-        contours, hierarchy = \
-            cv2.findContours(image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
         if len(contours) == 0:
             return []
 
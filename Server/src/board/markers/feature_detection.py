@@ -0,0 +1,97 @@
+import cv2
+from util import enum
+
+
+FeatureType = enum.Enum('SIFT', 'ORB', 'BRISK', 'AKAZE')
+
+FLANN_INDEX_KDTREE = 0
+FLANN_INDEX_LSH = 6
+
+
+def feature_type_from_name(name):
+    """
+    Returns the feature type with the given name.
+
+    :param name: Name, fx. "ORB"
+    :return: Feature type, or None if unknown
+    """
+    return getattr(FeatureType, name.upper(), None)
+
+
+def is_binary_feature_type(feature_type):
+    """
+    Returns whether the feature type has binary descriptors, which are matched by Hamming distance.
+
+    :param feature_type: Feature type
+    :return: True if descriptors are binary
+    """
+    return feature_type != FeatureType.SIFT
+
+
+def is_feature_type_available(feature_type):
+    """
+    Returns whether the feature type is available in the installed OpenCV version.
+
+    :param feature_type: Feature type
+    :return: True if available
+    """
+    return create_feature_detector(feature_type) is not None
+
+
+def create_feature_detector(feature_type, max_features=1000):
+    """
+    Creates a feature detector and descriptor extractor, supporting both the OpenCV 2.4 and 3.x API.
+
+    :param feature_type: Feature type
+    :param max_features: Maximum number of features to detect, for detectors supporting it
+    :return: Feature detector, or None if not available
+    """
+    try:
+        if feature_type == FeatureType.SIFT:
+            return cv2.SIFT() if hasattr(cv2, "SIFT") else cv2.xfeatures2d.SIFT_create()
+        if feature_type == FeatureType.ORB:
+            return cv2.ORB(nfeatures=max_features) if hasattr(cv2, "ORB") else cv2.ORB_create(nfeatures=max_features)
+        if feature_type == FeatureType.BRISK:
+            return cv2.BRISK() if hasattr(cv2, "BRISK") else cv2.BRISK_create()
+        if feature_type == FeatureType.AKAZE:
+            return cv2.AKAZE_create() if hasattr(cv2, "AKAZE_create") else None
+    except (AttributeError, cv2.error):
+        return None
+
+    return None
+
+
+def create_descriptor_matcher(feature_type, brute_force=False):
+    """
+    Creates a matcher for descriptors of the feature type. Binary descriptors are matched by an LSH FLANN index or
+    Hamming distance brute force, other descriptors by a KD-tree FLANN index or L2 distance brute force.
+
+    :param feature_type: Feature type
+    :param brute_force: If true, matches by brute force instead of FLANN index
+    :return: Descriptor matcher
+    """
+    binary = is_binary_feature_type(feature_type)
+
+    if brute_force:
+        return cv2.BFMatcher(cv2.NORM_HAMMING if binary else cv2.NORM_L2)
+
+    if binary:
+        index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+    else:
+        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+
+    search_params = dict(checks=50)
+
+    return cv2.FlannBasedMatcher(index_params, search_params)
+
+
+def good_matches(matches, ratio=0.666):
+    """
+    Filters k-nearest neighbour matches by ratio test. Queries with less than two neighbours, which LSH indices may
+    return, are skipped.
+
+    :param matches: List of k-nearest neighbour matches for each query descriptor
+    :param ratio: Maximum distance ratio between best and second best match
+    :return: List of good matches
+    """
+    return [match[0] for match in matches if len(match) >= 2 and match[0].distance < ratio * match[1].distance]
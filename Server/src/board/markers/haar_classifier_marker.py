@@ -1,33 +1,129 @@
+from __future__ import with_statement
 import tempfile
+import hashlib
+import math
 import os
 import cv2
+import numpy as np
+from collections import OrderedDict
+from threading import Lock
+from multiprocessing.pool import ThreadPool
 from marker import Marker
+from util import image_util
+
+
+max_cached_cascades = 8
+region_thread_count = 4
+
+cascade_classifier_cache = OrderedDict()
+cascade_classifier_cache_lock = Lock()
+
+region_thread_pool = None
+region_thread_pool_lock = Lock()
+
+
+def cascade_classifiers(cascade_data, count=1):
+    """
+    Returns classifiers created from the given cascade data. Classifiers are cached by content hash, so that
+    reinitializing a marker with the same data does not load the cascade again. Only the most recently used cascades
+    are kept. Markers created from the same data share classifiers, and must therefore not detect concurrently.
+
+    :param cascade_data: Haar cascade classifier data
+    :param count: Number of classifiers, fx. one per thread detecting in parallel
+    :return: List of classifiers
+    """
+    key = hashlib.sha1(cascade_data).hexdigest()
+
+    with cascade_classifier_cache_lock:
+        classifiers = cascade_classifier_cache.pop(key, [])
+        if len(classifiers) < count:
+            classifiers.extend(load_cascade_classifiers(cascade_data, count - len(classifiers)))
+
+        # Mark as most recently used and forget least recently used cascades
+        cascade_classifier_cache[key] = classifiers
+        while len(cascade_classifier_cache) > max_cached_cascades:
+            cascade_classifier_cache.popitem(last=False)
+
+        return classifiers[:count]
+
+
+def region_search_thread_pool():
+    """
+    Returns the thread pool shared by all Haar classifier markers for searching regions in parallel.
+
+    :return: Thread pool
+    """
+    global region_thread_pool
+
+    with region_thread_pool_lock:
+        if region_thread_pool is None:
+            region_thread_pool = ThreadPool(processes=region_thread_count)
+        return region_thread_pool
+
+
+def load_cascade_classifiers(cascade_data, count):
+
+    # Create the classifiers from a temporary file containing the given data
+    cascade_file = tempfile.NamedTemporaryFile(delete=False)
+
+    try:
+        cascade_file.write(cascade_data)
+        cascade_file.close()
+
+        # Create classifiers
+        return [cv2.CascadeClassifier(cascade_file.name) for i in range(0, count)]
+    finally:
+        os.remove(cascade_file.name)
 
 
 class HaarClassifierMarker(Marker):
-    def __init__(self, marker_id, cascade_data):
+    """
+    Marker detected by a Haar cascade classifier.
+
+    With a region split, the image is split into a grid of overlapping regions which are searched in parallel by a
+    thread pool shared by all markers, each region using its own classifier.
+
+    Field variables:
+    min_size -- Minimum marker size in percentage [0..1] of smallest image dimension, or None
+    max_size -- Maximum marker size in percentage [0..1] of smallest image dimension, or None
+    scale_factor -- Scale factor between detection scales
+    region_split -- Number of regions [columns, rows] to search in parallel
+    """
+
+    def __init__(self, marker_id, cascade_data, min_size=None, max_size=None, scale_factor=1.1, region_split=(1, 1)):
         """
         :param marker_id: Marker ID
         :param cascade_data: Haar cascade classifier data
+        :param min_size: Minimum marker size in percentage [0..1] of smallest image dimension. (Optional)
+        :param max_size: Maximum marker size in percentage [0..1] of smallest image dimension. (Optional)
+        :param scale_factor: Scale factor between detection scales. Larger is faster but may miss markers
+        :param region_split: Number of regions [columns, rows] to search in parallel
         """
         super(HaarClassifierMarker, self).__init__(marker_id)
 
-        # Create the classifier from a temporary file containing the given data
-        cascade_file = tempfile.NamedTemporaryFile(delete=False)
-
-        try:
-            cascade_file.write(cascade_data)
-            cascade_file.close()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.scale_factor = scale_factor
+        self.region_split = region_split
 
-            # Create classifier
-            self.cascade_data = cv2.CascadeClassifier(cascade_file.name)
-        finally:
-            os.remove(cascade_file.name)
+        # Create classifiers
+        self.classifiers = cascade_classifiers(cascade_data, region_split[0] * region_split[1])
 
     def find_marker_in_image(self, image):
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        image = image_util.grayscaled_image(image)
         return self.find_marker_in_thresholded_image(image)
 
+    def find_marker_in_region(self, image, region):
+        x1, y1, x2, y2 = region
+        image_height, image_width = image.shape[:2]
+
+        # Find all markers in region, sized relative to whole image
+        markers = self.find_markers_in_thresholded_image(image_util.grayscaled_image(image[y1:y2, x1:x2]),
+                                                         bounds_image_size=(image_width, image_height))
+
+        # Return first marker
+        return markers[0] if len(markers) > 0 else None
+
     def find_marker_in_thresholded_image(self, image):
 
         # Find all markers
@@ -37,14 +133,92 @@ class HaarClassifierMarker(Marker):
         return markers[0] if len(markers) > 0 else None
 
     def find_markers_in_image(self, image):
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        image = image_util.grayscaled_image(image)
         return self.find_markers_in_thresholded_image(image)
 
-    def find_markers_in_thresholded_image(self, image):
-        matches = self.cascade_data.detectMultiScale(image)
+    def find_markers_in_preprocessed_image(self, preprocessed_image):
+        return self.find_markers_in_thresholded_image(preprocessed_image.grayscaled().image)
+
+    def find_markers_in_thresholded_image(self, image, bounds_image_size=None):
+        """
+        Find all markers in grayscaled image.
+
+        :param image: Grayscaled image
+        :param bounds_image_size: Image (width, height) which minimum and maximum marker size are relative to, fx. the
+                                  whole area image when searching a window of it. Image size if None
+        :return: List of markers each in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        image_height, image_width = image.shape[:2]
+
+        # Calculate size bounds
+        image_size = min(bounds_image_size) if bounds_image_size is not None else min(image_width, image_height)
+
+        min_size = int(image_size * self.min_size) if self.min_size is not None else None
+        max_size = int(image_size * self.max_size) if self.max_size is not None else None
+
+        # Find markers in regions, overlapping by maximum marker size
+        regions = self.split_regions(image_width, image_height, max_size if max_size is not None else min(image_width, image_height) / 4)
+
+        if len(regions) > 1:
+            rectangles = region_search_thread_pool().map(lambda i: self.detect_in_region(self.classifiers[i], image, regions[i], min_size, max_size), range(0, len(regions)))
+        else:
+            rectangles = [self.detect_in_region(self.classifiers[0], image, regions[0], min_size, max_size)]
+
+        # Remove markers found in overlap of several regions
+        matches = []
+        for (x, y, width, height) in [rectangle for region_rectangles in rectangles for rectangle in region_rectangles]:
+            center_x, center_y = x + (width / 2.0), y + (height / 2.0)
+            if not any([mx <= center_x <= mx + mw and my <= center_y <= my + mh for (mx, my, mw, mh) in matches]):
+                matches.append((x, y, width, height))
+
         return [{"markerId": self.marker_id,
-                 "x": int(x - (width / 2)),
-                 "y": int(y - (height / 2)),
-                 "width": int(width),
-                 "height": int(height),
-                 "angle": 0} for (x, y, width, height) in matches]
+                 "x": (x + (width / 2.0)) / float(image_width),
+                 "y": (y + (height / 2.0)) / float(image_height),
+                 "width": width / float(image_width),
+                 "height": height / float(image_height),
+                 "angle": 0,
+                 "contour": np.int32([[x, y], [x + width, y], [x + width, y + height], [x, y + height]]).reshape(-1, 1, 2)}
+                for (x, y, width, height) in matches]
+
+    def detect_in_region(self, classifier, image, region, min_size, max_size):
+        """
+        Detects markers in region of image.
+
+        :param classifier: Classifier
+        :param image: Grayscaled image
+        :param region: Region (x1, y1, x2, y2)
+        :param min_size: Minimum marker size in pixels, or None
+        :param max_size: Maximum marker size in pixels, or None
+        :return: List of marker rectangles (x, y, width, height) in image
+        """
+        x1, y1, x2, y2 = region
+
+        parameters = {"scaleFactor": self.scale_factor}
+        if min_size is not None:
+            parameters["minSize"] = (min_size, min_size)
+        if max_size is not None:
+            parameters["maxSize"] = (max_size, max_size)
+
+        matches = classifier.detectMultiScale(image[y1:y2, x1:x2], **parameters)
+
+        return [(x + x1, y + y1, width, height) for (x, y, width, height) in matches]
+
+    def split_regions(self, image_width, image_height, overlap):
+        """
+        Splits the image into overlapping regions.
+
+        :param image_width: Image width
+        :param image_height: Image height
+        :param overlap: Overlap in pixels
+        :return: List of regions (x1, y1, x2, y2)
+        """
+        columns, rows = self.region_split
+
+        region_width = int(math.ceil(float(image_width) / columns))
+        region_height = int(math.ceil(float(image_height) / rows))
+
+        return [(max((column * region_width) - overlap, 0),
+                 max((row * region_height) - overlap, 0),
+                 min(((column + 1) * region_width) + overlap, image_width),
+                 min(((row + 1) * region_height) + overlap, image_height))
+                for row in range(0, rows) for column in range(0, columns)]
@@ -2,71 +2,185 @@ import math
 import cv2
 import numpy as np
 from marker import Marker
+import feature_detection
+from feature_detection import FeatureType
 from board.board_descriptor import BoardDescriptor
+from board.preprocessed_image import PreprocessedImage
 from util import misc_math
+from util import image_util
 
 
 class ImageMarker(Marker):
-    def __init__(self, marker_id, marker_image, min_matches=8):
+    def __init__(self, marker_id, marker_image, min_matches=8, feature_type=FeatureType.SIFT, brute_force_matching=False,
+                 resolution=BoardDescriptor.SnapshotSize.LARGE, max_instances=1):
         """
         :param marker_id: Marker ID
         :param marker_image: Marker image
         :param min_matches: Minimum number of matches for marker to be detected
+        :param feature_type: Feature type. Binary features (ORB, BRISK, AKAZE) are much faster to detect than SIFT
+        :param brute_force_matching: If true, features are matched by brute force instead of FLANN index
+        :param resolution: Input image resolution (of type BoardDescriptor.SnapshotSize)
+        :param max_instances: Maximum number of instances of the marker to find in an image
         """
         super(ImageMarker, self).__init__(marker_id)
 
         self.min_matches = min_matches
+        self.feature_type = feature_type
+        self.brute_force_matching = brute_force_matching
+        self.resolution = resolution
+        self.max_instances = max_instances
 
         # Get size of query image
         self.query_image_height, self.query_image_width = marker_image.shape[:2]
 
-        # Initialize SIFT detector
-        self.sift = cv2.SIFT()
+        # Initialize feature detector
+        self.detector = feature_detection.create_feature_detector(feature_type)
 
-        # Initialize FLANN matcher
-        FLANN_INDEX_KDTREE = 0
-        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-        search_params = dict(checks=50)
-
-        self.flann = cv2.FlannBasedMatcher(index_params, search_params)
+        # Initialize matcher
+        self.matcher = feature_detection.create_descriptor_matcher(feature_type, brute_force=brute_force_matching)
 
         # Find features in marker image
-        self.kp1, self.des1 = self.sift.detectAndCompute(marker_image, None)
+        self.marker_points, self.marker_descriptors = \
+            PreprocessedImage(image_util.grayscaled_image(marker_image)).detect_features(self.detector)
+
+        # Train matcher with marker features
+        if self.marker_descriptors is not None:
+            self.matcher.add([self.marker_descriptors])
+            self.matcher.train()
 
     def preferred_input_image_resolution(self):
-        return BoardDescriptor.SnapshotSize.LARGE
+        return self.resolution
 
     def find_marker_in_image(self, image):
+        return self.find_marker_in_preprocessed_image(PreprocessedImage(image))
 
-        # Find features in image
-        kp2, des2 = self.sift.detectAndCompute(image, None)
+    def find_marker_in_preprocessed_image(self, preprocessed_image):
+        markers = self.find_instances_in_preprocessed_image(preprocessed_image, max_instances=1)
+        return markers[0] if len(markers) > 0 else None
 
-        if len(self.kp1) < 2 or len(kp2) < 2:
-            return None
+    def find_markers_in_preprocessed_image(self, preprocessed_image):
+        return self.find_instances_in_preprocessed_image(preprocessed_image, self.max_instances)
+
+    def find_instances_in_preprocessed_image(self, preprocessed_image, max_instances):
+        """
+        Find up to the given number of instances of the marker in image.
+
+        :param preprocessed_image: Preprocessed image
+        :param max_instances: Maximum number of instances to find
+        :return: List of markers each in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+
+        # Find features in image, shared with other markers of same feature type
+        points, descriptors = preprocessed_image.grayscaled().features(self.feature_type, self.detector)
+
+        # Match features
+        return self.match_features(preprocessed_image.image, points, descriptors, max_instances)
+
+    def match_features(self, image, points, descriptors, max_instances=1):
+        """
+        Matches the features found in image against the marker features. Each image feature is matched to its nearest
+        marker feature, so that several instances of the marker can be matched.
+
+        :param image: Image
+        :param points: Keypoint positions found in image
+        :param descriptors: Descriptors found in image
+        :param max_instances: Maximum number of instances to find
+        :return: List of markers each in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        if len(self.marker_points) < 2 or len(points) < 2:
+            return []
 
         # Find matches
-        matches = self.flann.knnMatch(self.des1, des2, k=2)
+        matches = self.matcher.knnMatch(descriptors, k=2)
 
         # Sort out bad matches
-        good_matches = []
-        for m, n in matches:
-            if m.distance < 0.666 * n.distance:
-                good_matches.append(m)
+        good_matches = feature_detection.good_matches(matches)
 
         # Check number of matches
         if len(good_matches) < self.min_matches:
-            return None
+            return []
+
+        # Find homographies between matches
+        src_pts = self.marker_points[[m.trainIdx for m in good_matches]]
+        dst_pts = points[[m.queryIdx for m in good_matches]]
+
+        return self.marker_results_from_matched_points(image, src_pts, dst_pts, max_instances)
+
+    def marker_results_from_matched_points(self, image, marker_points, image_points, max_instances=1):
+        """
+        Finds instances of the marker from matched points. A homography is found by RANSAC, after which its inliers
+        are removed and the next homography is found among the remaining matches, until too few matches remain.
+        Instances whose center lies inside an instance already found are skipped, as the outliers of an instance may
+        produce a homography at nearly the same place.
+
+        :param image: Image
+        :param marker_points: Matched keypoint positions in marker image
+        :param image_points: Matched keypoint positions in image
+        :param max_instances: Maximum number of instances to find
+        :return: List of markers each in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        src_pts = np.float32(marker_points).reshape(-1, 1, 2)
+        dst_pts = np.float32(image_points).reshape(-1, 1, 2)
+
+        marker_results = []
+
+        while len(marker_results) < max_instances and len(src_pts) >= max(self.min_matches, 4):
+
+            # Find homography between remaining matches
+            M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+            if M is None:
+                break
+
+            inliers = mask.ravel() != 0
+            if np.count_nonzero(inliers) < self.min_matches and len(marker_results) > 0:
+                break
+
+            # Convert into marker result
+            marker_result = self.marker_result_from_homography(image, M)
+            if marker_result is None:
+                break
+
+            # Skip instance overlapping instance already found
+            if not self.overlaps_marker_results(marker_result, marker_results):
+                marker_results.append(marker_result)
+
+            # Remove inliers
+            src_pts = src_pts[~inliers]
+            dst_pts = dst_pts[~inliers]
+
+        return marker_results
 
-        # Find homography between matches
-        src_pts = np.float32([self.kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([     kp2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+    def overlaps_marker_results(self, marker_result, marker_results):
+        """
+        Checks whether the center of the marker result lies inside the contour of any of the given marker results.
+
+        :param marker_result: Marker result
+        :param marker_results: Marker results
+        :return: True, if the marker result overlaps any of the marker results, else false
+        """
+        center_x, center_y = np.mean(np.float32(marker_result["contour"]).reshape(-1, 2), axis=0)
+        center = (float(center_x), float(center_y))
+
+        return any([cv2.pointPolygonTest(result["contour"], center, False) >= 0 for result in marker_results])
+
+    def marker_result_from_homography(self, image, M):
+        """
+        Extracts the marker result from the homography from marker image to image.
 
-        M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+        :param image: Image
+        :param M: Homography
+        :return: Marker in form {"markerId", "x", "y", "width", "height", "angle", "contour"}, or None if the marker
+                 contour is not convex
+        """
 
         # Transform points to board area
         pts = np.float32([[0, 0], [0, self.query_image_height - 1], [self.query_image_width - 1, self.query_image_height - 1], [self.query_image_width - 1, 0]]).reshape(-1,1,2)
         dst = cv2.perspectiveTransform(pts, M)
 
+        # Sort out degenerate homographies
+        if not cv2.isContourConvex(np.int32(dst)):
+            return None
+
         # Convert into marker result
         marker_result = self.contour_to_marker_result(image, np.int32(dst))
 
@@ -80,10 +194,7 @@ class ImageMarker(Marker):
         return self.find_marker_in_image(image)
 
     def find_markers_in_image(self, image):
-
-        # TODO! Extract all markers!
-        result = self.find_marker_in_image(image)
-        return [result] if result is not None else []
+        return self.find_markers_in_preprocessed_image(PreprocessedImage(image))
 
     def find_markers_in_thresholded_image(self, image):
         """
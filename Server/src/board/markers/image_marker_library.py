@@ -0,0 +1,206 @@
+from __future__ import with_statement
+import numpy as np
+from threading import Lock
+from board.preprocessed_image import PreprocessedImage
+import feature_detection
+
+
+class ImageMarkerLibrary(object):
+    """
+    Library of image markers matched against an image all at once.
+
+    The descriptors of all markers of the same feature type and matching method are concatenated into a single index,
+    trained once when markers are added or removed. Finding markers runs one k-nearest neighbour match of the image
+    descriptors against the index, where each good match votes for the marker owning the matched descriptor. Only
+    markers with at least their minimum number of matches in votes are verified by homography, so the cost stays
+    roughly flat as the number of markers grows.
+
+    Field variables:
+    markers -- Dictionary of image markers by marker id
+    max_neighbours -- Maximum number of nearest neighbours to find for each image descriptor
+    """
+
+    def __init__(self, max_neighbours=16):
+        self.lock = Lock()
+        self.markers = {}
+        self.tables = {}
+        self.max_neighbours = max_neighbours
+
+    def add(self, marker):
+        """
+        Adds the image marker to the library, replacing any marker with the same id.
+
+        :param marker: Image marker
+        """
+        with self.lock:
+            old_marker = self.markers.get(marker.marker_id)
+            self.markers[marker.marker_id] = marker
+
+            if old_marker is not None and self.table_key(old_marker) != self.table_key(marker):
+                self.build_table(self.table_key(old_marker))
+            self.build_table(self.table_key(marker))
+
+    def remove(self, marker_id):
+        """
+        Removes the marker with the given id from the library, if present.
+
+        :param marker_id: Marker ID
+        """
+        with self.lock:
+            marker = self.markers.pop(marker_id, None)
+            if marker is not None:
+                self.build_table(self.table_key(marker))
+
+    def clear(self):
+        """
+        Removes all markers from the library.
+        """
+        with self.lock:
+            self.markers = {}
+            self.tables = {}
+
+    def contains(self, marker):
+        """
+        Returns whether the given marker instance is in the library.
+
+        :param marker: Marker
+        :return: True if the marker is in the library
+        """
+        return self.markers.get(marker.marker_id) is marker
+
+    def table_key(self, marker):
+        """
+        Returns the key of the table holding the marker. Markers share a table if they have the same feature type and
+        matching method.
+
+        :param marker: Image marker
+        :return: Table key in form (feature type, brute force matching)
+        """
+        return marker.feature_type, marker.brute_force_matching
+
+    def build_table(self, key):
+        """
+        Builds and trains the descriptor index of all markers with the table key. The table is replaced as a whole,
+        so lookups running concurrently always see a consistent table.
+
+        :param key: Table key in form (feature type, brute force matching)
+        """
+        feature_type, brute_force_matching = key
+
+        markers = [marker for marker in self.markers.values()
+                   if self.table_key(marker) == key and marker.marker_descriptors is not None]
+
+        if len(markers) == 0:
+            self.tables.pop(key, None)
+            return
+
+        # Concatenate descriptors, remembering the owning marker and offset of each
+        descriptors = np.concatenate([marker.marker_descriptors for marker in markers])
+        marker_indices = np.concatenate([np.repeat(i, len(markers[i].marker_descriptors)) for i in range(0, len(markers))])
+        descriptor_offsets = np.cumsum([0] + [len(marker.marker_descriptors) for marker in markers])[:-1]
+
+        # Train index
+        matcher = feature_detection.create_descriptor_matcher(feature_type, brute_force=brute_force_matching)
+        matcher.add([descriptors])
+        matcher.train()
+
+        self.tables[key] = {"markers": markers,
+                            "matcher": matcher,
+                            "markerIndices": marker_indices,
+                            "descriptorOffsets": descriptor_offsets,
+                            "minMatches": np.array([marker.min_matches for marker in markers])}
+
+    def find_markers_in_image(self, image, marker_ids=None):
+        """
+        Find all markers in image.
+
+        :param image: Image
+        :param marker_ids: Only search for markers with these ids. All markers if None. (Optional)
+        :return: Dictionary of marker results by marker id, each a list of markers in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        return self.find_markers_in_preprocessed_image(PreprocessedImage(image), marker_ids)
+
+    def find_markers_in_preprocessed_image(self, preprocessed_image, marker_ids=None):
+        """
+        Find all markers in image, sharing features with other markers.
+
+        :param preprocessed_image: Preprocessed image
+        :param marker_ids: Only search for markers with these ids. All markers if None. (Optional)
+        :return: Dictionary of marker results by marker id, each a list of markers in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        results = {}
+
+        for (feature_type, _), table in self.tables.items():
+            markers = table["markers"]
+
+            if marker_ids is not None and not any([marker.marker_id in marker_ids for marker in markers]):
+                continue
+
+            # Find features in image
+            points, descriptors = preprocessed_image.grayscaled().features(feature_type, markers[0].detector)
+            if descriptors is None or len(points) < 2:
+                continue
+
+            # Match image features against all markers at once
+            k = max(2, min(2 * len(markers), self.max_neighbours, len(table["markerIndices"])))
+            matches = table["matcher"].knnMatch(descriptors, k=k)
+
+            # Sort out bad matches
+            image_indices, descriptor_indices = self.good_matches(matches, table["markerIndices"])
+            if len(image_indices) == 0:
+                continue
+
+            # Vote for markers
+            match_marker_indices = table["markerIndices"][descriptor_indices]
+            votes = np.bincount(match_marker_indices, minlength=len(markers))
+
+            # Verify markers with enough votes
+            for i in np.flatnonzero(votes >= table["minMatches"]):
+                marker = markers[i]
+
+                if marker_ids is not None and marker.marker_id not in marker_ids:
+                    continue
+
+                marker_matches = match_marker_indices == i
+                marker_points = marker.marker_points[descriptor_indices[marker_matches] - table["descriptorOffsets"][i]]
+
+                results[marker.marker_id] = marker.marker_results_from_matched_points(preprocessed_image.image, marker_points, points[image_indices[marker_matches]], marker.max_instances)
+
+        return results
+
+    def good_matches(self, matches, marker_indices, ratio=0.666):
+        """
+        Filters k-nearest neighbour matches by ratio test among the neighbours owned by the same marker, so that
+        markers with similar features, fx. the same marker added twice, do not cancel out each other's matches. An image
+        descriptor may thereby match several markers. If only one neighbour of a marker is among the k nearest, the
+        farthest neighbour is used as its second best, as the actual second best is even farther away.
+
+        :param matches: List of k-nearest neighbour matches for each image descriptor
+        :param marker_indices: Index of owning marker for each descriptor in index
+        :param ratio: Maximum distance ratio between best and second best match of the same marker
+        :return: (image descriptor indices, index descriptor indices) of good matches
+        """
+        image_indices = []
+        descriptor_indices = []
+
+        for neighbours in matches:
+            if len(neighbours) < 2:
+                continue
+
+            # Find best and second best neighbour of each marker. Neighbours are sorted by distance
+            best_matches = {}
+            second_best_distances = {}
+            for match in neighbours:
+                marker_index = marker_indices[match.trainIdx]
+                if marker_index not in best_matches:
+                    best_matches[marker_index] = match
+                elif marker_index not in second_best_distances:
+                    second_best_distances[marker_index] = match.distance
+
+            # Ratio test
+            for marker_index, match in best_matches.iteritems():
+                if match.distance < ratio * second_best_distances.get(marker_index, neighbours[-1].distance):
+                    image_indices.append(match.queryIdx)
+                    descriptor_indices.append(match.trainIdx)
+
+        return np.array(image_indices, dtype=np.int32), np.array(descriptor_indices, dtype=np.int32)
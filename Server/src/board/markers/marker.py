@@ -3,6 +3,12 @@ from board.board_descriptor import BoardDescriptor
 
 
 class Marker(object):
+    """
+    Field variables:
+    marker_id -- Marker ID
+    max_instances -- Maximum number of instances of the marker reported when finding all markers
+    """
+    max_instances = 1
 
     def __init__(self, marker_id):
         """
@@ -36,6 +42,16 @@ class Marker(object):
         """
         return []
 
+    def find_markers_in_preprocessed_image(self, preprocessed_image):
+        """
+        Find all markers in image, drawing grayscaled and thresholded images and contours from the preprocessing
+        results shared with other markers. Defaults to searching the image itself.
+
+        :param preprocessed_image: Preprocessed image
+        :return: List of markers each in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        return self.find_markers_in_image(preprocessed_image.image)
+
     def find_marker_in_image(self, image):
         """
         Find marker in image.
@@ -45,6 +61,18 @@ class Marker(object):
         """
         return None
 
+    def find_marker_in_region(self, image, region):
+        """
+        Find marker in region of image, fx. a search window around the last known position of the marker. Defaults to
+        searching the cropped region.
+
+        :param image: Image
+        :param region: Region (x1, y1, x2, y2)
+        :return: Marker relative to region in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        x1, y1, x2, y2 = region
+        return self.find_marker_in_image(image[y1:y2, x1:x2])
+
     def find_marker_in_thresholded_image(self, image):
         """
         Find marker in image which has already been thresholded.
@@ -54,6 +82,17 @@ class Marker(object):
         """
         return None
 
+    def find_marker_in_preprocessed_image(self, preprocessed_image):
+        """
+        Find marker in image, drawing grayscaled and thresholded images and contours from the preprocessing results
+        shared with other markers.
+
+        :param preprocessed_image: Preprocessed image
+        :return: Marker in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        markers = self.find_markers_in_preprocessed_image(preprocessed_image)
+        return markers[0] if len(markers) > 0 else None
+
     def contour_to_marker_result(self, image, contour):
         """
         Extracts marker result from contour.
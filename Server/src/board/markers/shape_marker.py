@@ -3,8 +3,10 @@ import math
 import numpy as np
 from marker import Marker
 from board.board_descriptor import BoardDescriptor
+from board.preprocessed_image import PreprocessedImage
 from util import misc_math
 from util import contour_util
+from util import image_util
 
 
 class ShapeMarker(Marker):
@@ -56,7 +58,7 @@ class ShapeMarker(Marker):
     def extract_marker_contour_from_image(self, image):
 
         # OTSU image
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        image = image_util.grayscaled_image(image)
         ret, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
 
         # Find contours
@@ -97,25 +99,51 @@ class ShapeMarker(Marker):
 
     def find_markers_in_image(self, image):
 
+        # Find marker in thresholded image
+        return self.find_markers_in_preprocessed_image(PreprocessedImage(image))
+
+    def find_markers_in_preprocessed_image(self, preprocessed_image):
+
+        # Find marker in thresholded image
+        thresholded_image = self.thresholded_image(preprocessed_image)
+        contours, _ = thresholded_image.contours(cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+
+        return self.find_markers_in_contours(thresholded_image.image, contours)
+
+    @staticmethod
+    def thresholded_image(preprocessed_image):
+        """
+        Thresholds the image the same way for all shape markers.
+
+        :param preprocessed_image: Preprocessed image
+        :return: Preprocessed thresholded image
+        """
+
         # Blur to remove noise
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        image = cv2.blur(image, (1, 1))
+        image = preprocessed_image.grayscaled().blurred((1, 1))
 
         # Threshold by using OTSU
         #image = cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-        ret, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        image = image.otsu_thresholded()
 
         # Remove noise again
-        image = cv2.dilate(image, (5, 5))
-        image = cv2.erode(image, (5, 5))
-
-        # Find marker in image
-        return self.find_markers_in_thresholded_image(image)
+        return image.dilated((5, 5)).eroded((5, 5))
 
     def find_markers_in_thresholded_image(self, image):
 
         # Find contours
         contours, _ = cv2.findContours(image.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+
+        return self.find_markers_in_contours(image, contours)
+
+    def find_markers_in_contours(self, image, contours):
+        """
+        Find all markers among contours found in thresholded image.
+
+        :param image: Thresholded image
+        :param contours: Contours
+        :return: List of markers each in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
         if len(contours) == 0:
             return []
 
@@ -133,38 +161,51 @@ class ShapeMarker(Marker):
                 #cv2.imshow('Contours', image2)
                 #cv2.waitKey(0)
 
-                # Extract result
-                result = self.contour_to_marker_result(image, matched_contour)
+                # Append marker to result list
+                markers.append(self.matched_contour_to_marker_result(image, matched_contour, marker_contour_start_index))
+
+        # Return markers
+        return markers
+
+    def matched_contour_to_marker_result(self, image, matched_contour, marker_contour_start_index):
+        """
+        Extracts marker result from matched contour, with angle and center relative to the marker contour.
 
-                # Calculate correct angle and center
-                matched_contour_center = contour_util.contour_center(matched_contour)
+        :param image: Image
+        :param matched_contour: Matched contour
+        :param marker_contour_start_index: Start index into marker contour
+        :return: Result in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
 
-                contour_angle = contour_util.contour_angle(matched_contour,
-                                                           matched_contour[0][0],
-                                                           matched_contour_center)
-                marker_angle = contour_util.contour_angle(self.marker_contour,
-                                                          self.marker_contour[marker_contour_start_index][0],
-                                                          self.marker_center)
-                angle = contour_angle - marker_angle
+        # Extract result
+        result = self.contour_to_marker_result(image, matched_contour)
 
-                image_height, image_width = image.shape[:2]
+        # Calculate correct angle and center
+        matched_contour_center = contour_util.contour_center(matched_contour)
 
-                result["angle"] = angle * 180.0 / math.pi
-                result["x"] = matched_contour_center[0] / float(image_width),
-                result["y"] = matched_contour_center[1] / float(image_height)
+        contour_angle = contour_util.contour_angle(matched_contour,
+                                                   matched_contour[0][0],
+                                                   matched_contour_center)
+        marker_angle = contour_util.contour_angle(self.marker_contour,
+                                                  self.marker_contour[marker_contour_start_index][0],
+                                                  self.marker_center)
+        angle = contour_angle - marker_angle
 
-                # Append marker to result list
-                markers.append(result)
+        image_height, image_width = image.shape[:2]
 
-        # Return markers
-        return markers
+        result["angle"] = angle * 180.0 / math.pi
+        result["x"] = matched_contour_center[0] / float(image_width)
+        result["y"] = matched_contour_center[1] / float(image_height)
 
-    def match_contour(self, contour, image):
+        return result
+
+    def match_contour(self, contour, image, approxed_contour=None):
         """
         Algorithm: XXX
 
         :param contour: Contour
         :param image: Image
+        :param approxed_contour: Simplified contour, if already calculated. (Optional)
         :return (Matched contour, start index into marker contour)
         """
         image_height, image_width = image.shape[:2]
@@ -202,7 +243,8 @@ class ShapeMarker(Marker):
             return None, None
 
         # Simplify contour
-        approxed_contour = contour_util.simplify_contour(contour)
+        if approxed_contour is None:
+            approxed_contour = contour_util.simplify_contour(contour)
 
         #contour_util.draw_contour(image.copy(), contour=approxed_contour, scale=1, points_color=(0, 255, 0))
         #cv2.waitKey(0)
@@ -216,11 +258,16 @@ class ShapeMarker(Marker):
             #print("Number of lines to many: %f < %f" % (len(approxed_contour), len(self.marker_contour) * 2))
             return None, None
 
+        # Calculate distances and headings between all contour points once for all start points
+        distances = contour_util.pairwise_distances(approxed_contour)
+        headings = contour_util.pairwise_headings(approxed_contour)
+
         # Go through source points
         for start_index in range(0, self.marker_length):
 
             # Match points in contour with marker
-            matched_contour_index_map = self.match_points(approxed_contour, start_index, 1 if orientation == self.marker_orientation else -1, contour_arc_length=arclength, image=None)
+            matched_contour_index_map = self.match_points(approxed_contour, start_index, 1 if orientation == self.marker_orientation else -1, contour_arc_length=arclength, image=None,
+                                                          distances=distances, headings=headings)
 
             # Check match
             if matched_contour_index_map is not None:
@@ -231,7 +278,8 @@ class ShapeMarker(Marker):
 
         return None, None
 
-    def match_points(self, contour, marker_start_offset, direction, contour_arc_length=None, image=None):
+    def match_points(self, contour, marker_start_offset, direction, contour_arc_length=None, image=None,
+                     distances=None, headings=None):
         """
         Match points against marker.
 
@@ -240,6 +288,8 @@ class ShapeMarker(Marker):
         :param direction: Direction, -1 or 1
         :param contour_arc_length: Contour arc length, for optimization reasons
         :param image: Image, for debug
+        :param distances: Pairwise distances between contour points, for optimization reasons
+        :param headings: Pairwise headings between contour points, for optimization reasons
         :return: Matched points index map in contour
         """
 
@@ -254,6 +304,12 @@ class ShapeMarker(Marker):
         if contour_arc_length is None:
             contour_arc_length = cv2.arcLength(contour, True)
 
+        # Calculate distances and headings
+        if distances is None:
+            distances = contour_util.pairwise_distances(contour)
+        if headings is None:
+            headings = contour_util.pairwise_headings(contour)
+
         # Reset indices
         contour_idx1 = contour_length - 1
         contour_idx2 = 0
@@ -289,7 +345,7 @@ class ShapeMarker(Marker):
                 cv2.waitKey(0)
 
             # Calculate contour line length
-            contour_line_length = misc_math.line_length(contour[contour_idx2 % contour_length][0], contour[contour_idx3 % contour_length][0])
+            contour_line_length = distances[contour_idx2 % contour_length, contour_idx3 % contour_length]
 
             # Get line unit lengths
             marker_unit_distance = max(self.marker_distance_map[orientation][marker_offset][1], min_threshold)
@@ -303,9 +359,10 @@ class ShapeMarker(Marker):
 
                 # Calculate angles
                 marker_angle = self.marker_angle_map[orientation][marker_offset]
-                contour_angle = self.contour_angle(contour, contour_idx1 % contour_length, contour_idx2 % contour_length, contour_idx3 % contour_length)
+                contour_angle = (headings[contour_idx2 % contour_length, contour_idx3 % contour_length] -
+                                 headings[contour_idx2 % contour_length, contour_idx1 % contour_length]) % (math.pi * 2.0)
 
-                delta_angle = math.atan2(math.sin(marker_angle - contour_angle), math.cos(marker_angle - contour_angle))
+                delta_angle = misc_math.angle_difference(marker_angle, contour_angle)
 
                 # Check angle
                 #print("%i, %i: Angle: %f vs %s = %f" % (marker_offset, contour_idx3, contour_angle, marker_angle, abs(delta_angle)))
@@ -347,45 +404,37 @@ class ShapeMarker(Marker):
         :return: Whether all lines not covered by index map points lies on lines spanned by points in distance map
         """
 
-        # Check all points not covered by index map
+        # Find lines with points between
         contour_length = len(contour)
-        index_map_length = len(index_map)
-
-        for i in range(0, index_map_length):
-
-            # Calculate delta index
-            idx1 = index_map[i]
-            idx2 = index_map[(i + 1) % index_map_length]
 
-            delta_index = abs(idx1 - idx2)
+        idx1 = np.asarray(index_map)
+        idx2 = np.roll(idx1, -1)
 
-            # Check if there are any points between
-            if delta_index == 1 or delta_index == contour_length - 1:
-                continue
+        delta_index = np.abs(idx1 - idx2)
+        has_points_between = (delta_index != 1) & (delta_index != contour_length - 1)
 
-            # Calculate total length of lines
-            lines_distance = 0.0
+        if not has_points_between.any():
+            return True
 
-            idx = idx1
-            prev_idx = idx
+        # Calculate total length of lines between points from cumulative arc lengths
+        arc_lengths = contour_util.cumulative_arc_lengths(contour)
 
-            while idx != idx2:
-                idx = (idx + 1) % contour_length
+        lines_distance = arc_lengths[idx2] - arc_lengths[idx1]
+        lines_distance[idx2 < idx1] += arc_lengths[-1]
 
-                # Calculate line length
-                lines_distance += misc_math.line_length(contour[idx][0], contour[prev_idx][0])
+        # Check distances
+        distance = np.asarray(distance_map)[:, 0]
 
-                prev_idx = idx
+        lines_distance = lines_distance[has_points_between]
+        distance = distance[has_points_between]
 
-            # Check distances
-            distance = distance_map[i][0]
-            distance_ratio = max(distance, lines_distance) / min(distance, lines_distance)
+        min_distance = np.minimum(distance, lines_distance)
+        if (min_distance <= 0.0).any():
+            return False
 
-            if distance_ratio - 1.0 > self.spike_tolerance:
-                return False
+        distance_ratio = np.maximum(distance, lines_distance) / min_distance
 
-        # Success
-        return True
+        return not (distance_ratio - 1.0 > self.spike_tolerance).any()
 
     def distance_map_for_contour(self, contour, direction, index_map=None):
         """
@@ -394,33 +443,26 @@ class ShapeMarker(Marker):
         :param contour: Contour
         :param direction: Direction
         :param index_map: Index map. (Optional)
-        :return: Distance map in form [(distance, normalized distance), ...]
+        :return: Distance map array in form [(distance, normalized distance), ...]
         """
 
-        contour_length = len(contour)
         contour_arclength = cv2.arcLength(contour, self.closed)
 
         offset = -1 if direction == -1 else 0
 
         # Calculate index map
-        if index_map is None:
-            index_map = [i for i in range(0, contour_length)]
-
-        index_map_length = len(index_map)
+        points = contour_util.contour_points(contour)
+        if index_map is not None:
+            points = points[np.asarray(index_map)]
 
-        # Calculate distance offset
-        distance_map = []
+        # Calculate distance from each point to next point
+        start_points = np.roll(points, -offset, axis=0)
+        end_points = np.roll(points, -(offset + 1), axis=0)
 
-        for i in range(0, index_map_length):
-            idx1 = ((i + offset    ) + index_map_length) % index_map_length
-            idx2 = ((i + offset + 1) + index_map_length) % index_map_length
-
-            line_length = misc_math.line_length(contour[index_map[idx1]][0], contour[index_map[idx2]][0])
-
-            distance_map.append(line_length)
+        distances = np.sqrt(((end_points - start_points) ** 2).sum(axis=1))
 
         # Return distances including unit distances
-        return [(distance, distance / contour_arclength) for distance in distance_map]
+        return np.column_stack((distances, distances / contour_arclength))
 
     def angle_map_for_contour(self, contour, direction):
         """
@@ -431,20 +473,15 @@ class ShapeMarker(Marker):
         :return: Angle map
         """
 
-        contour_length = len(contour)
+        points = contour_util.contour_points(contour)
 
         # Compute angle map
-        angle_map = []
-
-        for i in range(0, contour_length):
-            idx1 = ((i - direction) + contour_length) % contour_length
-            idx2 = ((i            ) + contour_length) % contour_length
-            idx3 = ((i + direction) + contour_length) % contour_length
+        previous_vectors = np.roll(points, direction, axis=0) - points
+        next_vectors = np.roll(points, -direction, axis=0) - points
 
-            angle = self.contour_angle(contour, idx1, idx2, idx3)
-            angle_map.append(angle)
+        angles = np.arctan2(next_vectors[:, 1], next_vectors[:, 0]) - np.arctan2(previous_vectors[:, 1], previous_vectors[:, 0])
 
-        return angle_map
+        return angles % (math.pi * 2.0)
 
     def contour_angle(self, contour, idx1, idx2, idx3):
         return self.points_angle(contour[idx1][0], contour[idx2][0], contour[idx3][0])
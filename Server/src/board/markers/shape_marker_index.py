@@ -0,0 +1,303 @@
+from __future__ import with_statement
+import cv2
+import math
+import numpy as np
+from threading import Lock
+from shape_marker import ShapeMarker
+from board.preprocessed_image import PreprocessedImage
+from util import contour_util
+
+
+class ShapeMarkerIndex(object):
+    """
+    Index of shape descriptors of registered shape markers. Finding markers in an image first looks up the few markers
+    worth matching against each contour, instead of running the full contour matching of every marker on every
+    contour.
+
+    Each shape is described by its vertex count, compactness (area/perimeter ratio normalized to 1 for a circle), Hu
+    moments and a quantized turning function signature, all invariant to position, scale and rotation. Both markers
+    and contours are described from their simplified polygons, the same representation the contour matching works on.
+    The descriptors of all markers are kept in arrays, so that looking up the candidates of a contour is a single
+    vectorized comparison.
+
+    The descriptor tolerances of each marker are derived from its distance and angle tolerances, so that the index
+    does not reject contours which the contour matching of the marker would accept.
+
+    Field variables:
+    markers -- Dictionary of indexed markers by marker id
+    """
+    signature_length = 32
+
+    def __init__(self):
+        self.lock = Lock()
+        self.markers = {}
+        self.descriptors = {}
+        self.table = None
+
+    def add(self, marker):
+        """
+        Adds the shape marker to the index, replacing any marker with the same id. Markers with a degenerate contour
+        are not indexed.
+
+        :param marker: Shape marker
+        """
+        descriptor = self.shape_descriptor(marker.marker_contour)
+
+        with self.lock:
+            if descriptor is not None:
+                self.markers[marker.marker_id] = marker
+                self.descriptors[marker.marker_id] = descriptor
+            else:
+                self.markers.pop(marker.marker_id, None)
+                self.descriptors.pop(marker.marker_id, None)
+
+            self.build_table()
+
+    def remove(self, marker_id):
+        """
+        Removes the marker with the given id from the index, if present.
+
+        :param marker_id: Marker ID
+        """
+        with self.lock:
+            self.markers.pop(marker_id, None)
+            self.descriptors.pop(marker_id, None)
+            self.build_table()
+
+    def clear(self):
+        """
+        Removes all markers from the index.
+        """
+        with self.lock:
+            self.markers = {}
+            self.descriptors = {}
+            self.table = None
+
+    def contains(self, marker):
+        """
+        Returns whether the given marker instance is indexed.
+
+        :param marker: Marker
+        :return: True if the marker is indexed
+        """
+        return self.markers.get(marker.marker_id) is marker
+
+    def build_table(self):
+        """
+        Builds the descriptor arrays of all markers. The table is replaced as a whole, so lookups running concurrently
+        always see a consistent table.
+        """
+        if len(self.markers) == 0:
+            self.table = None
+            return
+
+        marker_ids = self.markers.keys()
+        descriptors = [self.descriptors[marker_id] for marker_id in marker_ids]
+
+        # Prepare all cyclic shifts of marker signatures, as the start point of a contour is arbitrary
+        signatures = np.array([[np.roll(descriptor["signature"], shift) for shift in range(0, self.signature_length)]
+                               for descriptor in descriptors])
+
+        # Derive descriptor tolerances from marker tolerances
+        tolerances = [self.descriptor_tolerances(self.markers[marker_id]) for marker_id in marker_ids]
+
+        self.table = {"markers": [self.markers[marker_id] for marker_id in marker_ids],
+                      "vertexCounts": np.array([descriptor["vertexCount"] for descriptor in descriptors]),
+                      "compactness": np.array([descriptor["compactness"] for descriptor in descriptors]),
+                      "huMoments": np.array([descriptor["huMoments"] for descriptor in descriptors]),
+                      "signatures": signatures,
+                      "compactnessTolerances": np.array([tolerance["compactness"] for tolerance in tolerances]),
+                      "huMomentTolerances": np.array([tolerance["huMoments"] for tolerance in tolerances]),
+                      "signatureTolerances": np.array([tolerance["signature"] for tolerance in tolerances])}
+
+    def descriptor_tolerances(self, marker):
+        """
+        Derives the descriptor tolerances of the marker from its distance and angle tolerances. Each edge may be up to
+        the distance tolerance longer or shorter than the marker edge, which changes the area/perimeter ratio and the
+        second order moments by up to the square of the edge length ratio. Each corner may turn up to the angle
+        tolerance more or less than the marker corner, which together with the shifted edge lengths bends the turning
+        function.
+
+        :param marker: Shape marker
+        :return: Tolerances in form {"compactness", "huMoments", "signature"}, relative to marker compactness, relative
+                 to first Hu moment of marker and as mean turning function difference in radians, respectively
+        """
+        scale_tolerance = ((1.0 + marker.distance_tolerance) ** 2) - 1.0
+
+        return {"compactness": scale_tolerance,
+                "huMoments": scale_tolerance,
+                "signature": (marker.angle_tolerance * 2.0) + marker.distance_tolerance}
+
+    def candidates(self, descriptor, marker_ids=None):
+        """
+        Looks up the markers worth matching against a contour with the given descriptor.
+
+        :param descriptor: Contour shape descriptor
+        :param marker_ids: Only return markers with these ids. All markers if None. (Optional)
+        :return: List of candidate markers
+        """
+        table = self.table
+        if table is None or descriptor is None:
+            return []
+
+        # Vertex count of simplified contour must be within [marker vertex count, 2 * marker vertex count]
+        vertex_counts = table["vertexCounts"]
+        mask = (descriptor["vertexCount"] >= vertex_counts) & (descriptor["vertexCount"] <= vertex_counts * 2)
+
+        # Compactness
+        compactness = table["compactness"]
+        mask &= np.abs(compactness - descriptor["compactness"]) <= compactness * table["compactnessTolerances"]
+
+        # Hu moments
+        hu_moments = table["huMoments"]
+        hu_moment_differences = np.abs(hu_moments - descriptor["huMoments"]).max(axis=1)
+        mask &= hu_moment_differences <= hu_moments[:, 0] * table["huMomentTolerances"]
+
+        if not mask.any():
+            return []
+
+        # Turning function signature, for best matching start point
+        signatures = table["signatures"][mask]
+        signature_differences = np.abs(signatures - descriptor["signature"]).mean(axis=2).min(axis=1)
+
+        candidates = [table["markers"][i] for i, signature_difference in zip(np.flatnonzero(mask), signature_differences)
+                      if signature_difference <= table["signatureTolerances"][i]]
+
+        if marker_ids is not None:
+            candidates = [marker for marker in candidates if marker.marker_id in marker_ids]
+
+        return candidates
+
+    def find_markers_in_image(self, image, marker_ids=None):
+        """
+        Find all indexed markers in image.
+
+        :param image: Image
+        :param marker_ids: Only search for markers with these ids. All markers if None. (Optional)
+        :return: Dictionary of marker results by marker id, each a list of markers in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        return self.find_markers_in_preprocessed_image(PreprocessedImage(image), marker_ids)
+
+    def find_markers_in_preprocessed_image(self, preprocessed_image, marker_ids=None):
+        """
+        Find all indexed markers in image, sharing thresholded image and contours with other markers.
+
+        :param preprocessed_image: Preprocessed image
+        :param marker_ids: Only search for markers with these ids. All markers if None. (Optional)
+        :return: Dictionary of marker results by marker id, each a list of markers in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        if self.table is None:
+            return {}
+
+        thresholded_image = ShapeMarker.thresholded_image(preprocessed_image)
+        contours, _ = thresholded_image.contours(cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+
+        return self.find_markers_in_contours(thresholded_image.image, contours, marker_ids)
+
+    def find_markers_in_thresholded_image(self, image, marker_ids=None):
+        """
+        Find all indexed markers in image which has already been thresholded.
+
+        :param image: Thresholded image
+        :param marker_ids: Only search for markers with these ids. All markers if None. (Optional)
+        :return: Dictionary of marker results by marker id, each a list of markers in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        contours, _ = cv2.findContours(image.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+
+        return self.find_markers_in_contours(image, contours, marker_ids)
+
+    def find_markers_in_contours(self, image, contours, marker_ids=None):
+        """
+        Find all indexed markers among contours found in thresholded image.
+
+        :param image: Thresholded image
+        :param contours: Contours
+        :param marker_ids: Only search for markers with these ids. All markers if None. (Optional)
+        :return: Dictionary of marker results by marker id, each a list of markers in form {"markerId", "x", "y", "width", "height", "angle", "contour"}
+        """
+        results = {}
+
+        if self.table is None:
+            return results
+
+        for contour in contours:
+
+            # Simplify contour once for all markers
+            approxed_contour = contour_util.simplify_contour(contour)
+
+            # Match contour against candidate markers only
+            for marker in self.candidates(self.shape_descriptor(approxed_contour), marker_ids):
+                matched_contour, marker_contour_start_index = marker.match_contour(contour, image, approxed_contour=approxed_contour)
+
+                if matched_contour is not None:
+                    result = marker.matched_contour_to_marker_result(image, matched_contour, marker_contour_start_index)
+                    results.setdefault(marker.marker_id, []).append(result)
+
+        return results
+
+    def shape_descriptor(self, approxed_contour):
+        """
+        Calculates the shape descriptor of the simplified contour.
+
+        :param approxed_contour: Simplified contour
+        :return: Descriptor in form {"vertexCount", "compactness", "huMoments", "signature"}, or None if the contour is degenerate
+        """
+        polygon = np.float32(contour_util.contour_points(approxed_contour)).reshape(-1, 1, 2)
+
+        arclength = cv2.arcLength(polygon, True)
+        moments = cv2.moments(polygon)
+
+        if arclength <= 0.0 or moments["m00"] == 0.0:
+            return None
+
+        signature = self.turning_function_signature(approxed_contour)
+        if signature is None:
+            return None
+
+        # Second order Hu moments are compared as square root to be of same magnitude as the first
+        hu_moments = cv2.HuMoments(moments).flatten()
+
+        return {"vertexCount": len(approxed_contour),
+                "compactness": 4.0 * math.pi * abs(moments["m00"]) / (arclength * arclength),
+                "huMoments": np.array([hu_moments[0], math.sqrt(abs(hu_moments[1]))]),
+                "signature": signature}
+
+    def turning_function_signature(self, contour):
+        """
+        Calculates the turning function of the contour, that is, the heading of the contour as function of the
+        normalized arc length, minus the steady turning of a circle. The function is sampled at signature length
+        positions and centered, making it invariant to rotation. All contours are traversed in the same direction.
+
+        :param contour: Simplified contour
+        :return: Turning function signature, or None if the contour has less than three edges
+        """
+        points = contour_util.contour_points(contour)
+
+        # Traverse all contours in same direction
+        if cv2.contourArea(np.float32(points), True) < 0:
+            points = points[::-1]
+
+        # Calculate edges
+        edges = np.roll(points, -1, axis=0) - points
+        lengths = np.sqrt((edges ** 2).sum(axis=1))
+
+        edges = edges[lengths > 0.0]
+        lengths = lengths[lengths > 0.0]
+
+        if len(edges) < 3:
+            return None
+
+        # Calculate accumulated heading at each edge
+        headings = np.arctan2(edges[:, 1], edges[:, 0])
+        turns = ((np.roll(headings, -1) - headings + math.pi) % (math.pi * 2.0)) - math.pi
+
+        total_turning = turns.sum()
+        headings = headings[0] + np.concatenate(([0.0], np.cumsum(turns[:-1])))
+
+        # Sample heading at normalized arc length positions
+        edge_starts = np.concatenate(([0.0], np.cumsum(lengths)[:-1])) / lengths.sum()
+        positions = (np.arange(self.signature_length) + 0.5) / self.signature_length
+
+        signature = headings[np.searchsorted(edge_starts, positions, side="right") - 1] - (total_turning * positions)
+
+        return signature - signature.mean()
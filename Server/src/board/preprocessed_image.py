@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+from util import image_util
+from board.image_cache import ImageCache
+
+
+class PreprocessedImage(object):
+    """
+    Image with cached preprocessing results, fx. grayscaled, blurred and thresholded images, contours and features.
+
+    Each preprocessing operation returns a new preprocessed image whose key is extended by the operation and its
+    parameters. Results are kept in the image cache of the board snapshot, so markers searching the same area image
+    share one threshold, one contour extraction and one feature extraction per frame.
+
+    Field variables:
+    image -- Image
+    image_cache -- Cache holding preprocessing results
+    key -- Cache key of image
+    """
+
+    def __init__(self, image, image_cache=None, key=None):
+        """
+        :param image: Image
+        :param image_cache: Cache holding preprocessing results. If None, results are cached for this image only
+        :param key: Cache key of image, ending with the operations applied. Must be given if image cache is given
+        """
+        self.image = image
+        self.image_cache = image_cache if image_cache is not None else ImageCache()
+        self.key = key if key is not None else (None, None, None, None, ())
+
+    def operation_key(self, operation):
+        return self.key[:-1] + (self.key[-1] + (operation,),)
+
+    def preprocessed(self, operation, create_function):
+        """
+        Returns the cached result of applying the operation, creating it if not present.
+
+        :param operation: Operation in form (name, parameters...)
+        :param create_function: Function returning the image resulting from the operation
+        :return: Preprocessed image
+        """
+        key = self.operation_key(operation)
+        return PreprocessedImage(self.image_cache.get_or_create(key, create_function), self.image_cache, key)
+
+    def grayscaled(self):
+        if image_util.is_grayscaled(self.image):
+            return self
+        return self.preprocessed(("grayscaled",), lambda: image_util.grayscaled_image(self.image))
+
+    def blurred(self, kernel_size):
+        return self.preprocessed(("blurred", kernel_size), lambda: cv2.blur(self.image, kernel_size))
+
+    def otsu_thresholded(self):
+        return self.preprocessed(("otsu",), lambda: cv2.threshold(self.image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1])
+
+    def dilated(self, kernel):
+        return self.preprocessed(("dilated", kernel), lambda: cv2.dilate(self.image, kernel))
+
+    def eroded(self, kernel):
+        return self.preprocessed(("eroded", kernel), lambda: cv2.erode(self.image, kernel))
+
+    def resized(self, scale):
+        image_height, image_width = self.image.shape[:2]
+        return self.preprocessed(("resized", scale), lambda: cv2.resize(self.image, (image_width * scale, image_height * scale)))
+
+    def contours(self, mode, method):
+        """
+        Returns the cached contours of the image. The contours are shared and must not be modified.
+
+        :param mode: Contour retrieval mode
+        :param method: Contour approximation method
+        :return: (contours, hierarchy)
+        """
+        key = self.operation_key(("contours", mode, method))
+
+        # Find contours in copy of image, as findContours modifies the image
+        return self.image_cache.get_or_create(key, lambda: tuple(cv2.findContours(self.image.copy(), mode, method)))
+
+    def features(self, feature_type, detector):
+        """
+        Returns the cached keypoints and descriptors of the image. All detectors of the same feature type must be
+        created with the same parameters, as the features are cached by feature type.
+
+        :param feature_type: Feature type
+        :param detector: Feature detector of the feature type
+        :return: (keypoint positions as array of shape (n, 2), descriptors). Descriptors is None if no keypoints found
+        """
+        key = self.operation_key(("features", feature_type))
+        return self.image_cache.get_or_create(key, lambda: self.detect_features(detector))
+
+    def detect_features(self, detector):
+        keypoints, descriptors = detector.detectAndCompute(self.image, None)
+        return np.float32([keypoint.pt for keypoint in keypoints]).reshape(-1, 2), descriptors
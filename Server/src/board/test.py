@@ -1,11 +1,15 @@
 import cv2
+import time
 import numpy as np
 from board.board_descriptor import BoardDescriptor
 from board.board_recognizer import BoardRecognizer
 from board.tile_brick_detector import TileBrickDetector
 from board.markers.shape_marker import ShapeMarker
+from board.markers.shape_marker_index import ShapeMarkerIndex
 from board.markers.triangle_marker import TriangleMarker
 from board.markers.image_marker import ImageMarker
+from board.markers.feature_detection import FeatureType
+from board.markers.feature_detection import is_feature_type_available
 from board.board_areas.tiled_board_area import TiledBoardArea
 from util import contour_util
 
@@ -218,6 +222,127 @@ def shape_marker_test():
 
     print("%i tests passed, %i failed" % (passed, failed))
 
+def shape_marker_index_test():
+    markers = [
+        ShapeMarker(0, contour=np.int32([[0, 0], [100, 0], [0, 100]]).reshape(-1, 1, 2), max_area=0.5),
+        ShapeMarker(1, contour=np.int32([[0, 0], [100, 0], [100, 100], [0, 100]]).reshape(-1, 1, 2)),
+        ShapeMarker(2, contour=np.int32([[0, 0], [10, 0], [10, 20], [20, 20], [20, 10], [30, 10], [30, 20], [40, 20], [40, 0], [50, 0], [50, 50], [30, 50], [30, 40], [20, 40], [20, 50], [0, 50]]).reshape(-1, 1, 2), distance_tolerance=0.2, angle_tolerance=0.65),
+        ShapeMarker(3, marker_image=cv2.imread("board/training/marker_star.png"), distance_tolerance=0.50, angle_tolerance=0.35)
+    ]
+
+    shape_marker_index = ShapeMarkerIndex()
+    for marker in markers:
+        shape_marker_index.add(marker)
+
+    failed = 0
+    passed = 0
+
+    marker_test_images_count = 13
+
+    for i in range(1, marker_test_images_count + 1):
+        image = cv2.imread("board/training/marker_test_{0}.png".format(i))
+        if image is None:
+            continue
+
+        indexed_results = shape_marker_index.find_markers_in_image(image)
+
+        # Index must find the same markers as each marker on its own
+        for marker in markers:
+            expected_centers = sorted([(marker_result["x"], marker_result["y"]) for marker_result in marker.find_markers_in_image(image)])
+            centers = sorted([(marker_result["x"], marker_result["y"]) for marker_result in indexed_results.get(marker.marker_id, [])])
+
+            if centers != expected_centers:
+                print("Test failed: Shape marker %i, image %i. Index found %i markers but marker found %i." % (marker.marker_id, i, len(centers), len(expected_centers)))
+                failed += 1
+                continue
+            passed += 1
+
+    print("%i tests passed, %i failed" % (passed, failed))
+
+
+def image_marker_benchmark():
+    marker_image = cv2.imread("board/training/marker_dog.png")
+    detect = [13]
+
+    marker_test_images_count = 13
+
+    # Load test images
+    images = {}
+    for i in range(1, marker_test_images_count + 1):
+        image = cv2.imread("board/training/marker_test_{0}.png".format(i))
+        if image is not None:
+            images[i] = image
+
+    # Benchmark each feature type, matcher and resolution
+    for feature_type_name in FeatureType.names:
+        feature_type = getattr(FeatureType, feature_type_name)
+
+        if not is_feature_type_available(feature_type):
+            print("%s: Not available" % feature_type_name)
+            continue
+
+        for brute_force_matching in [False, True]:
+            marker = ImageMarker(-1, marker_image, feature_type=feature_type, brute_force_matching=brute_force_matching)
+
+            for width in [320, 640, 800, 1200]:
+                passed = 0
+                detected = 0
+                total_time = 0.0
+
+                for i, image in images.iteritems():
+
+                    # Resize image like board snapshots
+                    image_height, image_width = image.shape[:2]
+                    if width < image_width:
+                        image = cv2.resize(image, (width, int(width * float(image_height) / float(image_width))))
+
+                    start_time = time.time()
+                    marker_result = marker.find_marker_in_image(image)
+                    total_time += time.time() - start_time
+
+                    found = marker_result is not None
+                    if found:
+                        detected += 1
+                    if found == (i in detect):
+                        passed += 1
+
+                print("%s, %s, width %i: %i of %i correct (%i of %i detected), %.1f ms per frame" %
+                      (feature_type_name, "brute force" if brute_force_matching else "FLANN", width,
+                       passed, len(images), detected, len(detect), total_time * 1000.0 / max(len(images), 1)))
+
+
+def image_marker_instances_test():
+    marker_image = cv2.imread("board/training/marker_dog.png")
+    marker_height, marker_width = marker_image.shape[:2]
+
+    failed = 0
+    passed = 0
+
+    # Place copies of marker side by side on white background
+    for count in range(1, 4):
+        image = np.zeros((marker_height * 2, marker_width * (count + 1), 3), dtype=np.uint8)
+        image[:] = 255
+
+        for i in range(0, count):
+            x = (marker_width / 2) + (i * marker_width) + (i * marker_width / (count + 1))
+            image[marker_height / 2:marker_height / 2 + marker_height, x:x + marker_width] = marker_image
+
+        marker = ImageMarker(-1, marker_image, max_instances=count + 2)
+        marker_results = marker.find_markers_in_image(image)
+
+        # Check each copy reported exactly once
+        centers = [(int(marker_result["x"] * image.shape[1]), int(marker_result["y"] * image.shape[0])) for marker_result in marker_results]
+        duplicates = [center for center in centers if len([c for c in centers if abs(c[0] - center[0]) < marker_width / 2 and abs(c[1] - center[1]) < marker_height / 2]) > 1]
+
+        if len(marker_results) != count or len(duplicates) > 0:
+            print("Test failed: %i copies of image marker. Markers found: %i, of which duplicates: %i." % (count, len(marker_results), len(duplicates)))
+            failed += 1
+            continue
+        passed += 1
+
+    print("%i tests passed, %i failed" % (passed, failed))
+
+
 def shape_marker_camera_test():
     marker_image = cv2.imread("board/training/marker_star.png")
     marker = ShapeMarker(marker_image=marker_image, distance_tolerance=0.50, angle_tolerance=0.35)
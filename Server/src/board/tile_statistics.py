@@ -0,0 +1,132 @@
+import numpy as np
+import image_statistics
+
+
+class TileStatistics(object):
+    """
+    Statistics for all tiles of a tiled area image, computed in a single pass.
+
+    All tiles are gathered into a (rows, cols, tile height, tile width) array at once, from which the statistics of
+    every tile are calculated with vectorized reductions. Statistics for any subset of tiles are then found by indexing.
+
+    Field variables:
+    tile_count -- [width, height]
+    tile_size -- Tile (width, height)
+    means -- Array (rows, cols) with mean intensity of each tile with border removed
+    histograms -- Array (rows, cols, 256) with histogram of each whole tile
+    cumulative_histograms -- Array (rows, cols, 256) with cumulative histogram of each tile with border removed
+    dark_fractions -- Array (rows, cols) with fraction of dark pixels in each tile, using OTSU threshold of whole area.
+                      Is a whole area estimate only, as the brick detector thresholds the tiles it searches among by
+                      the OTSU threshold of those tiles
+    """
+    border_percentage = 0.1
+
+    def __init__(self, image, tile_count):
+        """
+        :param image: Grayscaled area image
+        :param tile_count: Tile count [width, height]
+        """
+        self.tile_count = tile_count
+
+        image_height, image_width = image.shape[:2]
+        cols, rows = tile_count
+
+        tile_width = float(image_width) / float(cols)
+        tile_height = float(image_height) / float(rows)
+        self.tile_size = (tile_width, tile_height)
+
+        # Gather tiles
+        tiles = self.tiles_from_image(image, rows, cols, tile_width, tile_height)
+
+        # Remove border
+        border_width = int(tile_width * self.border_percentage)
+        border_height = int(tile_height * self.border_percentage)
+        border_removed_tiles = tiles[:, :, border_height:int(tile_height) - border_height, border_width:int(tile_width) - border_width]
+
+        # Calculate means
+        border_removed_area = (tile_width - (border_width * 2)) * (tile_height - (border_height * 2))
+        self.means = border_removed_tiles.reshape(rows, cols, -1).sum(axis=2) / border_removed_area
+
+        # Calculate histograms
+        self.histograms = self.histograms_of_tiles(tiles)
+        self.cumulative_histograms = np.cumsum(self.histograms_of_tiles(border_removed_tiles), axis=2)
+
+        # Calculate dark fractions using OTSU threshold of whole area
+        threshold = image_statistics.otsu_threshold_from_histogram(self.histograms.sum(axis=(0, 1)))
+        self.dark_fractions = self.cumulative_histograms[:, :, threshold] / (tile_width * tile_height)
+
+    def tiles_from_image(self, image, rows, cols, tile_width, tile_height):
+        """
+        Gathers all tiles of the image into a single array, using the same tile regions as TiledBoardArea.tile_region.
+
+        :return: Array of shape (rows, cols, tile height, tile width)
+        """
+        ys = (np.arange(rows) * tile_height).astype(np.int32)[:, np.newaxis] + np.arange(int(tile_height))
+        xs = (np.arange(cols) * tile_width).astype(np.int32)[:, np.newaxis] + np.arange(int(tile_width))
+
+        return image[ys[:, np.newaxis, :, np.newaxis], xs[np.newaxis, :, np.newaxis, :]]
+
+    def histograms_of_tiles(self, tiles):
+        """
+        Calculates the 256 bin histogram of each tile with a single bincount.
+
+        :param tiles: Array of shape (rows, cols, tile height, tile width)
+        :return: Array of shape (rows, cols, 256)
+        """
+        rows, cols = tiles.shape[:2]
+
+        tile_indices = np.arange(rows * cols, dtype=np.int64).reshape(rows, cols, 1, 1) * 256
+        bins = (tile_indices + tiles).ravel()
+
+        return np.bincount(bins, minlength=rows * cols * 256).reshape(rows, cols, 256)
+
+    def indices(self, coordinates):
+        """
+        Converts coordinates into index arrays.
+
+        :param coordinates: Coordinates [(x, y), ...]
+        :return: (row indices, col indices)
+        """
+        coordinates = np.asarray(coordinates, dtype=np.int32).reshape(-1, 2)
+        return coordinates[:, 1], coordinates[:, 0]
+
+    def means_of_tiles(self, coordinates):
+        """
+        Returns the mean intensities of the tiles at the given coordinates with border removed.
+
+        :param coordinates: Coordinates [(x, y), ...]
+        :return: Array of means
+        """
+        return self.means[self.indices(coordinates)]
+
+    def otsu_threshold_of_tiles(self, coordinates):
+        """
+        Calculates the OTSU threshold of the whole tiles at the given coordinates combined.
+
+        :param coordinates: Coordinates [(x, y), ...]
+        :return: OTSU threshold
+        """
+        return image_statistics.otsu_threshold_from_histogram(self.histograms[self.indices(coordinates)].sum(axis=0))
+
+    def dark_fractions_of_tiles(self, coordinates, threshold):
+        """
+        Returns the number of pixels less than or equal to the threshold in each tile with border removed, relative to
+        the size of the whole tile.
+
+        :param coordinates: Coordinates [(x, y), ...]
+        :param threshold: Threshold
+        :return: Array of dark fractions
+        """
+        tile_width, tile_height = self.tile_size
+        return self.cumulative_histograms[self.indices(coordinates)][:, int(threshold)] / (tile_width * tile_height)
+
+    def to_dict(self):
+        """
+        Returns the occupancy of all tiles.
+
+        :return: Dictionary in form {"tileCount", "means", "darkFractions"}, where means and dark fractions are lists
+                 of rows
+        """
+        return {"tileCount": list(self.tile_count),
+                "means": self.means.tolist(),
+                "darkFractions": self.dark_fractions.tolist()}
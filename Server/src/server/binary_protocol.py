@@ -0,0 +1,145 @@
+"""
+Compact binary encoding of the most frequent reporter updates, used instead of JSON when negotiated by the client.
+
+All values are little endian. A binary message holds one or more updates:
+
+    uint8 format (0xB1, binary layout version 1), uint16 update count
+    update...
+
+The format byte lets the client tell binary updates from JSON messages, which never start with 0xB1.
+
+Each update starts with a header followed by a body depending on the update type:
+
+    uint8 update type, int32 request id, int32 reporter id
+
+    BRICK_FOUND_AT_POSITION:  int16 x, int16 y
+    BRICK_MOVED_TO_POSITION:  int16 x, int16 y, uint8 has initial position, int16 initial x, int16 initial y
+    MARKER_FOUND:             int32 area id, marker
+    MARKERS_FOUND:            int32 area id, uint16 marker count, marker...
+    MARKER_TRACKED:           int32 area id, marker
+
+    marker:                   int32 marker id, float32 x, float32 y, float32 width, float32 height, float32 angle,
+                              uint8 source, float32 confidence
+
+Marker source is 0 if not given, 1 for "detection" and 2 for "flow", in which case confidence is given too.
+
+Updates which do not fit the layout, fx. with non-integer ids, are left for JSON.
+"""
+import struct
+from util import enum
+
+
+UpdateType = enum.Enum('BRICK_FOUND_AT_POSITION', 'BRICK_MOVED_TO_POSITION', 'MARKER_FOUND', 'MARKERS_FOUND', 'MARKER_TRACKED')
+
+update_types = {"brickFoundAtPosition": UpdateType.BRICK_FOUND_AT_POSITION,
+                "brickMovedToPosition": UpdateType.BRICK_MOVED_TO_POSITION,
+                "markerFound": UpdateType.MARKER_FOUND,
+                "markersFound": UpdateType.MARKERS_FOUND,
+                "markerTracked": UpdateType.MARKER_TRACKED}
+
+marker_keys = set(["markerId", "x", "y", "width", "height", "angle"])
+tracked_marker_keys = marker_keys | set(["source", "confidence"])
+
+marker_sources = {"detection": 1, "flow": 2}
+
+binary_format = 0xB1
+
+
+def encode_updates(messages):
+    """
+    Encodes the given messages into a single binary message.
+
+    :param messages: List of messages in form {"result", "action", "payload", "requestId"}
+    :return: (binary message or None if no message could be encoded, list of encoded messages, list of messages which
+             could not be encoded)
+    """
+    encoded_updates = []
+    encoded_messages = []
+    remaining_messages = []
+
+    for message in messages:
+        encoded_update = encode_update(message)
+        if encoded_update is not None:
+            encoded_updates.append(encoded_update)
+            encoded_messages.append(message)
+        else:
+            remaining_messages.append(message)
+
+    if len(encoded_updates) == 0:
+        return None, encoded_messages, remaining_messages
+
+    return struct.pack("<BH", binary_format, len(encoded_updates)) + "".join(encoded_updates), encoded_messages, remaining_messages
+
+
+def encode_update(message):
+    """
+    Encodes a single update message.
+
+    :param message: Message in form {"result", "action", "payload", "requestId"}
+    :return: Encoded update, or None if message does not fit the binary layout
+    """
+    if message["result"] != "UPDATE" or message["action"] not in update_types:
+        return None
+
+    update_type = update_types[message["action"]]
+    payload = message["payload"]
+
+    if not is_int32(message["requestId"]) or not is_int32(payload.get("id")):
+        return None
+
+    header = struct.pack("<Bii", update_type, message["requestId"], payload["id"])
+
+    try:
+        if update_type == UpdateType.BRICK_FOUND_AT_POSITION:
+            return header + struct.pack("<hh", *payload["position"])
+
+        if update_type == UpdateType.BRICK_MOVED_TO_POSITION:
+            if "initialPosition" in payload:
+                return header + struct.pack("<hhBhh", payload["position"][0], payload["position"][1], 1, *payload["initialPosition"])
+            else:
+                return header + struct.pack("<hhBhh", payload["position"][0], payload["position"][1], 0, 0, 0)
+
+        if not is_int32(payload.get("areaId")):
+            return None
+
+        if update_type == UpdateType.MARKERS_FOUND:
+            markers = [encode_marker(marker) for marker in payload["markers"]]
+            if None in markers:
+                return None
+            return header + struct.pack("<iH", payload["areaId"], len(markers)) + "".join(markers)
+
+        marker = encode_marker(payload["marker"])
+        if marker is None:
+            return None
+        return header + struct.pack("<i", payload["areaId"]) + marker
+
+    except (struct.error, TypeError, KeyError, IndexError):
+        return None
+
+
+def encode_marker(marker):
+    """
+    Encodes a single marker result.
+
+    :param marker: Marker in form {"markerId", "x", "y", "width", "height", "angle"}, optionally with "source" and
+                   "confidence"
+    :return: Encoded marker, or None if marker does not fit the binary layout
+    """
+    keys = set(marker.keys())
+
+    if keys == marker_keys:
+        source, confidence = 0, 0.0
+    elif keys == tracked_marker_keys and marker["source"] in marker_sources:
+        source, confidence = marker_sources[marker["source"]], marker["confidence"]
+    else:
+        return None
+
+    if not is_int32(marker["markerId"]):
+        return None
+
+    return struct.pack("<ifffffBf", marker["markerId"], marker["x"], marker["y"], marker["width"], marker["height"],
+                       marker["angle"], source, confidence)
+
+
+def is_int32(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool) and -2**31 <= value < 2**31
@@ -1,24 +1,26 @@
-from __future__ import with_statement
 import cv2
-import time
 from threading import Thread
-from threading import Lock
+from frame_buffer import FrameBuffer
 
 
 class Camera(object):
     stopped = False
-    image = None
     camera = None
-    lock = Lock()
 
-    def start(self, resolution=(640, 480), framerate=16):
+    def __init__(self):
+        self.frame_buffer = FrameBuffer()
+
+    def start(self, resolution=(640, 480), framerate=16, grayscale=False):
         """
         Starts camera input in a new thread.
 
         :param resolution Resolution
         :param framerate Framerate
+        :param grayscale If true, images are grayscaled when captured
         """
         self.stopped = False
+        self.grayscale = grayscale
+        self.color_image = None
 
         # Initialize camera
         self.camera = cv2.VideoCapture(0)
@@ -41,21 +43,37 @@ class Camera(object):
         """
         Returns the most recent image read from the camera input.
         """
-        with self.lock:
-            return self.image
+        frame = self.frame_buffer.latest()
+        return frame.image if frame is not None else None
+
+    def read_next(self, after_sequence_number=0, timeout=None):
+        """
+        Returns the most recent frame newer than the given sequence number, waiting for it if necessary.
+
+        :param after_sequence_number: Sequence number of last processed frame
+        :param timeout: Maximum time in seconds to wait. Waits forever if None
+        :return: Frame, or None if no newer frame arrived within the timeout
+        """
+        return self.frame_buffer.read_next(after_sequence_number, timeout)
 
     def update(self):
         """
-        Grabs next image from camera.
+        Grabs next image from camera. Blocks on the camera device until the next image is available.
         """
         while not self.stopped:
-            time.sleep(0.01)
             self.grab_image()
 
     def grab_image(self):
         """
         Grabs an image from the camera input.
         """
-        _, camera_image = self.camera.read()
-        with self.lock:
-            self.image = camera_image
+        if not self.grayscale:
+            success, camera_image = self.camera.read(self.frame_buffer.write_slot())
+            if success:
+                self.frame_buffer.commit(camera_image)
+            return
+
+        # Grayscale color image into frame buffer, reusing the color image for the next capture
+        success, self.color_image = self.camera.read(self.color_image)
+        if success:
+            self.frame_buffer.commit(cv2.cvtColor(self.color_image, cv2.COLOR_BGR2GRAY, self.frame_buffer.write_slot()))
@@ -1,37 +1,45 @@
 import cv2
-import time
+import io
+import numpy as np
 from threading import Thread
-from threading import Lock
 from picamera.array import PiRGBArray
 from picamera import PiCamera
+from frame_buffer import FrameBuffer
 
 
 class Camera(object):
     stopped = False
-    image = None
     camera = None
     raw_capture = None
     stream = None
-    lock = Lock()
 
-    def start(self, resolution=(640, 480), framerate=16):
+    def __init__(self):
+        self.frame_buffer = FrameBuffer()
+
+    def start(self, resolution=(640, 480), framerate=16, grayscale=False):
         """
         Starts camera input in a new thread.
 
         :param resolution Resolution
         :param framerate Framerate
+        :param grayscale If true, only the luma plane of the YUV output is captured
         """
         self.stopped = False
+        self.resolution = resolution
+        self.grayscale = grayscale
 
         # Initialize camera
         self.camera = PiCamera()
         self.camera.resolution = resolution
         self.camera.framerate = framerate
 
-        self.raw_capture = PiRGBArray(self.camera, size=resolution)
-        self.raw_capture.truncate(0)
-
-        self.stream = self.camera.capture_continuous(self.raw_capture, format="bgr", use_video_port=True)
+        if self.grayscale:
+            self.raw_capture = io.BytesIO()
+            self.stream = self.camera.capture_continuous(self.raw_capture, format="yuv", use_video_port=True)
+        else:
+            self.raw_capture = PiRGBArray(self.camera, size=resolution)
+            self.raw_capture.truncate(0)
+            self.stream = self.camera.capture_continuous(self.raw_capture, format="bgr", use_video_port=True)
 
         # Start thread
         thread = Thread(target=self.update, args=())
@@ -48,31 +56,32 @@ class Camera(object):
         """
         Returns the most recent image read from the camera input.
         """
-        with self.lock:
-            return self.image
+        frame = self.frame_buffer.latest()
+        return frame.image if frame is not None else None
+
+    def read_next(self, after_sequence_number=0, timeout=None):
+        """
+        Returns the most recent frame newer than the given sequence number, waiting for it if necessary.
+
+        :param after_sequence_number: Sequence number of last processed frame
+        :param timeout: Maximum time in seconds to wait. Waits forever if None
+        :return: Frame, or None if no newer frame arrived within the timeout
+        """
+        return self.frame_buffer.read_next(after_sequence_number, timeout)
 
     def update(self):
         """
-        Grabs next image from camera.
+        Grabs next image from camera. Blocks on the camera stream until the next image is available.
         """
         for f in self.stream:
 
-            # Sleep a while
-            time.sleep(0.01)
+            # Rotate image 180 degrees directly into frame buffer
+            rotated_image = cv2.flip(self.captured_image(), -1, self.frame_buffer.write_slot())
+            self.raw_capture.seek(0)
+            self.raw_capture.truncate()
 
-            # Grab image
-            rotated_image = f.array
-            self.raw_capture.truncate(0)
-
-            # Rotate image 180 degrees
-            (height, width) = rotated_image.shape[:2]
-            center = (width / 2, height / 2)
-            matrix = cv2.getRotationMatrix2D(center, 180, 1.0)
-            rotated_image = cv2.warpAffine(rotated_image, matrix, (width, height))
-
-            # Grab image
-            with self.lock:
-                self.image = rotated_image
+            # Publish image
+            self.frame_buffer.commit(rotated_image)
 
             # Stop
             if self.stopped:
@@ -80,3 +89,18 @@ class Camera(object):
                 self.raw_capture.close()
                 self.camera.close()
                 return
+
+    def captured_image(self):
+        """
+        Returns the image most recently written to the raw capture.
+        """
+        if not self.grayscale:
+            return self.raw_capture.array
+
+        # YUV output is padded to a width of a multiple of 32 and a height of a multiple of 16, with luma plane first
+        width, height = self.resolution
+        padded_width = (width + 31) // 32 * 32
+        padded_height = (height + 15) // 16 * 16
+
+        luma = np.frombuffer(self.raw_capture.getvalue(), dtype=np.uint8, count=padded_width * padded_height)
+        return luma.reshape(padded_height, padded_width)[:height, :width]
@@ -0,0 +1,118 @@
+from __future__ import with_statement
+import time
+from threading import Condition
+
+
+class Frame(object):
+    """
+    Represents a camera frame stored in a frame buffer slot.
+
+    Field variables:
+    image -- Camera image. Is owned by the frame buffer and reused when the slot is overwritten
+    sequence_number -- Monotonically increasing frame number, starting at 1. None while the slot is being written
+    capture_time -- Time at which the image was captured
+    slot_index -- Index of slot in frame buffer
+    """
+    def __init__(self, slot_index, image=None, sequence_number=None, capture_time=None):
+        self.slot_index = slot_index
+        self.image = image
+        self.sequence_number = sequence_number
+        self.capture_time = capture_time
+
+
+class FrameBuffer(object):
+    """
+    Ring buffer of camera frames.
+
+    The camera writes each frame directly into the image of the next slot, so once all slots have been filled no
+    images are allocated per frame. Consumers call read_next with the sequence number of the last frame they
+    processed and block until a newer frame is available, so a frame is never processed twice.
+
+    Frames are not copied when read. A slot is overwritten after slot_count - 1 newer frames have been captured, which
+    consumers holding on to a frame can detect with is_valid.
+    """
+
+    def __init__(self, slot_count=8):
+        """
+        :param slot_count: Number of slots
+        """
+        self.slots = [Frame(i) for i in range(0, slot_count)]
+        self.condition = Condition()
+        self.write_index = 0
+        self.latest_frame = None
+        self.sequence_number = 0
+
+    def write_slot(self):
+        """
+        Returns the image of the next slot to write into and marks the slot as being written. The image is None until
+        the slot has been filled once.
+
+        :return: Slot image to be overwritten by the camera
+        """
+        with self.condition:
+            slot = self.slots[self.write_index]
+            slot.sequence_number = None
+            return slot.image
+
+    def commit(self, image, capture_time=None):
+        """
+        Publishes the frame written into the slot returned by write_slot and wakes up waiting consumers.
+
+        :param image: Written image. Is normally the slot image itself, but may be a new image if the slot was empty or
+                      had another size
+        :param capture_time: Capture time. Current time if None
+        """
+        with self.condition:
+            self.sequence_number += 1
+
+            slot = self.slots[self.write_index]
+            slot.image = image
+            slot.sequence_number = self.sequence_number
+            slot.capture_time = capture_time if capture_time is not None else time.time()
+
+            self.latest_frame = Frame(slot.slot_index, slot.image, slot.sequence_number, slot.capture_time)
+            self.write_index = (self.write_index + 1) % len(self.slots)
+
+            self.condition.notify_all()
+
+    def latest(self):
+        """
+        Returns the most recent frame.
+
+        :return: Frame, or None if no frame has been captured yet
+        """
+        with self.condition:
+            return self.latest_frame
+
+    def read_next(self, after_sequence_number=0, timeout=None):
+        """
+        Returns the most recent frame newer than the given sequence number, waiting for it if necessary.
+
+        :param after_sequence_number: Sequence number of last processed frame
+        :param timeout: Maximum time in seconds to wait. Waits forever if None
+        :return: Frame, or None if no newer frame arrived within the timeout
+        """
+        with self.condition:
+            end_time = time.time() + timeout if timeout is not None else None
+
+            while self.latest_frame is None or self.latest_frame.sequence_number <= after_sequence_number:
+                if end_time is None:
+                    self.condition.wait()
+                else:
+                    remaining_time = end_time - time.time()
+                    if remaining_time <= 0.0:
+                        return None
+                    self.condition.wait(remaining_time)
+
+            return self.latest_frame
+
+    def is_valid(self, frame):
+        """
+        Checks whether the image of the frame is still untouched, that is, the slot has not been overwritten since the
+        frame was read.
+
+        :param frame: Frame
+        :return: True, if the frame image is still valid, else false
+        """
+        with self.condition:
+            return self.slots[frame.slot_index].sequence_number == frame.sequence_number
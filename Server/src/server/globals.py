@@ -1,12 +1,16 @@
 from board.board_descriptor import BoardDescriptor
 from board.board_recognizer import BoardRecognizer
 from board.tile_brick_detector import TileBrickDetector
+from board.frame_change_detector import FrameChangeDetector
+from board.image_cache import shared_image_cache
 
 
 camera = None
 board_descriptor = BoardDescriptor()
 board_recognizer = BoardRecognizer()
 brick_detector = TileBrickDetector()
+frame_change_detector = FrameChangeDetector()
+image_cache = shared_image_cache
 
 debug = False
 
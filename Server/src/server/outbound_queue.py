@@ -0,0 +1,100 @@
+from __future__ import with_statement
+from collections import deque
+from threading import Condition
+from threading import Thread
+
+
+class OutboundQueue(object):
+    """
+    Per connection queue of outgoing messages, sent by its own thread so that a slow client never blocks the caller.
+
+    Messages put with a coalesce key, fx. continuous marker tracking updates, are droppable: a newer message with the
+    same key replaces the queued one, and when more than max_size messages are waiting the oldest droppable message is
+    dropped. Other messages, fx. action replies, are never dropped.
+
+    Field variables:
+    max_size -- Maximum number of waiting messages before droppable messages are dropped
+    sent_count -- Number of messages sent
+    dropped_count -- Number of droppable messages dropped or replaced by a newer message
+    """
+
+    def __init__(self, send_function, max_size=32):
+        """
+        :param send_function: Function sending a single message. Is called from the sender thread only
+        :param max_size: Maximum number of waiting messages before droppable messages are dropped
+        """
+        self.send_function = send_function
+        self.max_size = max_size
+
+        self.condition = Condition()
+        self.messages = deque()
+        self.stopped = False
+        self.sent_count = 0
+        self.dropped_count = 0
+
+    def start(self):
+        thread = Thread(target=self.run, args=())
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def put(self, message, coalesce_key=None):
+        """
+        Queues the message for sending. Never blocks.
+
+        :param message: Message
+        :param coalesce_key: If not None, the message is droppable and replaces any waiting message with the same key
+        """
+        with self.condition:
+
+            # Replace waiting message with same key
+            if coalesce_key is not None:
+                for i in range(0, len(self.messages)):
+                    if self.messages[i][1] == coalesce_key:
+                        self.messages[i] = (message, coalesce_key)
+                        self.dropped_count += 1
+                        return
+
+            self.messages.append((message, coalesce_key))
+
+            # Drop oldest droppable message
+            if len(self.messages) > self.max_size:
+                for i in range(0, len(self.messages)):
+                    if self.messages[i][1] is not None:
+                        del self.messages[i]
+                        self.dropped_count += 1
+                        break
+
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.messages) == 0 and not self.stopped:
+                    self.condition.wait()
+
+                if self.stopped:
+                    return
+
+                message, _ = self.messages.popleft()
+
+            try:
+                self.send_function(message)
+                self.sent_count += 1
+            except Exception, e:
+                print("Exception sending message: %s" % str(e))
+
+    def statistics(self):
+        """
+        Returns queue statistics.
+
+        :return: Dictionary in form {"queued", "sent", "dropped"}
+        """
+        with self.condition:
+            return {"queued": len(self.messages),
+                    "sent": self.sent_count,
+                    "dropped": self.dropped_count}
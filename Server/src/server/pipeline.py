@@ -0,0 +1,220 @@
+from __future__ import with_statement
+import sys, traceback
+import time
+import Queue
+from threading import Thread
+from threading import Lock
+
+
+class PipelineItem(object):
+    """
+    Represents a single camera frame travelling through the pipeline.
+
+    Field variables:
+    frame -- Camera frame
+    image -- Camera image
+    capture_time -- Time at which the image was captured by the camera
+    board_descriptor -- Board descriptor active when the image was captured
+    thumbnail -- Thumbnail of image compared by the frame change detector. Is set by the frame change stage
+    changed -- Whether the image has changed since the last processed image. Is set by the frame change stage
+    snapshot -- Board snapshot. Is set by the board recognition stage
+    """
+    def __init__(self, frame, board_descriptor):
+        self.frame = frame
+        self.image = frame.image
+        self.capture_time = frame.capture_time
+        self.board_descriptor = board_descriptor
+        self.thumbnail = None
+        self.changed = True
+        self.snapshot = None
+
+
+class PipelineStageStatistics(object):
+    """
+    Latency and drop statistics for a single pipeline stage.
+
+    Field variables:
+    processed_count -- Number of processed items
+    dropped_count -- Number of items dropped because the stage could not keep up
+    average_latency -- Exponentially smoothed processing time in seconds
+    max_latency -- Maximum processing time in seconds
+    """
+    smoothing_factor = 0.1
+
+    def __init__(self):
+        self.lock = Lock()
+        self.processed_count = 0
+        self.dropped_count = 0
+        self.average_latency = 0.0
+        self.max_latency = 0.0
+
+    def add_processed(self, latency):
+        with self.lock:
+            if self.processed_count == 0:
+                self.average_latency = latency
+            else:
+                self.average_latency += (latency - self.average_latency) * self.smoothing_factor
+            self.max_latency = max(self.max_latency, latency)
+            self.processed_count += 1
+
+    def add_dropped(self):
+        with self.lock:
+            self.dropped_count += 1
+
+    def to_dict(self):
+        with self.lock:
+            return {"processed": self.processed_count,
+                    "dropped": self.dropped_count,
+                    "averageLatency": self.average_latency,
+                    "maxLatency": self.max_latency}
+
+
+class PipelineStage(object):
+    """
+    A single stage of the pipeline, running in its own thread.
+
+    The stage takes items from its bounded input queue, processes them and hands the result on to the next stage. If
+    the process function returns None the item is not passed on. If the input queue is full the oldest item is dropped,
+    so a slow stage always works on the most recent frame.
+    """
+    stop_item = object()
+
+    def __init__(self, name, process_function, queue_size=1):
+        """
+        :param name: Stage name
+        :param process_function: Function taking an item and returning the item to pass on, or None
+        :param queue_size: Maximum number of items waiting in the input queue
+        """
+        self.name = name
+        self.process_function = process_function
+        self.input_queue = Queue.Queue(maxsize=queue_size)
+        self.next_stage = None
+        self.statistics = PipelineStageStatistics()
+        self.stopped = False
+
+    def start(self):
+        thread = Thread(target=self.run, args=())
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.put(self.stop_item)
+
+    def put(self, item):
+        """
+        Hands an item to this stage. Drops the oldest waiting item if the input queue is full.
+
+        :param item: Item to process
+        """
+        while True:
+            try:
+                self.input_queue.put_nowait(item)
+                return
+            except Queue.Full:
+                try:
+                    if self.input_queue.get_nowait() is not self.stop_item:
+                        self.statistics.add_dropped()
+                except Queue.Empty:
+                    pass
+
+    def next_item(self):
+        return self.input_queue.get()
+
+    def run(self):
+        while not self.stopped:
+            item = self.next_item()
+            if item is None or item is self.stop_item:
+                continue
+
+            try:
+                start_time = time.time()
+                result = self.process_function(item)
+                self.statistics.add_processed(time.time() - start_time)
+
+                if result is not None and self.next_stage is not None:
+                    self.next_stage.put(result)
+
+            except Exception, e:
+                print("Exception in pipeline stage %s: %s" % (self.name, str(e)))
+                traceback.print_exc(file=sys.stdout)
+
+
+class PipelineSourceStage(PipelineStage):
+    """
+    First stage of the pipeline. Produces items by calling the source function instead of reading an input queue.
+    """
+    def __init__(self, name, source_function):
+        """
+        :param name: Stage name
+        :param source_function: Function waiting for and returning the next item, or None if no item arrived in time
+        """
+        super(PipelineSourceStage, self).__init__(name, lambda item: item)
+        self.source_function = source_function
+
+    def stop(self):
+        self.stopped = True
+
+    def next_item(self):
+        return self.source_function()
+
+
+class Pipeline(object):
+    """
+    Staged frame processing pipeline. Each stage runs in its own thread with a bounded queue in front of it, so
+    consecutive frames are processed by different stages at the same time.
+    """
+    def __init__(self):
+        self.stages = []
+
+    def add_source(self, name, source_function):
+        """
+        Adds the source stage. Must be added first.
+
+        :param name: Stage name
+        :param source_function: Function waiting for and returning the next item, or None if no item arrived in time
+        """
+        self.append_stage(PipelineSourceStage(name, source_function))
+
+    def add_stage(self, name, process_function, queue_size=1):
+        """
+        Adds a processing stage to the end of the pipeline.
+
+        :param name: Stage name
+        :param process_function: Function taking an item and returning the item to pass on, or None
+        :param queue_size: Maximum number of items waiting in front of the stage
+        """
+        self.append_stage(PipelineStage(name, process_function, queue_size))
+
+    def stage(self, name):
+        """
+        Returns the stage with the given name.
+
+        :param name: Stage name
+        :return: Stage, or None if not found
+        """
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def append_stage(self, stage):
+        if len(self.stages) > 0:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+
+    def start(self):
+        for stage in reversed(self.stages):
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def statistics(self):
+        """
+        Returns latency and drop statistics for all stages.
+
+        :return: Dictionary in form {stage name: {"processed", "dropped", "averageLatency", "maxLatency"}}
+        """
+        return {stage.name: stage.statistics.to_dict() for stage in self.stages}
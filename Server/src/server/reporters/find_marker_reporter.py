@@ -21,7 +21,7 @@ class FindMarkerReporter(Reporter):
     def run_iteration(self):
 
         # Get area image
-        image = self.board_area.area_image(snapshot_size=self.marker.preferred_input_image_resolution())
+        image = self.board_area.preprocessed_area_image(snapshot_size=self.marker.preferred_input_image_resolution())
 
         # Check if we have a board area image
         if image is None:
@@ -32,7 +32,7 @@ class FindMarkerReporter(Reporter):
             return
 
         # Find marker
-        marker_result = self.marker.find_marker_in_image(image)
+        marker_result = self.marker.find_marker_in_preprocessed_image(image)
         if marker_result is None:
             return
 
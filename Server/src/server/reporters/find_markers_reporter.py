@@ -4,17 +4,19 @@ from reporter import Reporter
 
 class FindMarkersReporter(Reporter):
 
-    def __init__(self, board_area, markers, stability_level, reporter_id, callback_function):
+    def __init__(self, board_area, markers, stability_level, reporter_id, callback_function, marker_indices=[]):
         """
         :param board_area: Board area
         :param markers: Markers to search for
         :param stability_level Minimum board area stability level before searching for markers
+        :param marker_indices: Marker indices, fx. shape marker index and image marker library. Indexed markers are searched for all at once
         """
         super(FindMarkersReporter, self).__init__(reporter_id, callback_function)
 
         self.board_area = board_area
         self.markers = markers
         self.stability_level = stability_level
+        self.marker_indices = marker_indices
 
     def run_iteration(self):
 
@@ -22,23 +24,60 @@ class FindMarkersReporter(Reporter):
         if self.board_area.stability_score() < self.stability_level:
             return
 
+        # Find indexed markers
+        indexed_results = self.find_indexed_markers()
+        if indexed_results is None:
+            return
+
         # Find markers
         result = []
         for marker in self.markers:
 
-            # Get area image
-            image = self.board_area.area_image(snapshot_size=marker.preferred_input_image_resolution())
+            # Use result of indexed marker
+            if marker.marker_id in indexed_results:
+                result.extend(indexed_results[marker.marker_id][:marker.max_instances])
+                continue
+
+            # Get area image, sharing preprocessing with the other markers
+            image = self.board_area.preprocessed_area_image(snapshot_size=marker.preferred_input_image_resolution())
 
             # Check if we have a board area image
             if image is None:
                 return
 
-            # Find marker in image
-            marker_result = marker.find_marker_in_image(image)
-            if marker_result:
-                result.append(marker_result)
+            # Find markers in image
+            result.extend(marker.find_markers_in_preprocessed_image(image)[:marker.max_instances])
 
         #if globals.debug:
             #print("%i: Markers found: %i" % (self.reporter_id, len(result)))
         self.callback_function(result)
         self.stop()
+
+    def find_indexed_markers(self):
+        """
+        Searches for all markers present in a marker index at once, in each of their preferred resolutions.
+
+        :return: Dictionary of marker results by marker id for all indexed markers, or None if no board area image
+        """
+        results = {}
+
+        for marker_index in self.marker_indices:
+            indexed_markers = [marker for marker in self.markers if marker_index.contains(marker)]
+
+            for marker in indexed_markers:
+                results[marker.marker_id] = []
+
+            for resolution in set([marker.preferred_input_image_resolution() for marker in indexed_markers]):
+
+                # Get area image
+                image = self.board_area.preprocessed_area_image(snapshot_size=resolution)
+
+                # Check if we have a board area image
+                if image is None:
+                    return None
+
+                # Find markers in image
+                marker_ids = set([marker.marker_id for marker in indexed_markers if marker.preferred_input_image_resolution() == resolution])
+                results.update(marker_index.find_markers_in_preprocessed_image(image, marker_ids))
+
+        return results
@@ -1,16 +1,41 @@
 import cv2
+import math
 import time
+import numpy as np
 from reporter import Reporter
 from board.board_descriptor import BoardDescriptor
 from util import misc_math
 
 
 class MarkerTracker(Reporter):
+    """
+    Continuously tracks a marker in a board area.
 
-    def __init__(self, board_area, marker, reporter_id, callback_function):
+    Once the marker has been found, it is searched for in a window around its last known position and size only, using
+    the area image in full resolution. Only after a number of consecutive misses in the window, the whole area is
+    searched again in the preferred resolution of the marker.
+
+    With a detection interval above one, the marker is only detected every n'th frame. In between, the contour points
+    of the marker are propagated with pyramidal Lucas-Kanade optical flow. If the flow error gets too large, the
+    marker is detected right away.
+
+    All reported marker results are relative to the whole area image and contain "source" ("detection" or "flow") and
+    "confidence" [0..1]. Contours are in pixels of the area image in full resolution.
+    """
+    tracking_resolution = BoardDescriptor.SnapshotSize.ORIGINAL
+    min_window_size = 32
+    flow_window_size = (15, 15)
+    flow_pyramid_levels = 2
+
+    def __init__(self, board_area, marker, reporter_id, callback_function, window_scale=3.0, max_window_misses=5,
+                 detection_interval=1, max_flow_error=10.0):
         """
         :param board_area: Board area
         :param marker: Marker
+        :param window_scale: Size of search window in multitudes of marker size
+        :param max_window_misses: Number of consecutive misses in search window before searching the whole area
+        :param detection_interval: Detect marker every n'th frame, propagating it with optical flow in between
+        :param max_flow_error: Maximum mean optical flow error before forcing detection
         """
         super(MarkerTracker, self).__init__(reporter_id, callback_function)
 
@@ -19,6 +44,16 @@ class MarkerTracker(Reporter):
         self.marker_history = []
         self.marker_history_time = 2.0
 
+        self.window_scale = window_scale
+        self.max_window_misses = max_window_misses
+        self.window_miss_count = 0
+
+        self.detection_interval = detection_interval
+        self.max_flow_error = max_flow_error
+        self.frames_since_detection = 0
+        self.previous_image = None
+        self.previous_points = None
+
     def run_iteration(self):
 
         # Update marker history
@@ -26,7 +61,7 @@ class MarkerTracker(Reporter):
             self.marker_history.pop(0)
 
         # Get area image
-        area_image = self.board_area.area_image(snapshot_size=self.marker.preferred_input_image_resolution())
+        area_image = self.board_area.area_image(snapshot_size=self.tracking_resolution)
 
         # Check if we have a board area image
         if area_image is None:
@@ -34,8 +69,20 @@ class MarkerTracker(Reporter):
 
         #cv2.imwrite("test.png", area_image_bounded)
 
+        # Propagate marker with optical flow between detections
+        marker_result = None
+
+        if self.previous_points is not None and len(self.marker_history) > 0 and \
+                self.frames_since_detection + 1 < self.detection_interval:
+            grayscaled_area_image = self.board_area.grayscaled_area_image(snapshot_size=self.tracking_resolution)
+            marker_result = self.propagate_marker(grayscaled_area_image, self.marker_history[-1]["marker_result"])
+            self.frames_since_detection += 1
+
         # Find marker
-        marker_result = self.marker.find_marker_in_image(area_image)
+        if marker_result is None:
+            marker_result = self.detect_marker(area_image)
+            self.frames_since_detection = 0
+            self.start_propagation(marker_result)
 
         if marker_result is not None:
 
@@ -44,3 +91,174 @@ class MarkerTracker(Reporter):
 
             # Notify client
             self.callback_function(marker_result)
+
+    def detect_marker(self, area_image):
+        """
+        Detects the marker in a window around the last known position, or in the whole area if not recently found.
+
+        :param area_image: Area image in full resolution
+        :return: Marker result, or None if not found
+        """
+        if len(self.marker_history) > 0 and self.window_miss_count < self.max_window_misses:
+            marker_result = self.find_marker_in_window(area_image, self.marker_history[-1]["marker_result"])
+            self.window_miss_count = self.window_miss_count + 1 if marker_result is None else 0
+        else:
+            marker_result = self.find_marker_in_area(area_image)
+            self.window_miss_count = 0
+
+        if marker_result is not None:
+            marker_result["source"] = "detection"
+            marker_result["confidence"] = 1.0
+
+        return marker_result
+
+    def start_propagation(self, marker_result):
+        """
+        Remembers the contour points of the detected marker to propagate with optical flow in the following frames.
+
+        :param marker_result: Detected marker result, or None if not found
+        """
+        self.previous_image = None
+        self.previous_points = None
+
+        if self.detection_interval <= 1 or marker_result is None:
+            return
+
+        if marker_result.get("contour") is None or len(marker_result["contour"]) < 3:
+            return
+
+        self.previous_image = self.board_area.grayscaled_area_image(snapshot_size=self.tracking_resolution)
+        self.previous_points = np.float32(marker_result["contour"]).reshape(-1, 1, 2)
+
+    def propagate_marker(self, image, last_marker_result):
+        """
+        Propagates the last marker result to the given image by tracking its contour points with optical flow.
+
+        :param image: Grayscaled area image in full resolution
+        :param last_marker_result: Last marker result
+        :return: Marker result, or None if points could not be tracked reliably
+        """
+        if self.previous_image.shape != image.shape:
+            return None
+
+        # Track points
+        points, status, errors = cv2.calcOpticalFlowPyrLK(self.previous_image, image, self.previous_points, None,
+                                                          winSize=self.flow_window_size,
+                                                          maxLevel=self.flow_pyramid_levels)
+        if points is None or not status.all():
+            return None
+
+        flow_error = float(np.mean(errors))
+        if flow_error > self.max_flow_error:
+            return None
+
+        # Find movement of marker
+        transform = cv2.estimateRigidTransform(self.previous_points, points, False)
+        if transform is None:
+            return None
+
+        scale = math.sqrt((transform[0][0] ** 2) + (transform[1][0] ** 2))
+        rotation = math.atan2(transform[1][0], transform[0][0])
+
+        # Move marker
+        image_height, image_width = image.shape[:2]
+        center = np.dot(transform, [last_marker_result["x"] * image_width, last_marker_result["y"] * image_height, 1.0])
+
+        result = dict(last_marker_result)
+        result["x"] = center[0] / float(image_width)
+        result["y"] = center[1] / float(image_height)
+        result["width"] = last_marker_result["width"] * scale
+        result["height"] = last_marker_result["height"] * scale
+        result["angle"] = last_marker_result["angle"] + (rotation * 180.0 / math.pi)
+        result["contour"] = np.int32(points)
+        result["source"] = "flow"
+        result["confidence"] = 1.0 - (flow_error / self.max_flow_error) if self.max_flow_error > 0.0 else 0.0
+
+        self.previous_image = image
+        self.previous_points = points
+
+        return result
+
+    def find_marker_in_area(self, area_image):
+        """
+        Searches for the marker in the whole area image in the preferred resolution of the marker.
+
+        :param area_image: Area image in full resolution
+        :return: Marker result, or None if not found
+        """
+        image = self.board_area.preprocessed_area_image(snapshot_size=self.marker.preferred_input_image_resolution())
+        if image is None:
+            return None
+
+        # Share preprocessing and features with other reporters searching the area
+        marker_result = self.marker.find_marker_in_preprocessed_image(image)
+        if marker_result is None:
+            return None
+
+        area_height, area_width = area_image.shape[:2]
+        image_height, image_width = image.image.shape[:2]
+
+        return self.translate_marker_result(marker_result, (0, 0, area_width, area_height), (area_width, area_height),
+                                            scale=float(area_width) / float(image_width))
+
+    def find_marker_in_window(self, area_image, last_marker_result):
+        """
+        Searches for the marker in a window around the last known position.
+
+        :param area_image: Area image in full resolution
+        :param last_marker_result: Last known marker result
+        :return: Marker result, or None if not found
+        """
+        area_height, area_width = area_image.shape[:2]
+        window = self.search_window(last_marker_result, area_width, area_height)
+
+        marker_result = self.marker.find_marker_in_region(area_image, window)
+        if marker_result is None:
+            return None
+
+        return self.translate_marker_result(marker_result, window, (area_width, area_height))
+
+    def search_window(self, marker_result, area_width, area_height):
+        """
+        Calculates the search window centered at the marker, expanded by the window scale.
+
+        :param marker_result: Marker result
+        :param area_width: Area image width
+        :param area_height: Area image height
+        :return: Window (x1, y1, x2, y2) in area image
+        """
+        marker_size = max(marker_result["width"] * area_width, marker_result["height"] * area_height)
+        half_size = max(marker_size * self.window_scale, self.min_window_size) / 2.0
+
+        center_x = marker_result["x"] * area_width
+        center_y = marker_result["y"] * area_height
+
+        return (int(max(center_x - half_size, 0)),
+                int(max(center_y - half_size, 0)),
+                int(min(center_x + half_size, area_width)),
+                int(min(center_y + half_size, area_height)))
+
+    def translate_marker_result(self, marker_result, region, area_size, scale=1.0):
+        """
+        Converts a marker result found in a region of the area image into a result relative to the whole area image.
+
+        :param marker_result: Marker result relative to region
+        :param region: Searched region (x1, y1, x2, y2) in area image
+        :param area_size: Area image (width, height)
+        :param scale: Scale from pixels of searched image to pixels of area image
+        :return: Marker result relative to area image
+        """
+        region_width = float(region[2] - region[0])
+        region_height = float(region[3] - region[1])
+        area_width, area_height = float(area_size[0]), float(area_size[1])
+
+        result = dict(marker_result)
+        result["x"] = (region[0] + (marker_result["x"] * region_width)) / area_width
+        result["y"] = (region[1] + (marker_result["y"] * region_height)) / area_height
+        result["width"] = marker_result["width"] * region_width / area_width
+        result["height"] = marker_result["height"] * region_height / area_height
+
+        if result.get("contour") is not None:
+            result["contour"] = np.int32(np.float32(marker_result["contour"]) * scale + (region[0], region[1]))
+
+        return result
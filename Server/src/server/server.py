@@ -4,11 +4,12 @@ import json
 import time
 import cv2
 import globals
+import binary_protocol
 import base64
 import numpy as np
 from random import randint
-from threading import Thread
 from threading import Lock
+from multiprocessing.pool import ThreadPool
 from SimpleWebSocketServer import SimpleWebSocketServer, WebSocket
 from util import misc_util
 from board.markers.marker_util import *
@@ -16,14 +17,22 @@ from board.board_descriptor import BoardDescriptor
 from board.board_areas.board_area import BoardArea
 from board.board_areas.tiled_board_area import TiledBoardArea
 from board.markers.image_marker import ImageMarker
+from board.markers.feature_detection import feature_type_from_name
+from board.markers.feature_detection import is_feature_type_available
 from board.markers.haar_classifier_marker import HaarClassifierMarker
 from board.markers.shape_marker import ShapeMarker
+from board.markers.shape_marker_index import ShapeMarkerIndex
+from board.markers.image_marker_library import ImageMarkerLibrary
 from reporters.tiled_brick_position_reporter import TiledBrickPositionReporter
 from reporters.tiled_brick_moved_reporters import TiledBrickMovedToAnyOfPositionsReporter
 from reporters.tiled_brick_moved_reporters import TiledBrickMovedToPositionReporter
 from reporters.find_marker_reporter import FindMarkerReporter
 from reporters.find_markers_reporter import FindMarkersReporter
 from reporters.marker_tracker import MarkerTracker
+from pipeline import Pipeline
+from pipeline import PipelineItem
+from pipeline import PipelineStageStatistics
+from outbound_queue import OutboundQueue
 
 if misc_util.module_exists("picamera"):
     print("Using Raspberry Pi camera")
@@ -38,11 +47,23 @@ class Server(WebSocket):
     Server which communicates with the client library.
     """
     busy_lock = Lock()
+    action_pool = ThreadPool(processes=1)
+    coalesced_actions = ["markerTracked"]
 
     reporters = {}
-    reporter_thread = None
+    connections = []
+    pipeline = None
+    pipeline_connection = None
+    last_frame_sequence_number = 0
+    last_recognized_item = None
+    last_extracted_item = None
+    reporting_item = None
+    report_latencies = {}
+    board_recognized_time = None
 
     markers = {}
+    shape_marker_index = ShapeMarkerIndex()
+    image_marker_library = ImageMarkerLibrary()
 
     board_areas = {}
 
@@ -51,20 +72,34 @@ class Server(WebSocket):
         Handles incoming message.
         """
         try:
-            print("Got message: %s" % self.data)
+            if globals.debug:
+                print("Got message: %s" % self.data)
             json_dict = json.loads(self.data)
 
             if "action" in json_dict:
-                action = json_dict["action"]
+                self.action_pool.apply_async(self.run_action, (json_dict["action"], json_dict["payload"]))
 
-                with self.busy_lock:
-                    result = self.handle_action(action, json_dict["payload"])
+        except Exception, e:
+            print("Exception in handleMessage: %s" % str(e))
+            traceback.print_exc(file=sys.stdout)
+
+    def run_action(self, action, payload):
+        """
+        Runs the action and sends back the result. Is run by the action pool, so that vision work never blocks the
+        socket thread.
+
+        :param action: Action
+        :param payload: Payload
+        """
+        try:
+            with self.busy_lock:
+                result = self.handle_action(action, payload)
 
-                if result is not None:
-                    self.send_message(result=result[0], action=action, payload=result[1], request_id=result[2])
+            if result is not None:
+                self.send_message(result=result[0], action=action, payload=result[1], request_id=result[2])
 
         except Exception, e:
-            print("Exception in handleMessage: %s" % str(e))
+            print("Exception in run_action: %s" % str(e))
             traceback.print_exc(file=sys.stdout)
 
     def handle_action(self, action, payload):
@@ -100,6 +135,8 @@ class Server(WebSocket):
             return self.report_back_when_brick_moved_to_position(payload)
         if action == "requestBrickPosition":
             return self.request_brick_position(payload)
+        if action == "requestOccupancyMap":
+            return self.request_occupancy_map(payload)
         if action == "initializeShapeMarker":
             return self.initialize_shape_marker(payload)
         if action == "initializeImageMarker":
@@ -112,19 +149,67 @@ class Server(WebSocket):
             return self.report_back_when_marker_found(payload)
         if action == "startTrackingMarker":
             return self.start_tracking_marker(payload)
+        if action == "getStats":
+            return self.get_stats(payload)
+        if action == "setProtocol":
+            return self.set_protocol(payload)
 
-    def initialize_video(self, resolution):
+    def initialize_video(self, resolution, grayscale=False):
         if globals.camera is not None:
             return
 
         globals.camera = Camera()
-        globals.camera.start(resolution)
+        globals.camera.start(resolution, grayscale=grayscale)
+
+    def initialize_pipeline(self):
+        """
+        Starts the pipeline, unless already started. A single pipeline is shared by all connections and is run by the
+        connection which started it, which also receives the board recognition notifications.
+        """
+        if Server.pipeline is not None:
+            return
+
+        Server.board_recognized_time = time.time()
+
+        pipeline = Pipeline()
+        pipeline.add_source("capture", self.pipeline_function(Server.capture_frame))
+        pipeline.add_stage("frameChange", self.pipeline_function(Server.detect_frame_change))
+        pipeline.add_stage("boardRecognition", self.pipeline_function(Server.recognize_board))
+        pipeline.add_stage("areaExtraction", self.pipeline_function(Server.extract_board_areas))
+        pipeline.add_stage("reporters", self.pipeline_function(Server.run_reporters))
 
-    def initialize_reporter_thread(self):
-        if self.reporter_thread is None:
-            self.reporter_thread = Thread(target=self.reporter_run, args=())
-            self.reporter_thread.daemon = True
-            self.reporter_thread.start()
+        Server.pipeline = pipeline
+        Server.pipeline_connection = self
+
+        pipeline.start()
+
+    def pipeline_function(self, function):
+        """
+        Returns a pipeline function calling the given method on the connection currently running the pipeline.
+
+        :param function: Unbound method
+        :return: Pipeline function
+        """
+        return lambda *args: function(Server.pipeline_connection or self, *args)
+
+    def release_pipeline(self):
+        """
+        Hands the pipeline over to another connection, if run by this connection. Stops the pipeline if no other
+        connection is left.
+        """
+        with self.busy_lock:
+            if Server.pipeline_connection is not self:
+                return
+
+            # Hand over pipeline
+            if len(Server.connections) > 0:
+                Server.pipeline_connection = Server.connections[0]
+                return
+
+            # Stop pipeline
+            Server.pipeline.stop()
+            Server.pipeline = None
+            Server.pipeline_connection = None
 
     def reset(self, payload):
         """
@@ -132,18 +217,27 @@ class Server(WebSocket):
 
         requestId: (Optional) Request ID
         cameraResolution: (Optional) Camera resolution in [width, height]. Default: [640, 480].
+        frameChangeThreshold: (Optional) Maximum difference in gray levels for camera image to be considered unchanged, in which case board recognition is skipped. Null disables. Default: 12.
+        imageCacheSize: (Optional) Maximum size in bytes of the cache holding resized and grayscaled board and area images. Default: 32 MB.
+        grayscale: (Optional) Capture grayscaled camera images only, which saves color conversions when no markers depend on color. Takes effect when camera is first started. Default: false.
         """
         resolution = payload["resolution"] if "resolution" in payload else [640, 480]
 
+        globals.frame_change_detector.threshold = payload["frameChangeThreshold"] if "frameChangeThreshold" in payload else 12.0
+        globals.frame_change_detector.reset()
+
+        globals.image_cache.set_max_size(payload["imageCacheSize"] if "imageCacheSize" in payload else 32 * 1024 * 1024)
+        globals.image_cache.clear()
+
         globals.board_descriptor = BoardDescriptor()
         self.reset_board_descriptor()
 
-        self.initialize_reporter_thread()
+        self.initialize_pipeline()
         self.reset_reporters({})
         self.remove_board_areas({})
         self.remove_markers({})
 
-        self.initialize_video(resolution)
+        self.initialize_video(resolution, payload["grayscale"] if "grayscale" in payload else False)
 
         return "OK", {}, self.request_id_from_payload(payload)
 
@@ -154,6 +248,19 @@ class Server(WebSocket):
         globals.board_descriptor.board_size = [1280, 800]
         globals.board_descriptor.border_percentage_size = [0.0, 0.0]
 
+    def set_protocol(self, payload):
+        """
+        Sets the message protocol for this connection. Is normally sent by the client right after connecting.
+
+        requestId: (Optional) Request ID
+        binary: (Optional) Send brick and marker updates as binary messages instead of JSON. Default: false.
+        batchUpdates: (Optional) Send all updates from the same camera image in one message. Default: false.
+        """
+        self.binary_protocol = payload["binary"] if "binary" in payload else False
+        self.batch_updates = payload["batchUpdates"] if "batchUpdates" in payload else False
+
+        return "OK", {"binary": self.binary_protocol, "batchUpdates": self.batch_updates}, self.request_id_from_payload(payload)
+
     def enable_debug(self, payload):
         """
         Enables debug output.
@@ -187,6 +294,8 @@ class Server(WebSocket):
         requestId: (Optional) Request ID
         borderPercentage: (Optional) Border [width, height] in percentage of board size.
         cornerMarker: (Optional) Corner marker
+        lockCalibration: (Optional) If true, freeze board corners once found consistently and only verify them regularly. Default: False.
+        parallelCornerSearch: (Optional) If true, search for the four corner markers concurrently. Default: False.
         """
         globals.board_descriptor = BoardDescriptor()
         self.reset_board_descriptor()
@@ -197,6 +306,10 @@ class Server(WebSocket):
         ]
         globals.board_descriptor.corner_marker = create_marker_from_name(payload["cornerMarker"], marker_id=-1) if "cornerMarker" in payload else DefaultMarker(marker_id=-1)
 
+        globals.board_recognizer.calibration_lock_enabled = payload["lockCalibration"] if "lockCalibration" in payload else False
+        globals.board_recognizer.unlock_calibration()
+        globals.board_recognizer.parallel_marker_search = payload["parallelCornerSearch"] if "parallelCornerSearch" in payload else False
+
         return "OK", {}, self.request_id_from_payload(payload)
 
     def initialize_board_area(self, payload):
@@ -248,7 +361,7 @@ class Server(WebSocket):
 
         requestId: (Optional) Request ID
         """
-        self.board_areas = {}
+        self.board_areas.clear()
 
         return "OK", {}, self.request_id_from_payload(payload)
 
@@ -270,7 +383,9 @@ class Server(WebSocket):
 
         requestId: (Optional) Request ID
         """
-        self.markers = {}
+        self.markers.clear()
+        self.shape_marker_index.clear()
+        self.image_marker_library.clear()
 
         return "OK", {}, self.request_id_from_payload(payload)
 
@@ -283,6 +398,8 @@ class Server(WebSocket):
         """
         marker_id = payload["id"]
         del self.markers[marker_id]
+        self.shape_marker_index.remove(marker_id)
+        self.image_marker_library.remove(marker_id)
 
         return "OK", {}, self.request_id_from_payload(payload)
 
@@ -311,6 +428,7 @@ class Server(WebSocket):
                                                              payload={"id": reporter_id, "position": tile},
                                                              request_id=self.request_id_from_payload(payload)))
         self.reporters[reporter_id] = reporter
+        self.wake_reporter(reporter_id)
 
         return "OK", {"id": reporter_id}, None
 
@@ -342,6 +460,7 @@ class Server(WebSocket):
                                                              payload={"id": reporter_id, "position": tile, "initialPosition": initial_position},
                                                              request_id=self.request_id_from_payload(payload)))
         self.reporters[reporter_id] = reporter
+        self.wake_reporter(reporter_id)
 
         return "OK", {"id": reporter_id}, None
 
@@ -373,6 +492,7 @@ class Server(WebSocket):
                                                              payload={"id": reporter_id, "position": tile},
                                                              request_id=self.request_id_from_payload(payload)))
         self.reporters[reporter_id] = reporter
+        self.wake_reporter(reporter_id)
 
         return "OK", {"id": reporter_id}, None
 
@@ -385,12 +505,10 @@ class Server(WebSocket):
         areaId: Board area id
         validPositions: Positions to search for object in
         """
-        image = self.take_photo()
-
-        if image is None:
-            return "CAMERA_NOT_READY", {}
+        if globals.camera is None or globals.camera.read() is None:
+            return "CAMERA_NOT_READY", {}, self.request_id_from_payload(payload)
 
-        globals.board_descriptor.snapshot = globals.board_recognizer.find_board(image, globals.board_descriptor)
+        # Use most recent snapshot from pipeline
         if globals.board_descriptor.is_recognized():
             board_area = self.board_areas[payload["areaId"]]
             valid_positions = payload["validPositions"]
@@ -402,6 +520,28 @@ class Server(WebSocket):
         else:
             return "BOARD_NOT_RECOGNIZED", {}, self.request_id_from_payload(payload)
 
+    def request_occupancy_map(self, payload):
+        """
+        Returns the mean intensity and dark fraction of all tiles in the given tiled board area. Means are the tile
+        means the brick detector compares. Dark fractions are thresholded by the OTSU threshold of the whole area, and
+        are thus only an estimate of the dark fractions the brick detector finds among the tiles it searches.
+
+        requestId: (Optional) Request ID
+        areaId: Board area id
+        """
+        if not globals.board_descriptor.is_recognized():
+            return "BOARD_NOT_RECOGNIZED", {}, self.request_id_from_payload(payload)
+
+        board_area = self.board_areas[payload["areaId"]]
+        occupancy_map = board_area.occupancy_map()
+        if occupancy_map is None:
+            return "BOARD_NOT_RECOGNIZED", {}, self.request_id_from_payload(payload)
+
+        result = occupancy_map.to_dict()
+        result["areaId"] = payload["areaId"]
+
+        return "OK", result, self.request_id_from_payload(payload)
+
     def initialize_image_marker(self, payload):
         """
         Initializes image marker with given parameters.
@@ -410,15 +550,33 @@ class Server(WebSocket):
         markerId: Marker id
         imageBase64: Image as base 64 encoded PNG
         minMatches: (Optional)Minimum number of required matches
+        featureType: (Optional) Feature type, one of "SIFT", "ORB", "BRISK" and "AKAZE". Binary features (ORB, BRISK, AKAZE) are much faster than SIFT. AKAZE requires OpenCV 3. Default: "SIFT".
+        bruteForceMatching: (Optional) Match features by brute force instead of FLANN index. Default: false.
+        resolution: (Optional) Input image resolution, one of "EXTRA_SMALL" (320 px), "SMALL" (640 px), "MEDIUM" (800 px), "LARGE" (1200 px) and "ORIGINAL". Default: "LARGE".
+        maxInstances: (Optional) Maximum number of instances of the marker reported by requestMarkers. Default: 1.
         """
         raw_image = base64.b64decode(payload["imageBase64"])
         raw_bytes = np.asarray(bytearray(raw_image), dtype=np.uint8)
         image = cv2.imdecode(raw_bytes, cv2.CV_LOAD_IMAGE_UNCHANGED)
 
+        feature_type = feature_type_from_name(payload["featureType"] if "featureType" in payload else "SIFT")
+        if feature_type is None or not is_feature_type_available(feature_type):
+            return "FEATURE_TYPE_NOT_AVAILABLE", {}, self.request_id_from_payload(payload)
+
+        resolution = getattr(BoardDescriptor.SnapshotSize, payload["resolution"].upper(), None) if "resolution" in payload else BoardDescriptor.SnapshotSize.LARGE
+        if resolution is None:
+            return "RESOLUTION_NOT_AVAILABLE", {}, self.request_id_from_payload(payload)
+
         marker_id = payload["markerId"]
         min_matches = payload["minMatches"] if "minMatches" in payload else 8
-        image_marker = ImageMarker(marker_id, image, min_matches=min_matches)
+        image_marker = ImageMarker(marker_id, image,
+                                   min_matches=min_matches,
+                                   feature_type=feature_type,
+                                   brute_force_matching=payload["bruteForceMatching"] if "bruteForceMatching" in payload else False,
+                                   resolution=resolution,
+                                   max_instances=payload["maxInstances"] if "maxInstances" in payload else 1)
         self.markers[marker_id] = image_marker
+        self.image_marker_library.add(image_marker)
 
         return "OK", {"id": marker_id}, self.request_id_from_payload(payload)
 
@@ -429,10 +587,18 @@ class Server(WebSocket):
         requestId: (Optional) Request ID
         markerId: Marker id
         dataBase64: Base 64 encoded Haar Cascade Classifier data
+        minSize: (Optional) Minimum expected marker size in percentage [0..1] of smallest area image dimension. Default: None.
+        maxSize: (Optional) Maximum expected marker size in percentage [0..1] of smallest area image dimension. Default: None.
+        scaleFactor: (Optional) Scale factor between detection scales. Larger is faster but may miss markers. Default: 1.1.
+        regionSplit: (Optional) Number of regions [columns, rows] to split the area image into, searched in parallel threads. Default: [1, 1].
         """
         cascade_data = base64.b64decode(payload["dataBase64"])
         marker_id = payload["markerId"]
-        haar_classifier_marker = HaarClassifierMarker(marker_id, cascade_data)
+        haar_classifier_marker = HaarClassifierMarker(marker_id, cascade_data,
+                                                      min_size=payload["minSize"] if "minSize" in payload else None,
+                                                      max_size=payload["maxSize"] if "maxSize" in payload else None,
+                                                      scale_factor=payload["scaleFactor"] if "scaleFactor" in payload else 1.1,
+                                                      region_split=payload["regionSplit"] if "regionSplit" in payload else [1, 1])
         self.markers[marker_id] = haar_classifier_marker
 
         return "OK", {"id": marker_id}, self.request_id_from_payload(payload)
@@ -465,6 +631,7 @@ class Server(WebSocket):
                                        max_area=payload["maxArea"] if "maxArea" in payload else 0.9)
 
         self.markers[marker_id] = shape_marker
+        self.shape_marker_index.add(shape_marker)
 
         return "OK", {"id": marker_id}, self.request_id_from_payload(payload)
 
@@ -495,6 +662,7 @@ class Server(WebSocket):
                                                                           "marker": filter_out_contour_from_marker_result(marker)},
                                                                  request_id=self.request_id_from_payload(payload)))
         self.reporters[reporter_id] = reporter
+        self.wake_reporter(reporter_id)
 
         return "OK", {"id": reporter_id}, None
 
@@ -523,8 +691,10 @@ class Server(WebSocket):
                                                                  payload={"id": reporter_id,
                                                                           "areaId": payload["areaId"],
                                                                           "markers": filter_out_contour_from_marker_result_list(result)},
-                                                                 request_id=self.request_id_from_payload(payload)))
+                                                                 request_id=self.request_id_from_payload(payload)),
+            marker_indices=[self.shape_marker_index, self.image_marker_library])
         self.reporters[reporter_id] = reporter
+        self.wake_reporter(reporter_id)
 
         return "OK", {"id": reporter_id}, None
 
@@ -536,6 +706,10 @@ class Server(WebSocket):
         areaId: Board area id
         markerId: Marker id
         id: (Optional) Reporter id
+        windowScale: (Optional) Size of window around last known position to search for marker in, in multitudes of marker size. Default: 3.
+        maxWindowMisses: (Optional) Number of consecutive misses in window before searching the whole area. Default: 5.
+        detectionInterval: (Optional) Detect marker every n'th frame only, following it with optical flow in between. Default: 1.
+        maxFlowError: (Optional) Maximum mean optical flow error before detecting marker right away. Default: 10.
         """
         board_area = self.board_areas[payload["areaId"]]
         marker = self.markers[payload["markerId"]]
@@ -545,6 +719,10 @@ class Server(WebSocket):
             board_area,
             marker,
             reporter_id,
+            window_scale=payload["windowScale"] if "windowScale" in payload else 3.0,
+            max_window_misses=payload["maxWindowMisses"] if "maxWindowMisses" in payload else 5,
+            detection_interval=payload["detectionInterval"] if "detectionInterval" in payload else 1,
+            max_flow_error=payload["maxFlowError"] if "maxFlowError" in payload else 10.0,
             callback_function=lambda (marker): self.send_message(result="UPDATE",
                                                                  action="markerTracked",
                                                                  payload={"id": reporter_id,
@@ -552,6 +730,7 @@ class Server(WebSocket):
                                                                           "marker": filter_out_contour_from_marker_result(marker)},
                                                                  request_id=self.request_id_from_payload(payload)))
         self.reporters[reporter_id] = reporter
+        self.wake_reporter(reporter_id)
 
         return "OK", {"id": reporter_id}, None
 
@@ -578,6 +757,21 @@ class Server(WebSocket):
 
         return "OK", {}, self.request_id_from_payload(payload)
 
+    def get_stats(self, payload):
+        """
+        Returns processing statistics.
+
+        requestId: (Optional) Request ID
+        """
+        stats = {"pipeline": self.pipeline.statistics() if self.pipeline is not None else {},
+                 "frameChange": globals.frame_change_detector.statistics(),
+                 "thresholdModes": globals.board_recognizer.threshold_mode_statistics(),
+                 "imageCache": globals.image_cache.statistics(),
+                 "reportLatency": {action: statistics.to_dict() for (action, statistics) in self.report_latencies.copy().iteritems()},
+                 "outboundQueue": self.outbound_queue.statistics()}
+
+        return "OK", stats, self.request_id_from_payload(payload)
+
     def take_photo(self):
         """
         Returns the most recent photo from the camera.
@@ -609,7 +803,8 @@ class Server(WebSocket):
 
     def send_message(self, result, action, payload={}, request_id=None):
         """
-        Sends a new message to the client.
+        Queues a new message to the client. Continuous updates, fx. from marker tracking, replace any unsent update from
+        the same reporter and may be dropped if the client cannot keep up.
 
         :param result Result code
         :param action Client action from which the message originates
@@ -620,15 +815,91 @@ class Server(WebSocket):
                    "action": action,
                    "payload": payload,
                    "requestId": request_id if request_id is not None else self.random_id()}
-        self.sendMessage(json.dumps(message, ensure_ascii=False, encoding='utf8'))
 
-        print("Sent message: %s" % message)
+        self.record_report_latency(action)
+
+        # Collect updates from reporters until all reporters have run
+        if self.batch_updates and self.reporting_item is not None and result == "UPDATE":
+            self.pending_updates.append(message)
+            return
+
+        self.queue_messages([message])
+
+    def flush_updates(self):
+        """
+        Sends all updates collected while running the reporters.
+        """
+        messages = self.pending_updates
+        self.pending_updates = []
+
+        if len(messages) > 0:
+            self.queue_messages(messages)
+
+    def queue_messages(self, messages):
+        """
+        Encodes the messages and queues them for sending. In binary protocol brick and marker updates are encoded in a
+        single binary message. Remaining messages are sent as JSON, several at a time in an "updates" envelope.
+
+        :param messages: List of messages in form {"result", "action", "payload", "requestId"}
+        """
+        if globals.debug:
+            for message in messages:
+                print("Sent message: %s" % message)
+
+        # Binary messages
+        if self.binary_protocol:
+            binary_message, encoded_messages, messages = binary_protocol.encode_updates(messages)
+            if binary_message is not None:
+                self.outbound_queue.put(bytearray(binary_message), self.coalesce_key(encoded_messages))
+
+        # JSON messages
+        if len(messages) == 1:
+            message = messages[0]
+        elif len(messages) > 1:
+            message = {"result": "UPDATE",
+                       "action": "updates",
+                       "payload": {"updates": messages},
+                       "requestId": self.random_id()}
+        else:
+            return
+
+        # Always send JSON as unicode, so that it is sent as text and never mistaken for binary updates
+        json_message = json.dumps(message, ensure_ascii=False, encoding='utf8')
+        if isinstance(json_message, str):
+            json_message = json_message.decode('utf8')
+
+        self.outbound_queue.put(json_message, self.coalesce_key(messages))
+
+    def coalesce_key(self, messages):
+        """
+        Returns the key by which the outbound queue may replace or drop the messages. Messages are only droppable if
+        they are all continuous updates, fx. from marker tracking.
+
+        :param messages: List of messages
+        :return: Coalesce key, or None if messages must not be dropped
+        """
+        keys = []
+        for message in messages:
+            if message["action"] not in self.coalesced_actions or "id" not in message["payload"]:
+                return None
+            keys.append((message["action"], message["payload"]["id"]))
+        return tuple(keys)
 
     def handleConnected(self):
+        self.binary_protocol = False
+        self.batch_updates = False
+        self.pending_updates = []
+        self.outbound_queue = OutboundQueue(self.sendMessage)
+        self.outbound_queue.start()
+        Server.connections.append(self)
         print self.address, 'connected'
 
     def handleClose(self):
+        self.outbound_queue.stop()
         self.reset_reporters({})
+        if self in Server.connections:
+            Server.connections.remove(self)
+        self.release_pipeline()
         print self.address, 'closed'
 
     def random_id(self):
@@ -637,74 +908,189 @@ class Server(WebSocket):
             if reporter_id not in self.reporters:
                 return reporter_id
 
-    def reporter_run(self):
-        board_recognized_time = time.time()
+    def capture_frame(self):
+        """
+        Pipeline source. Waits for the next image from the camera.
 
-        while True:
+        :return: Pipeline item, or None if no new image is available
+        """
+
+        # Wait for camera to be started
+        if globals.camera is None:
+            time.sleep(0.1)
+            return None
+
+        frame = globals.camera.read_next(self.last_frame_sequence_number, timeout=0.1)
+        if frame is None:
+            return None
+
+        Server.last_frame_sequence_number = frame.sequence_number
+
+        return PipelineItem(frame, globals.board_descriptor)
+
+    def detect_frame_change(self, item):
+        """
+        Pipeline stage. Checks whether the captured image has changed since the last processed image.
+
+        :param item: Pipeline item
+        :return: Pipeline item
+        """
+        item.thumbnail = globals.frame_change_detector.thumbnail(item.image)
+        item.changed = globals.frame_change_detector.has_changed(item.thumbnail)
+        return item
+
+    def recognize_board(self, item):
+        """
+        Pipeline stage. Recognizes the board in the captured image. If the image has not changed since the last
+        processed image the previous board snapshot is reused, keeping all images cached in it. Otherwise the image is
+        copied out of the frame buffer before recognizing the board, so a slow recognition is never discarded.
+
+        :param item: Pipeline item
+        :return: Pipeline item with board snapshot
+        """
+        if item.board_descriptor is None:
+            return None
+
+        last_item = self.last_recognized_item
+
+        if not item.changed and last_item is not None and last_item.board_descriptor is item.board_descriptor:
+            item.snapshot = last_item.snapshot
+        else:
+
+            # Copy image, as the camera overwrites the frame buffer slot while the board is being recognized
+            image = item.image.copy()
 
-            # Sleep a while
-            time.sleep(0.01)
+            # Camera has overwritten the image before it was copied
+            if not globals.camera.frame_buffer.is_valid(item.frame):
+                return None
 
-            try:
-                # Read image from camera
-                if globals.camera is None:
-                    continue
+            item.image = image
+            item.snapshot = globals.board_recognizer.find_board(image, item.board_descriptor)
 
-                image = globals.camera.read()
-                if image is None:
-                    continue
+            # Compare following images with this one
+            globals.frame_change_detector.set_processed(item.thumbnail)
 
-                # Do all in a lock to force sequential execution of handleMessage above
-                with self.busy_lock:
+        Server.last_recognized_item = item
+        return item
 
-                    # Recognize board
-                    if globals.board_descriptor is not None:
-                        globals.board_descriptor.snapshot = globals.board_recognizer.find_board(image, globals.board_descriptor)
+    def extract_board_areas(self, item):
+        """
+        Pipeline stage. Publishes the board snapshot and updates the board areas.
+
+        :param item: Pipeline item
+        :return: Pipeline item
+        """
+
+        # Lock in order to force sequential execution of handleMessage above
+        with self.busy_lock:
+
+            # Board has been reinitialized since image was captured
+            if item.board_descriptor is not globals.board_descriptor:
+                return None
+
+            globals.board_descriptor.snapshot = item.snapshot
+
+            # Board not recognized
+            if not globals.board_descriptor.is_recognized():
+
+                # Notify client that board is not recognized
+                if self.board_recognized_time is not None and time.time() > self.board_recognized_time + globals.board_not_recognized_notify_delay:
+                    self.notify_board_not_recognized(globals.board_descriptor.snapshot)
+                    Server.board_recognized_time = None
+
+                return None
+
+            # Notify client that board is recognized
+            if self.board_recognized_time is None:
+                self.notify_board_recognized()
+
+            Server.board_recognized_time = time.time()
+
+            # Update board areas
+            for (_, board_area) in self.board_areas.copy().iteritems():
+                board_area.update_stability_score()
+
+            Server.last_extracted_item = item
+
+        return item
+
+    def run_reporters(self, item):
+        """
+        Pipeline stage. Runs all reporters on the most recent board snapshot.
 
-                        # Board not recognized
-                        if not globals.board_descriptor.is_recognized():
+        :param item: Pipeline item
+        """
+
+        # Lock in order to force sequential execution of handleMessage above
+        with self.busy_lock:
+
+            # Board has been reinitialized since image was captured
+            if item.board_descriptor is not globals.board_descriptor:
+                return None
+
+            # Run all reporters
+            reporter_ids_to_remove = []
 
-                            # Notify client that board is not recognized
-                            if board_recognized_time is not None and time.time() > board_recognized_time + globals.board_not_recognized_notify_delay:
-                                self.notify_board_not_recognized(globals.board_descriptor.snapshot)
-                                board_recognized_time = None
+            for (reporter_id, reporter) in self.reporters.copy().iteritems():
 
-                            #cv2.imwrite("board.png", image)
-                        else:
+                # Run reporter
+                Server.reporting_item = item
+                try:
+                    reporter.run_iteration()
+                finally:
+                    Server.reporting_item = None
 
-                            #cv2.imwrite("board.png", globals.board_descriptor.snapshot.board_image())
+                # Check if stopped
+                if reporter.stopped:
+                    reporter_ids_to_remove.append(reporter_id)
 
-                            # Notify client that board is recognized
-                            if board_recognized_time is None:
-                                self.notify_board_recognized()
+            # Send updates from all reporters, batched per connection
+            for connection in list(Server.connections):
+                connection.flush_updates()
+
+            # Remove stopped reporters
+            for reporter_id in reporter_ids_to_remove:
+                self.reporters.pop(reporter_id)
+
+        return None
+
+    def wake_reporter(self, reporter_id):
+        """
+        Runs the newly registered reporter on the most recent board snapshot right away instead of waiting for the next
+        camera image. Only the new reporter is run, so the other reporters never report the same snapshot twice.
 
-                            board_recognized_time = time.time()
+        :param reporter_id: Reporter ID
+        """
 
-                    # Update board areas
-                    if globals.board_descriptor.is_recognized():
+        # Check that the most recent snapshot is of the current board
+        if self.last_extracted_item is None or self.last_extracted_item.board_descriptor is not globals.board_descriptor:
+            return
 
-                        for (_, board_area) in self.board_areas.copy().iteritems():
-                            board_area.update_stability_score()
+        reporter = self.reporters[reporter_id]
 
-                    # Run all reporters
-                    reporter_ids_to_remove = []
+        try:
+            reporter.run_iteration()
+        except Exception, e:
+            print("Exception in reporter %s: %s" % (str(reporter_id), str(e)))
+            traceback.print_exc(file=sys.stdout)
 
-                    for (reporter_id, reporter) in self.reporters.copy().iteritems():
+        # Remove reporter if done
+        if reporter.stopped:
+            self.reporters.pop(reporter_id, None)
 
-                        # Run reporter
-                        reporter.run_iteration()
+    def record_report_latency(self, action):
+        """
+        Records the time from capturing the camera image to reporting back a result found in it.
 
-                        # Check if stopped
-                        if reporter.stopped:
-                            reporter_ids_to_remove.append(reporter_id)
+        :param action: Client action of the report
+        """
+        if self.reporting_item is None:
+            return
 
-                    # Remove stopped reporters
-                    for reporter_id in reporter_ids_to_remove:
-                        self.reporters.pop(reporter_id)
+        if action not in self.report_latencies:
+            self.report_latencies[action] = PipelineStageStatistics()
 
-            except Exception, e:
-                print("Exception in reporter loop: %s" % str(e))
-                traceback.print_exc(file=sys.stdout)
+        self.report_latencies[action].add_processed(time.time() - self.reporting_item.capture_time)
 
     def request_id_from_payload(self, payload):
         """
@@ -4,4 +4,7 @@ import board.test as test
 #test.board_detector_test()
 #test.custom_test()
 test.shape_marker_test()
+#test.shape_marker_index_test()
+#test.image_marker_benchmark()
+#test.image_marker_instances_test()
 #test.shape_marker_camera_test()
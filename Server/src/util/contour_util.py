@@ -1,13 +1,11 @@
 import cv2
 import numpy as np
 import math
-import misc_math
 
 
 def contour_center(contour):
-    contour_length = len(contour)
-    return (sum([p[0][0] for p in contour]) / float(contour_length),
-            sum([p[0][1] for p in contour]) / float(contour_length))
+    center = contour_points(contour).mean(axis=0)
+    return float(center[0]), float(center[1])
 
 
 def contour_angle(contour, reference_point, center_point=None):
@@ -23,6 +21,10 @@ def simplify_contour(contour, lookahead_length=8, image=None):
     """
     Simplifies the given contour, honoring corners.
 
+    The direction vectors between all points and the points lookahead length further ahead are calculated at once.
+    From each added point, the next point to add is then found with a single vectorized comparison against the
+    comparison vector, so the loop only runs once per point in the simplified contour.
+
     :param contour: Contour to simplify
     :param lookahead_length: Index length to look ahead on contour
     :return: Simplified contour
@@ -38,57 +40,113 @@ def simplify_contour(contour, lookahead_length=8, image=None):
     # Add first point to contour
     result_contour = [contour[0][0]]
 
-    # Simplify contour
-    comparison_vector = None
+    if contour_length <= lookahead_length:
+        return np.int32(result_contour).reshape(-1, 1, 2)
 
+    # Calculate direction vectors
+    points = contour_points(contour)
+    direction_vectors = points[lookahead_length:] - points[:contour_length - lookahead_length]
+    direction_vector_lengths = np.sqrt((direction_vectors ** 2).sum(axis=1))
+
+    # Simplify contour
     i = 0
     comparison_end_point_index = lookahead_length
 
-    while i < len(contour) - lookahead_length:
+    while i < contour_length - lookahead_length:
 
-        # Extract line points
-        pt1 = contour[i][0]
-        pt2 = contour[(i + lookahead_length) % contour_length][0]
+        # Calculate new comparison vector
+        comparison_vector = points[comparison_end_point_index] - points[i]
 
-        # Calculate direction vector
-        direction_vector = pt2 - pt1
+        # Make comparison vector same length as direction vector
+        length = math.sqrt((comparison_vector ** 2).sum())
+        if length > 0.0:
+            comparison_vector = comparison_vector * direction_vector_lengths[i] / length
 
-        # Just added point - reset comparison (initial) vector
-        if comparison_vector is None:
+        # Find first line differing from comparison vector
+        deviations = np.sqrt(((direction_vectors[i:] - comparison_vector) ** 2).sum(axis=1))
+        deviating_indices = np.flatnonzero(deviations > max_deviation)
 
-            # Calculate new comparison vector
-            comparison_vector = contour[comparison_end_point_index][0] - contour[i][0]
+        if len(deviating_indices) == 0:
+            break
 
-            # Make comparison vector same length as direction vector
-            length = misc_math.line_length([0.0, 0.0], comparison_vector)
-            if length > 0.0:
-                comparison_vector = comparison_vector * misc_math.line_length([0.0, 0.0], direction_vector) / length
+        i += deviating_indices[0]
 
-        # Check line difference from comparison vector
-        if misc_math.line_length(direction_vector, comparison_vector) > max_deviation:
-
-            # Add point to line
-            result_contour.append(contour[(i + half_lookahead_length) % contour_length][0])
-
-            # Move forward on contour
-            comparison_end_point_index = i + lookahead_length
-            i += half_lookahead_length
-
-            # Reset comparison vector
-            comparison_vector = None
+        # Add point to line
+        result_contour.append(contour[(i + half_lookahead_length) % contour_length][0])
 
         # Draw progress
         if image is not None:
-            draw_image = draw_contour(image=image, contour=np.int32([pt1, pt2]).reshape(-1, 1, 2), name="Progress")
+            draw_image = draw_contour(image=image, contour=np.int32([points[i], points[i + lookahead_length]]).reshape(-1, 1, 2), name="Progress")
             draw_image = draw_points(scaled_image=draw_image, points=result_contour, scale=3, name="Progress")
             cv2.waitKey(0)
 
-        i += 1
+        # Move forward on contour
+        comparison_end_point_index = i + lookahead_length
+        i += half_lookahead_length + 1
 
     # Return result contour
     return np.int32(result_contour).reshape(-1, 1, 2)
 
 
+def contour_points(contour):
+    """
+    Returns the points of the contour as floats.
+
+    :param contour: Contour
+    :return: Array of shape (n, 2)
+    """
+    return np.float64(contour).reshape(-1, 2)
+
+
+def edge_lengths(contour):
+    """
+    Calculates the length of each edge of the closed contour, that is, from point i to point i + 1.
+
+    :param contour: Contour
+    :return: Array of edge lengths
+    """
+    points = contour_points(contour)
+    return np.sqrt(((np.roll(points, -1, axis=0) - points) ** 2).sum(axis=1))
+
+
+def cumulative_arc_lengths(contour):
+    """
+    Calculates the arc length from the first point to each point of the closed contour. The last element is the
+    length of the whole closed contour.
+
+    :param contour: Contour
+    :return: Array of n + 1 arc lengths
+    """
+    return np.concatenate(([0.0], np.cumsum(edge_lengths(contour))))
+
+
+def pairwise_distances(contour):
+    """
+    Calculates the distances between all pairs of points of the contour.
+
+    :param contour: Contour
+    :return: Array of shape (n, n), where element [a, b] is the distance from point a to point b
+    """
+    deltas = pairwise_deltas(contour)
+    return np.sqrt((deltas ** 2).sum(axis=2))
+
+
+def pairwise_headings(contour):
+    """
+    Calculates the headings between all pairs of points of the contour.
+
+    :param contour: Contour
+    :return: Array of shape (n, n), where element [a, b] is the angle of the vector from point a to point b
+    """
+    deltas = pairwise_deltas(contour)
+    return np.arctan2(deltas[:, :, 1], deltas[:, :, 0])
+
+
+def pairwise_deltas(contour):
+    points = contour_points(contour)
+    return points[np.newaxis, :, :] - points[:, np.newaxis, :]
+
+
 def draw_contour(image=None, scaled_image=None, contour=None, scale=3, contour_color=(255, 0, 255), points_color=None, line_width=2, name="Contour"):
     scaled_contour = contour * scale
 
@@ -0,0 +1,26 @@
+import cv2
+
+
+def is_grayscaled(image):
+    """
+    Checks whether the image has a single channel.
+
+    :param image: Image
+    :return: True, if image is grayscaled, else false
+    """
+    return len(image.shape) == 2 or image.shape[2] == 1
+
+
+def grayscaled_image(image):
+    """
+    Returns the image in grayscale. Grayscaled images are returned as is without copying.
+
+    :param image: Grayscaled, BGR or BGRA image
+    :return: Grayscaled image
+    """
+    if is_grayscaled(image):
+        return image
+    elif image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    else:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)